@@ -1,32 +1,94 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import cv2
 import numpy as np
 import os
 from datetime import datetime
 import requests
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from pymongo import MongoClient, IndexModel, UpdateOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, OperationFailure, BulkWriteError
 from bson import ObjectId, Binary
 import pickle
 import time
 import threading
 import json
-from collections import deque
+from collections import deque, namedtuple, OrderedDict
+from contextlib import contextmanager
 import secrets
+import atexit
+import io
+import tempfile
+import multiprocessing
+from multiprocessing import shared_memory
+import zlib
+import gzip
+import hashlib
+import sqlite3
+import struct
 from datetime import timedelta
 
-import subprocess
 import sys
 
 try:
-    import mediapipe as mp
+    from flask_sock import Sock
 except ImportError:
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "mediapipe"])
-    import mediapipe as mp
+    Sock = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def json_default(value):
+    """Types the JSON encoders do not handle on their own"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Response JSON through orjson when it is installed (datetime and numpy natively,
+    ObjectId via json_default), otherwise the stdlib encoder with the same conversions.
+    datetimes are ISO 8601 either way, like the .isoformat() strings built by hand.
+    Output is always compact, debug mode included.
+    """
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self._orjson_dumps(obj).decode()
+        kwargs.setdefault('default', json_default)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def _orjson_dumps(self, obj):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=json_default, option=option)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is not None:
+            body = self._orjson_dumps(obj)
+        else:
+            body = self.dumps(obj, separators=(',', ':')) + '\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
 
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # MongoDB Configuration
@@ -43,46 +105,587 @@ registered_faces = set()
 # In-memory storage for UFM data (for testing without database)
 ufm_storage = []
 
-# Simple in-memory session store for teacher tokens (token -> {username, expires_at})
-teacher_sessions = {}
-TEACHER_SESSION_TTL = timedelta(hours=4)
+# Inference engines (object detector, MediaPipe) are never loaded at import time.
+# ENGINE_LOADING selects when they are:
+#   background  start loading every engine on a daemon thread once the module is imported (default)
+#   lazy        load each engine on its first request (or when /ready is polled)
+#   eager       load everything before the module finishes importing
+# Each engine runs a warm-up pass on a synthetic frame before it reports ready. Requests
+# that need an engine still loading wait up to ENGINE_WAIT_TIMEOUT_S, then get a 503.
+ENGINE_LOADING = os.environ.get('ENGINE_LOADING', 'background')
+ENGINE_WAIT_TIMEOUT_S = float(os.environ.get('ENGINE_WAIT_TIMEOUT_S', 60))
+# With MODEL_OFFLINE=1 model files are only resolved from disk: no hub downloads,
+# pretrained fallbacks or requirement auto-installs
+MODEL_OFFLINE = os.environ.get('MODEL_OFFLINE', '0') == '1'
+MODEL_DIR = os.environ.get('MODEL_DIR') or os.path.dirname(os.path.abspath(__file__))
+ENGINE_STATES = ('pending', 'loading', 'ready', 'unavailable')
+# Inference worker processes (0 = run inference in the web process, see InferenceWorkerPool)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+INFERENCE_WORKER_PREFIX = 'inference-worker'
+# Inside a worker the engines are loaded locally and no pool of its own is started
+IN_INFERENCE_WORKER = multiprocessing.current_process().name.startswith(INFERENCE_WORKER_PREFIX)
+USE_INFERENCE_WORKERS = INFERENCE_WORKERS > 0 and not IN_INFERENCE_WORKER
 
-# Thread-safe queue for streaming audio anomaly events (SSE)
-audio_event_queue = deque()
-audio_queue_lock = threading.Lock()
-MAX_AUDIO_QUEUE = 200
+class ModelEngine:
+    """
+    One inference engine, loaded at most once: the loader and then a warm-up pass run
+    on a background thread. Request handlers call wait(), which also starts loading
+    if nothing has yet, and returns True only once the engine is ready.
+    """
+    def __init__(self, name, loader, warmup=None):
+        self.name = name
+        self._loader = loader
+        self._warmup = warmup
+        self._cond = threading.Condition()
+        self.state = 'pending'
+        self.error = None
+        self.load_ms = None
+        self.warmup_ms = None
 
-# Load YOLOv5 model for object detection (cell phone, laptop, etc.)
-print("Loading YOLO model for object detection...")
-try:
+    def start(self):
+        """Begin loading in the background (no-op once started)"""
+        with self._cond:
+            if self.state != 'pending':
+                return
+            self.state = 'loading'
+        threading.Thread(target=self._load, name=f'{self.name}-loader', daemon=True).start()
+
+    def _load(self):
+        state, error = 'ready', None
+        started = time.perf_counter()
+        try:
+            self._loader()
+            loaded = time.perf_counter()
+            self.load_ms = (loaded - started) * 1000.0
+            if self._warmup is not None:
+                self._warmup()
+                self.warmup_ms = (time.perf_counter() - loaded) * 1000.0
+            print(f"✓ {self.name} engine ready (load {self.load_ms:.0f} ms, warm-up {self.warmup_ms or 0:.0f} ms)")
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            print(f"✗ {self.name} engine unavailable: {error}")
+            state = 'unavailable'
+        with self._cond:
+            self.state, self.error = state, error
+            self._cond.notify_all()
+
+    def wait(self, timeout=ENGINE_WAIT_TIMEOUT_S):
+        """Block until the engine is loaded; True if it is ready to serve"""
+        self.start()
+        with self._cond:
+            self._cond.wait_for(lambda: self.state in ('ready', 'unavailable'), timeout)
+            return self.state == 'ready'
+
+    def reset_after_fork(self):
+        # A loader thread does not survive fork(); the child loads the engine itself
+        self._cond = threading.Condition()
+        if self.state == 'loading':
+            self.state = 'pending'
+
+    def status(self):
+        with self._cond:
+            return {
+                'state': self.state,
+                'error': self.error,
+                'load_ms': self.load_ms,
+                'warmup_ms': self.warmup_ms
+            }
+
+# Filled in by each engine section below, in load order
+engines = OrderedDict()
+
+def start_engines():
+    for engine in engines.values():
+        engine.start()
+
+def resolve_model_path(path):
+    """Local path for a model file: as given if it exists, else under MODEL_DIR; None if missing"""
+    for candidate in (path, os.path.join(MODEL_DIR, path)):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+# Synthetic frame used to warm engines up (mid-grey, typical webcam size)
+WARMUP_FRAME = np.full((480, 640, 3), 114, dtype=np.uint8)
+
+# Object detection backend (cell phone, laptop, etc.), picked by DETECTOR_BACKEND:
+#   torch        YOLOv5 through torch.hub (default)
+#   onnxruntime  the ONNX export of DETECTOR_WEIGHTS on ONNX Runtime's CPU provider
+#   opencv       a batch-1 copy of that export on cv2.dnn, with no extra dependencies
+# The ONNX files are exported from the .pt weights into MODEL_DIR ahead of time with
+# `python app.py export-detector [--int8] [--opencv]`; until they exist the detector engine
+# is unavailable. DETECTOR_INT8=1 runs the dynamically quantized (INT8 weights) copy
+# instead; that is only supported on onnxruntime.
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'torch')
+DETECTOR_WEIGHTS = os.environ.get('DETECTOR_WEIGHTS', 'yolov5n.pt')  # Nano model for faster inference
+DETECTOR_ONNX_PATH = os.environ.get('DETECTOR_ONNX_PATH') or os.path.splitext(DETECTOR_WEIGHTS)[0] + '.onnx'
+DETECTOR_INT8 = os.environ.get('DETECTOR_INT8', '0') == '1'
+DETECTOR_THREADS = int(os.environ.get('DETECTOR_THREADS', 0))  # 0 = runtime default
+DETECTOR_IMAGE_SIZE = 640
+# (h, w) the ONNX models are exported at. OpenCV DNN cannot run dynamic spatial axes, and
+# for 4:3 webcam frames this is the same letterboxed shape AutoShape picks on the torch path,
+# so detections match torch exactly. Wider landscape frames (16:9) get extra padding and stay
+# close (boxes within a few pixels); portrait and square frames are letterboxed to a different
+# shape than torch's and their detections can differ noticeably.
+DETECTOR_INPUT_SHAPE = (480, 640)
+DETECTOR_CONF_THRESHOLD = 0.4  # Confidence threshold (lower to detect more objects)
+DETECTOR_IOU_THRESHOLD = 0.45  # IoU threshold for NMS
+DETECTOR_MAX_DET = 10  # Maximum detections per image
+DETECTOR_STRIDE = 32
+DETECTOR_MAX_WH = 7680  # Box offset per class so NMS never suppresses across classes
+
+def yolov5_repo_dir():
+    """Local checkout of the ultralytics/yolov5 hub repo (YOLOV5_REPO_DIR or the torch.hub cache), if any"""
     import torch
-    # Try to load custom trained model first, fallback to pretrained
-    model_path = 'yolov5n.pt'  # Use the nano model for faster inference
-    if os.path.exists(model_path):
-        model = torch.hub.load('ultralytics/yolov5', 'custom', path=model_path, force_reload=False)
-        print(f"✓ Loaded custom YOLOv5 model from {model_path}")
+    repo_dir = os.environ.get('YOLOV5_REPO_DIR') or os.path.join(torch.hub.get_dir(), 'ultralytics_yolov5_master')
+    return repo_dir if os.path.isdir(repo_dir) else None
+
+def load_torch_yolo(weights=DETECTOR_WEIGHTS):
+    """
+    YOLOv5 AutoShape model from torch.hub: the custom weights if present, else pretrained yolov5n.
+    A local copy of the hub repo is loaded with source='local', which skips GitHub entirely.
+    """
+    import torch
+    if MODEL_OFFLINE:
+        # Stop the hub code from pip-installing missing requirements
+        os.environ['YOLOv5_AUTOINSTALL'] = 'false'
+    repo_dir = yolov5_repo_dir()
+    if repo_dir is not None:
+        repo, source = repo_dir, 'local'
+    elif MODEL_OFFLINE:
+        raise FileNotFoundError('MODEL_OFFLINE is set but no local yolov5 hub repo was found (set YOLOV5_REPO_DIR)')
+    else:
+        repo, source = 'ultralytics/yolov5', 'github'
+
+    weights_path = resolve_model_path(weights)
+    if weights_path is not None:
+        hub_model = torch.hub.load(repo, 'custom', path=weights_path, source=source, force_reload=False)
+        print(f"✓ Loaded custom YOLOv5 model from {weights_path}")
+    elif MODEL_OFFLINE:
+        raise FileNotFoundError(f"MODEL_OFFLINE is set and {weights} was not found (looked in . and {MODEL_DIR})")
     else:
         # Fallback to pretrained model
-        model = torch.hub.load('ultralytics/yolov5', 'yolov5n', pretrained=True, force_reload=False)
+        hub_model = torch.hub.load(repo, 'yolov5n', pretrained=True, source=source, force_reload=False)
         print("✓ Loaded pretrained YOLOv5n model")
-    
-    # Set model confidence threshold
-    model.conf = 0.4  # Confidence threshold (lower to detect more objects)
-    model.iou = 0.45  # IoU threshold for NMS
-    model.max_det = 10  # Maximum detections per image
-    
-    YOLO_AVAILABLE = True
-    print("✓ YOLO model loaded successfully for cell phone detection")
-except Exception as e:
-    print(f"✗ Failed to load YOLO model: {e}")
-    print("  Cell phone/laptop detection will not be available")
-    YOLO_AVAILABLE = False
-    model = None
-
-# Face Recognition Model (LBPH)
-face_recognizer = None
+    return hub_model
+
+class TorchDetector:
+    """
+    torch.hub YOLOv5 backend. Every backend is called with a list of RGB frames and
+    returns one (n, 6) [x1, y1, x2, y2, confidence, class] float array per frame.
+    """
+    backend = 'torch'
+
+    def __init__(self, hub_model, conf=DETECTOR_CONF_THRESHOLD, iou=DETECTOR_IOU_THRESHOLD, max_det=DETECTOR_MAX_DET):
+        self.model = hub_model
+        self.model.conf = conf
+        self.model.iou = iou
+        self.model.max_det = max_det
+        self.names = hub_model.names
+
+    def __call__(self, images):
+        results = self.model(images, size=DETECTOR_IMAGE_SIZE)
+        return [detections.cpu().numpy() for detections in results.xyxy]
+
+def letterbox(image, shape, color=(114, 114, 114)):
+    """Resize keeping aspect ratio and pad to shape (h, w), as YOLOv5 does; returns (image, gain, (pad_x, pad_y))"""
+    h, w = image.shape[:2]
+    gain = min(shape[0] / h, shape[1] / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    pad_x, pad_y = (shape[1] - new_w) / 2, (shape[0] - new_h) / 2
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, gain, (pad_x, pad_y)
+
+def nms_boxes(boxes, scores, iou_threshold, max_det):
+    """Greedy non-maximum suppression over (n, 4) xyxy boxes; returns kept indices by descending score"""
+    order = np.argsort(-scores, kind='stable')
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size and len(keep) < max_det:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        x1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+class OnnxYoloDetector:
+    """
+    Base for backends running the ONNX export of YOLOv5. The pre- and post-processing
+    reproduce torch.hub's AutoShape so detections match the torch backend: frames are
+    letterboxed into DETECTOR_INPUT_SHAPE, then confidence filtering, class-aware NMS
+    and box rescaling are done in NumPy. The match is exact for 4:3 frames only (see
+    DETECTOR_INPUT_SHAPE). Subclasses implement _forward.
+    """
+    backend = None
+
+    def __init__(self, onnx_path, conf=DETECTOR_CONF_THRESHOLD, iou=DETECTOR_IOU_THRESHOLD, max_det=DETECTOR_MAX_DET):
+        self.onnx_path = onnx_path
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+        self.names = read_onnx_class_names(onnx_path)
+
+    def _forward(self, batch):
+        """(b, 3, h, w) float32 batch -> (b, anchors, 5 + classes) raw predictions"""
+        raise NotImplementedError
+
+    def __call__(self, images):
+        padded, transforms = [], []
+        for image in images:
+            boxed, gain, pad = letterbox(image[..., :3], DETECTOR_INPUT_SHAPE)
+            padded.append(boxed)
+            transforms.append((gain, pad, image.shape[:2]))
+        batch = np.ascontiguousarray(np.stack(padded).transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+        predictions = self._forward(batch)
+        return [self._postprocess(pred, *transform) for pred, transform in zip(predictions, transforms)]
+
+    def _postprocess(self, pred, gain, pad, image_shape):
+        pred = pred[pred[:, 4] > self.conf]
+        scores = pred[:, 5:] * pred[:, 4:5]
+        class_ids = scores.argmax(axis=1)
+        conf = scores[np.arange(len(scores)), class_ids]
+        keep = conf > self.conf
+        pred, conf, class_ids = pred[keep], conf[keep], class_ids[keep]
+        if not len(pred):
+            return np.zeros((0, 6), dtype=np.float32)
+
+        # xywh -> xyxy
+        boxes = np.empty((len(pred), 4), dtype=np.float32)
+        boxes[:, :2] = pred[:, :2] - pred[:, 2:4] / 2
+        boxes[:, 2:] = pred[:, :2] + pred[:, 2:4] / 2
+        keep = nms_boxes(boxes + class_ids[:, None] * DETECTOR_MAX_WH, conf, self.iou, self.max_det)
+        boxes, conf, class_ids = boxes[keep], conf[keep], class_ids[keep]
+
+        # Undo the letterbox
+        boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad[0]) / gain, 0, image_shape[1])
+        boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad[1]) / gain, 0, image_shape[0])
+        return np.column_stack([boxes, conf, class_ids]).astype(np.float32)
+
+class OnnxRuntimeDetector(OnnxYoloDetector):
+    """ONNX Runtime CPU backend"""
+    backend = 'onnxruntime'
+
+    def __init__(self, onnx_path, **kwargs):
+        import onnxruntime as ort
+        super().__init__(onnx_path, **kwargs)
+        options = ort.SessionOptions()
+        if DETECTOR_THREADS > 0:
+            options.intra_op_num_threads = DETECTOR_THREADS
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _forward(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class OpenCVDnnDetector(OnnxYoloDetector):
+    """
+    cv2.dnn backend. OpenCV's importer needs fully static shapes, so the model has a
+    fixed batch of 1 and frames are run one at a time (only ever from the batching thread).
+    """
+    backend = 'opencv'
+
+    def __init__(self, onnx_path, **kwargs):
+        super().__init__(onnx_path, **kwargs)
+        self.net = cv2.dnn.readNetFromONNX(onnx_path)
+        if DETECTOR_THREADS > 0:
+            cv2.setNumThreads(DETECTOR_THREADS)
+
+    def _forward(self, batch):
+        predictions = []
+        for blob in batch:
+            self.net.setInput(blob[None])
+            predictions.append(self.net.forward()[0])
+        return predictions
+
+def read_onnx_class_names(onnx_path):
+    """Class names stored in the ONNX metadata by export_detector_onnx ({} if unreadable)"""
+    try:
+        import onnx
+        metadata = {prop.key: prop.value for prop in onnx.load(onnx_path, load_external_data=False).metadata_props}
+        return {int(k): v for k, v in json.loads(metadata['names']).items()}
+    except Exception:
+        return {}
+
+def int8_model_path(onnx_path):
+    return os.path.splitext(onnx_path)[0] + '-int8.onnx'
+
+def batch1_model_path(onnx_path):
+    return os.path.splitext(onnx_path)[0] + '-b1.onnx'
+
+def fold_onnx_constants(onnx_path):
+    """
+    Rewrite the model in place with ONNX Runtime's basic graph optimizations, which only
+    emit standard ONNX ops. This constant-folds the shape arithmetic the exporter leaves
+    around Upsample and the Detect grids; OpenCV's ONNX importer cannot parse it.
+    """
+    import onnxruntime as ort
+    folded_path = onnx_path + '.folded'
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    options.optimized_model_filepath = folded_path
+    ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+    os.replace(folded_path, onnx_path)
+
+@contextmanager
+def replaced_atomically(path):
+    """
+    Temporary file next to path that is moved over it with os.replace once the block
+    succeeds, so a reader never loads a half-written model
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def export_detector_onnx(weights=DETECTOR_WEIGHTS, onnx_path=DETECTOR_ONNX_PATH, int8=False, hub_model=None, batch_size=None):
+    """
+    Export the YOLOv5 weights to ONNX at DETECTOR_INPUT_SHAPE with the class names in the
+    model metadata. The batch axis is dynamic unless batch_size is given (OpenCV DNN needs 1).
+    With int8=True also write a dynamically quantized copy next to it
+    (onnxruntime.quantization). onnxruntime is needed to export for OpenCV, see
+    fold_onnx_constants. Returns the path of the model to load.
+    """
+    import copy
+    import torch
+    import onnx
+    hub_model = hub_model or load_torch_yolo(weights)
+    # AutoShape -> DetectMultiBackend -> DetectionModel (already fused); copied so the
+    # export flags below never touch a model that is still serving the torch backend
+    net = copy.deepcopy(hub_model.model.model).float().cpu().eval()
+    for module in net.modules():
+        if hasattr(module, 'anchor_grid') and hasattr(module, 'export'):
+            # Detect head: return only the concatenated (batch, anchors, 5 + classes) predictions
+            module.inplace = False
+            module.export = True
+
+    dummy = torch.zeros(batch_size or 1, 3, *DETECTOR_INPUT_SHAPE)
+    names = hub_model.names if isinstance(hub_model.names, dict) else dict(enumerate(hub_model.names))
+    with replaced_atomically(onnx_path) as tmp_path:
+        torch.onnx.export(
+            net, dummy, tmp_path,
+            opset_version=12,
+            do_constant_folding=True,
+            input_names=['images'],
+            output_names=['output0'],
+            dynamic_axes=None if batch_size else {'images': {0: 'batch'}, 'output0': {0: 'batch'}},
+            dynamo=False
+        )
+        try:
+            fold_onnx_constants(tmp_path)
+        except ImportError:
+            if batch_size:
+                raise
+            print("ℹ onnxruntime not installed - exported graph left unfolded")
+
+        proto = onnx.load(tmp_path)
+        for key, value in (('names', json.dumps({str(k): v for k, v in names.items()})), ('stride', str(DETECTOR_STRIDE))):
+            prop = proto.metadata_props.add()
+            prop.key, prop.value = key, value
+        onnx.save(proto, tmp_path)
+    print(f"✓ Exported {weights} to {onnx_path}")
+
+    if not int8:
+        return onnx_path
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantized_path = int8_model_path(onnx_path)
+    with replaced_atomically(quantized_path) as tmp_path:
+        quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QUInt8)
+    print(f"✓ Wrote INT8 dynamically quantized model to {quantized_path}")
+    return quantized_path
+
+def load_detector(backend=DETECTOR_BACKEND):
+    """Build the configured detector backend; the ONNX backends need `export-detector` to have run"""
+    if backend == 'torch':
+        return TorchDetector(load_torch_yolo())
+    if backend not in ('onnxruntime', 'opencv'):
+        raise ValueError(f"Unknown DETECTOR_BACKEND '{backend}' (expected torch, onnxruntime or opencv)")
+
+    int8 = DETECTOR_INT8 and backend == 'onnxruntime'
+    if DETECTOR_INT8 and not int8:
+        print("ℹ DETECTOR_INT8 is only supported on onnxruntime - using the FP32 model")
+    batch_size = 1 if backend == 'opencv' else None
+    onnx_path = batch1_model_path(DETECTOR_ONNX_PATH) if batch_size else DETECTOR_ONNX_PATH
+    path = resolve_model_path(int8_model_path(onnx_path) if int8 else onnx_path)
+    if path is None:
+        # Never exported here: it is slow, and every worker would race to write the same file
+        flags = ' --int8' if int8 else ' --opencv' if batch_size else ''
+        raise FileNotFoundError(
+            f"{int8_model_path(onnx_path) if int8 else onnx_path} not found in {MODEL_DIR} - "
+            f"run `python app.py export-detector{flags}` first"
+        )
+    detector_class = OnnxRuntimeDetector if backend == 'onnxruntime' else OpenCVDnnDetector
+    print(f"✓ Loaded {path} on {backend}")
+    return detector_class(path)
+
+# Set by the detector engine once loaded
+detector = None
+detector_class_names = None
+yolo_scheduler = None
+
+# Micro-batching for YOLO inference: frames from concurrent requests are
+# collected for up to YOLO_BATCH_MAX_WAIT_MS (or YOLO_BATCH_MAX_SIZE frames)
+# and run through the model in one batched forward pass
+YOLO_BATCH_MAX_SIZE = int(os.environ.get('YOLO_BATCH_MAX_SIZE', 8))
+YOLO_BATCH_MAX_WAIT_MS = float(os.environ.get('YOLO_BATCH_MAX_WAIT_MS', 10))
+YOLO_BATCH_TIMEOUT_S = 30
+
+class YoloBatchScheduler:
+    """
+    Inference scheduler that batches frames across concurrent requests.
+    Request threads call submit() and block until their frame's detections
+    are ready; a single background thread owns every call into the model.
+    """
+    def __init__(self, yolo_detector, max_batch_size=8, max_wait_ms=10.0):
+        self.model = yolo_detector
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        # Counters reported by /inference-stats
+        self._batches_run = 0
+        self._frames_processed = 0
+        self._largest_batch = 0
+        self._total_queue_wait = 0.0
+        self._total_inference_time = 0.0
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='yolo-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, rgb, timeout=YOLO_BATCH_TIMEOUT_S):
+        """Queue one RGB frame and wait for its (n, 6) detections array"""
+        job = {
+            'image': rgb,
+            'event': threading.Event(),
+            'result': None,
+            'error': None,
+            'enqueued_at': time.monotonic()
+        }
+        with self._cond:
+            self._ensure_worker()
+            self._pending.append(job)
+            self._cond.notify()
+
+        if not job['event'].wait(timeout):
+            raise TimeoutError('Timed out waiting for batched YOLO inference')
+        if job['error'] is not None:
+            raise job['error']
+        return job['result']
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Wait for the batch to fill, but never longer than max_wait after
+            # the oldest queued frame arrived
+            deadline = self._pending[0]['enqueued_at'] + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch_size = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(batch_size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            try:
+                results = self.model([job['image'] for job in batch])
+                # One (n, 6) [x1, y1, x2, y2, confidence, class] array per image
+                for job, detections in zip(batch, results):
+                    job['result'] = detections
+            except Exception as e:
+                print(f"Batched YOLO inference error: {e}")
+                for job in batch:
+                    job['error'] = e
+            finally:
+                finished = time.monotonic()
+                with self._cond:
+                    self._batches_run += 1
+                    self._frames_processed += len(batch)
+                    self._largest_batch = max(self._largest_batch, len(batch))
+                    self._total_queue_wait += sum(started - job['enqueued_at'] for job in batch)
+                    self._total_inference_time += finished - started
+                for job in batch:
+                    job['event'].set()
+
+    def stats(self):
+        with self._cond:
+            batches = self._batches_run
+            frames = self._frames_processed
+            return {
+                'backend': self.model.backend,
+                'queue_depth': len(self._pending),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches_run': batches,
+                'frames_processed': frames,
+                'largest_batch': self._largest_batch,
+                'avg_batch_size': (frames / batches) if batches else 0.0,
+                'avg_queue_wait_ms': (self._total_queue_wait / frames * 1000.0) if frames else 0.0,
+                'avg_batch_inference_ms': (self._total_inference_time / batches * 1000.0) if batches else 0.0
+            }
+
+def load_detector_engine():
+    global detector, detector_class_names, yolo_scheduler
+    if USE_INFERENCE_WORKERS:
+        # The workers own the model (and warm it up); only the label map is needed here
+        inference_pool.require('detector')
+        detector_class_names = inference_pool.worker_status['detector_names']
+        return
+    print(f"Loading YOLO model for object detection ({DETECTOR_BACKEND} backend)...")
+    detector = load_detector()
+    detector_class_names = detector.names
+    yolo_scheduler = YoloBatchScheduler(detector, YOLO_BATCH_MAX_SIZE, YOLO_BATCH_MAX_WAIT_MS)
+
+def warm_up_detector():
+    # Runs outside the scheduler: nothing else can reach the detector until it is ready
+    detector([cv2.cvtColor(WARMUP_FRAME, cv2.COLOR_BGR2RGB)])
+
+detector_engine = engines['detector'] = ModelEngine(
+    'detector', load_detector_engine, None if USE_INFERENCE_WORKERS else warm_up_detector
+)
+
+# Face Recognition Model (LBPH histograms matched by face_gallery)
+# Set once init_face_recognizer has loaded the persisted model; face endpoints answer 503 before
+face_gallery_loaded = False
 face_labels = {}  # {roll_number: label_id}
 label_counter = 0
+# Guards face_labels, label_counter and gallery swaps across request threads
+face_model_lock = threading.RLock()
+
+# Preprocessed 200x200 face ROIs by (roll_number, exam_id), also persisted as
+# registered_faces.roi_data so enrollment and compaction never re-extract them
+face_roi_cache = {}
+FACE_ROI_SIZE = (200, 200)
+
+# Seconds to wait after an enrollment before persisting the model, so bursts of
+# registrations are written to MongoDB once
+FACE_MODEL_SAVE_DELAY_S = float(os.environ.get('FACE_MODEL_SAVE_DELAY_S', 5))
+face_model_save_timer = None
+face_model_compaction_thread = None
+# Enrollments made while a compaction runs, as (histograms, labels); re-applied after its
+# gallery swap so they are not wiped by it. None when no compaction is running.
+face_compaction_journal = None
 
 def get_mongo_client():
     """Create and return MongoDB client"""
@@ -119,45 +722,1147 @@ def get_db_connection():
         print(f"✗ Database connection error: {e}")
         return None
 
+# Write-behind pipeline for alert documents: handlers enqueue and return, a
+# background thread flushes with insert_many(ordered=False) once
+# ALERT_WRITER_BATCH_SIZE documents are queued or the oldest has waited
+# ALERT_WRITER_FLUSH_MS. When the queue is full, ALERT_WRITER_OVERFLOW picks the policy:
+#   block       - wait up to ALERT_WRITER_BLOCK_MS for room, then drop the new alert
+#   drop_oldest - evict the oldest queued alert
+#   drop_newest - reject the new alert
+ALERT_WRITER_BATCH_SIZE = int(os.environ.get('ALERT_WRITER_BATCH_SIZE', 200))
+ALERT_WRITER_FLUSH_MS = float(os.environ.get('ALERT_WRITER_FLUSH_MS', 250))
+ALERT_WRITER_MAX_QUEUE = int(os.environ.get('ALERT_WRITER_MAX_QUEUE', 10000))
+ALERT_WRITER_OVERFLOW = os.environ.get('ALERT_WRITER_OVERFLOW', 'block')
+ALERT_WRITER_BLOCK_MS = float(os.environ.get('ALERT_WRITER_BLOCK_MS', 50))
+ALERT_WRITER_MAX_RETRIES = 5
+ALERT_WRITER_DRAIN_TIMEOUT_S = 10
+# Collections whose writes get updated_at set as they are written (/alerts?since= follows it)
+CHANGE_STAMPED_COLLECTIONS = ('alerts',)
+
+def stamp_updated_at(entries):
+    now = datetime.now()
+    for entry in entries:
+        if 'doc' in entry:
+            entry['doc']['updated_at'] = now
+        else:
+            filter_doc, update, upsert = entry['update']
+            update = dict(update, **{'$set': dict(update.get('$set') or {}, updated_at=now)})
+            entry['update'] = (filter_doc, update, upsert)
+
+class AlertWriter:
+    """
+    Bounded write-behind queue for alert documents. Request threads call submit()
+    (inserts) or submit_update() (updates to documents queued earlier); a single
+    background thread owns every write. Critical documents (terminations, UFM marks)
+    are never dropped and may exceed the queue bound.
+    """
+    def __init__(self, batch_size=200, flush_ms=250.0, max_queue=10000,
+                 overflow='block', block_ms=50.0, max_retries=5):
+        if overflow not in ('block', 'drop_oldest', 'drop_newest'):
+            raise ValueError(f"Unknown alert writer overflow policy: {overflow}")
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.overflow = overflow
+        self.block_timeout = max(0.0, float(block_ms)) / 1000.0
+        self.max_retries = max_retries
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._in_flight = 0
+        # Counters reported by /inference-stats
+        self._enqueued = 0
+        self._written = 0
+        self._batches = 0
+        self._retries = 0
+        self._dropped_full = 0
+        self._dropped_failed = 0
+        self._last_error = None
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='alert-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, collection_name, doc, critical=False):
+        """Queue one document for insertion; False if the overflow policy dropped it"""
+        return self._enqueue({'collection': collection_name, 'doc': doc}, critical)
+
+    def submit_update(self, collection_name, filter_doc, update, critical=False, upsert=False):
+        """Queue an update; within a collection it is applied after every insert queued before it"""
+        return self._enqueue({'collection': collection_name, 'update': (filter_doc, update, upsert)}, critical)
+
+    def _enqueue(self, entry, critical):
+        entry.update(attempts=0, enqueued_at=time.monotonic())
+        with self._cond:
+            if not self._stopping:
+                return self._append(entry, critical)
+            self._enqueued += 1
+        # Shutting down: the worker may already be gone, so write inline, outside the
+        # lock so stats() and other producers do not wait on the database
+        retry = self._write([entry])
+        if retry:
+            with self._cond:
+                self._dropped_failed += len(retry)
+        return not retry
+
+    def _append(self, entry, critical):
+        """Queue entry under the overflow policy; the caller holds self._cond"""
+        if not critical and len(self._pending) >= self.max_queue:
+            if self.overflow == 'block':
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._pending) >= self.max_queue:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if len(self._pending) >= self.max_queue:
+                self._dropped_full += 1
+                if self.overflow != 'drop_oldest':
+                    return False
+                self._pending.popleft()
+        self._ensure_worker()
+        self._pending.append(entry)
+        self._enqueued += 1
+        self._cond.notify_all()
+        return True
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            if self._pending and not self._stopping:
+                # Flush on size, or once the oldest queued alert has waited flush_interval
+                deadline = self._pending[0]['enqueued_at'] + self.flush_interval
+                while len(self._pending) < self.batch_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            batch_size = min(len(self._pending), self.batch_size)
+            batch = [self._pending.popleft() for _ in range(batch_size)]
+            self._in_flight += len(batch)
+            # Wake producers blocked on a full queue
+            self._cond.notify_all()
+            return batch
+
+    def _write(self, batch):
+        """
+        Write a batch grouped by collection: inserts via insert_many, then updates via
+        bulk_write, so an update never overtakes the insert it targets. Returns entries
+        that should be retried.
+        """
+        database = get_db_connection()
+        if database is None:
+            self._last_error = 'Database connection failed'
+            return batch
+        by_collection = OrderedDict()
+        for entry in batch:
+            by_collection.setdefault(entry['collection'], []).append(entry)
+        retry = []
+        touched = set()
+        for collection_name, entries in by_collection.items():
+            collection = database[collection_name]
+            if collection_name in CHANGE_STAMPED_COLLECTIONS:
+                stamp_updated_at(entries)
+            inserts = [entry for entry in entries if 'doc' in entry]
+            updates = [entry for entry in entries if 'update' in entry]
+            try:
+                if inserts:
+                    try:
+                        collection.insert_many([entry['doc'] for entry in inserts], ordered=False)
+                    except BulkWriteError as e:
+                        # Duplicate keys mean an earlier attempt already landed
+                        self._record_write_errors(collection_name, e, ignore_codes=(11000,))
+                    self._written += len(inserts)
+                    touched.update(data_version_scopes(collection_name, inserts))
+                    inserts = []
+                if updates:
+                    try:
+                        collection.bulk_write([UpdateOne(*entry['update']) for entry in updates], ordered=False)
+                    except BulkWriteError as e:
+                        self._record_write_errors(collection_name, e)
+                    self._written += len(updates)
+                    touched.update(data_version_scopes(collection_name, updates))
+            except Exception as e:
+                self._last_error = str(e)
+                retry.extend(inserts + updates)
+        # Only after the writes landed, so a reader never pairs a new tag with old data
+        data_versions.bump(touched)
+        return retry
+
+    def _record_write_errors(self, collection_name, error, ignore_codes=()):
+        """Per-document failures are not retried; count them as dropped"""
+        errors = [err for err in error.details.get('writeErrors', []) if err.get('code') not in ignore_codes]
+        if errors:
+            self._written -= len(errors)
+            self._dropped_failed += len(errors)
+            self._last_error = errors[0].get('errmsg')
+            print(f"✗ Alert writer dropped {len(errors)} {collection_name} writes: {self._last_error}")
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            retry = self._write(batch)
+            with self._cond:
+                self._batches += 1
+                requeue, failed = [], 0
+                for entry in retry:
+                    entry['attempts'] += 1
+                    if entry['attempts'] > self.max_retries:
+                        failed += 1
+                    else:
+                        requeue.append(entry)
+                self._retries += len(requeue)
+                self._dropped_failed += failed
+                # Retried alerts go back to the front to keep insertion order
+                self._pending.extendleft(reversed(requeue))
+                self._in_flight -= len(batch)
+                self._cond.notify_all()
+            if failed:
+                print(f"✗ Alert writer gave up on {failed} documents: {self._last_error}")
+            if retry:
+                # Back off while the database is unreachable
+                attempts = max(entry['attempts'] for entry in retry)
+                time.sleep(min(0.1 * (2 ** attempts), 5.0))
+
+    def flush(self, timeout=ALERT_WRITER_DRAIN_TIMEOUT_S):
+        """Block until everything queued so far has been written (or timeout); True if drained"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def drain(self, timeout=ALERT_WRITER_DRAIN_TIMEOUT_S):
+        """Flush what is queued and stop the worker (registered with atexit)"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        with self._cond:
+            # Anything the worker did not get to is written inline
+            remaining = list(self._pending)
+            self._pending.clear()
+        if remaining:
+            retry = self._write(remaining)
+            self._dropped_failed += len(retry)
+            if retry:
+                print(f"✗ Alert writer lost {len(retry)} documents on shutdown: {self._last_error}")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queue_depth': len(self._pending),
+                'in_flight': self._in_flight,
+                'max_queue': self.max_queue,
+                'overflow_policy': self.overflow,
+                'batch_size': self.batch_size,
+                'flush_ms': self.flush_interval * 1000.0,
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'batches': self._batches,
+                'avg_batch_size': (self._written / self._batches) if self._batches else 0.0,
+                'retries': self._retries,
+                'dropped_queue_full': self._dropped_full,
+                'dropped_write_failed': self._dropped_failed,
+                'last_error': self._last_error
+            }
+
+alert_writer = AlertWriter(
+    ALERT_WRITER_BATCH_SIZE, ALERT_WRITER_FLUSH_MS, ALERT_WRITER_MAX_QUEUE,
+    ALERT_WRITER_OVERFLOW, ALERT_WRITER_BLOCK_MS, ALERT_WRITER_MAX_RETRIES
+)
+atexit.register(alert_writer.drain)
+
+# Conditional GET for the polled read endpoints (/alerts, /api/ufm/<exam_id>,
+# /api/exam/<exam_id>/summary): every write to a versioned collection bumps a counter
+# for its scope ('alerts', 'alerts:<exam_id>', or 'alerts:?' when the write does not
+# name an exam), and the response ETag is built from the counters the endpoint depends
+# on plus the query string. A poll whose If-None-Match still matches gets a 304 before
+# anything is queried or serialized.
+VERSIONED_COLLECTIONS = {'alerts': 'alerts', 'alert_rollups': 'alerts', 'unfair_means': 'ufm'}
+
+def version_scope(family, exam_id=None):
+    return f"{family}:{exam_id}" if exam_id else f"{family}:?"
+
+def data_version_scopes(collection_name, entries):
+    """Version scopes touched by a batch of AlertWriter entries for one collection"""
+    family = VERSIONED_COLLECTIONS.get(collection_name)
+    if family is None or not entries:
+        return set()
+    scopes = {family}
+    for entry in entries:
+        if 'doc' in entry:
+            doc = entry['doc']
+        else:
+            filter_doc, update, _ = entry['update']
+            doc = dict(update.get('$setOnInsert') or {}, **filter_doc)
+        details = doc.get('details') if isinstance(doc.get('details'), dict) else {}
+        exam_id = doc.get('exam_id') or details.get('exam_id')
+        scopes.add(version_scope(family, exam_id if isinstance(exam_id, str) else None))
+    return scopes
+
+class DataVersions:
+    """
+    Write counters behind the read endpoints' ETags. They live in the data_versions
+    collection so every web and worker process agrees on them (in process memory while
+    MongoDB is unreachable). Each counter document carries a random epoch, so counters
+    restarting after a wiped database never reproduce an old tag.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = {}
+        self.epoch = secrets.token_hex(4)
+        # Counters reported by /inference-stats
+        self._bumps = 0
+        self._checks = 0
+        self._not_modified = 0
+        self._last_error = None
+
+    def bump(self, scopes):
+        scopes = sorted(set(scopes))
+        if not scopes:
+            return
+        database = get_db_connection()
+        with self._lock:
+            self._bumps += 1
+            if database is None:
+                for scope in scopes:
+                    self._local[scope] = self._local.get(scope, 0) + 1
+                return
+        try:
+            database.data_versions.bulk_write([
+                UpdateOne({'_id': scope}, {'$inc': {'v': 1}, '$setOnInsert': {'epoch': secrets.token_hex(4)}}, upsert=True)
+                for scope in scopes
+            ], ordered=False)
+        except Exception as e:
+            self._last_error = str(e)
+            print(f"✗ Data version bump failed for {', '.join(scopes)}: {e}")
+
+    def tokens(self, scopes):
+        """Current token per scope, or None when they cannot be read (serve without an ETag)"""
+        database = get_db_connection()
+        if database is None:
+            with self._lock:
+                return [f"{self.epoch}.{self._local.get(scope, 0)}" for scope in scopes]
+        try:
+            docs = {doc['_id']: doc for doc in database.data_versions.find({'_id': {'$in': list(scopes)}})}
+        except Exception as e:
+            self._last_error = str(e)
+            return None
+        return [f"{docs[scope]['epoch']}.{docs[scope]['v']}" if scope in docs else '0' for scope in scopes]
+
+    def not_modified(self, etag):
+        """A 304 for a request whose If-None-Match holds etag, else None"""
+        with self._lock:
+            self._checks += 1
+        if etag is None or not request.if_none_match.contains_weak(etag):
+            return None
+        with self._lock:
+            self._not_modified += 1
+        return with_etag(app.response_class(status=304), etag)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bumps': self._bumps,
+                'conditional_requests': self._checks,
+                'not_modified': self._not_modified,
+                'hit_rate': (self._not_modified / self._checks) if self._checks else 0.0,
+                'last_error': self._last_error
+            }
+
+data_versions = DataVersions()
+
+def request_etag(tokens):
+    """ETag for the current request from its version tokens (None disables caching)"""
+    if tokens is None:
+        return None
+    return '-'.join(list(tokens) + [f"{zlib.crc32(request.query_string):08x}"])
+
+def with_etag(response, etag):
+    """Attach etag to a successful response; clients must revalidate before reuse"""
+    if etag is not None and response.status_code in (200, 304):
+        # Weak: the same representation may go out gzip- or brotli-encoded
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# JSON bodies of at least COMPRESS_MIN_BYTES are compressed for clients that accept
+# it: brotli when the module is installed and the client prefers it, otherwise gzip
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+
+@app.after_request
+def _compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+        encoding, body = 'br', brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    elif accepted['gzip']:
+        encoding, body = 'gzip', gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# Real-time events for SSE clients: a ring buffer of the last EVENT_HUB_BUFFER_SIZE
+# sequence-numbered events that every subscriber reads with its own cursor
+EVENT_HUB_BUFFER_SIZE = int(os.environ.get('EVENT_HUB_BUFFER_SIZE', 1000))
+EVENT_HUB_HEARTBEAT_S = float(os.environ.get('EVENT_HUB_HEARTBEAT_S', 15))
+EVENT_TYPES = ('head', 'object', 'audio', 'exam_alert', 'termination', 'ufm')
+
+class EventHub:
+    """
+    Broadcast publish/subscribe hub. publish() appends to the ring buffer and wakes
+    waiting subscribers; each subscriber tracks the last sequence id it has seen, so
+    every connection receives every event and can resume via Last-Event-ID.
+    """
+    def __init__(self, buffer_size=1000):
+        self._events = deque(maxlen=max(1, int(buffer_size)))
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._subscribers = 0
+        self._published = 0
+
+    def publish(self, event_type, payload):
+        """Serialize once and broadcast; returns the event's sequence id"""
+        data = json.dumps(payload, default=str)
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event_type, payload.get('student_id'), payload.get('exam_id'), data))
+            self._published += 1
+            self._cond.notify_all()
+            return self._seq
+
+    @property
+    def latest_seq(self):
+        with self._cond:
+            return self._seq
+
+    def resume_point(self, last_event_id):
+        """Cursor to resume from; ids from before a restart (or garbage) start at the live edge"""
+        with self._cond:
+            try:
+                seq = int(last_event_id)
+            except (TypeError, ValueError):
+                return self._seq
+            return seq if 0 <= seq <= self._seq else self._seq
+
+    def wait_for(self, after_seq, timeout, types=None, student_id=None, exam_id=None):
+        """
+        Events newer than after_seq matching the filters, waiting up to timeout for one.
+        Returns (events, cursor) where cursor is the new position even if everything was filtered out.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                matched = []
+                if self._seq > after_seq:
+                    # Walk back from the newest event so the cost is O(new events)
+                    for seq, event_type, event_student, event_exam, data in reversed(self._events):
+                        if seq <= after_seq:
+                            break
+                        if types and event_type not in types:
+                            continue
+                        if student_id and event_student != student_id:
+                            continue
+                        if exam_id and event_exam != exam_id:
+                            continue
+                        matched.append((seq, event_type, data))
+                    matched.reverse()
+                    after_seq = self._seq
+                    if matched:
+                        return matched, after_seq
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return matched, after_seq
+                self._cond.wait(remaining)
+
+    def discard(self, exam_id, student_id=None):
+        """
+        Drop the buffered events of one exam (or one student in it); returns how many.
+        Sequence ids keep increasing, so other subscribers resume exactly where they were.
+        """
+        with self._cond:
+            kept = [event for event in self._events
+                    if not (event[3] == exam_id and (student_id is None or event[2] == student_id))]
+            dropped = len(self._events) - len(kept)
+            if dropped:
+                self._events = deque(kept, maxlen=self._events.maxlen)
+            return dropped
+
+    @contextmanager
+    def subscription(self):
+        with self._cond:
+            self._subscribers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'latest_seq': self._seq,
+                'buffered': len(self._events),
+                'buffer_size': self._events.maxlen,
+                'published': self._published,
+                'subscribers': self._subscribers
+            }
+
+event_hub = EventHub(EVENT_HUB_BUFFER_SIZE)
+
+def sse_response(types=None, student_id=None, exam_id=None, include_type=False):
+    """Stream hub events as Server-Sent Events, resuming after Last-Event-ID if given"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    cursor = event_hub.resume_point(last_event_id)
+    
+    def event_stream(cursor):
+        with event_hub.subscription():
+            # Reconnect delay hint for EventSource
+            yield "retry: 3000\n\n"
+            while True:
+                events, cursor = event_hub.wait_for(cursor, EVENT_HUB_HEARTBEAT_S, types, student_id, exam_id)
+                if not events:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+                for seq, event_type, data in events:
+                    if include_type:
+                        yield f"id: {seq}\nevent: {event_type}\ndata: {data}\n\n"
+                    else:
+                        yield f"id: {seq}\ndata: {data}\n\n"
+    
+    response = app.response_class(event_stream(cursor), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Alert coalescing: consecutive repeats of the same alert (same exam, student and coalesce
+# key) arriving within ALERT_COALESCE_GAP_S of each other are folded into the alerts
+# document of that run instead of adding a row; any other alert of the student in between
+# ends the run. The run document keeps the first
+# occurrence's fields (alert_time is when the run started) and is upserted through the
+# alert writer with $inc count and $max last_seen / peak_severity, so every repeat costs
+# one small update. ALERT_COALESCE_GAP_S=0 turns coalescing off; ALERT_EVENT_LOG=1 also
+# keeps every occurrence in alert_events, each pointing at its run via run_id.
+ALERT_COALESCE_GAP_S = float(os.environ.get('ALERT_COALESCE_GAP_S', 30))
+ALERT_EVENT_LOG = os.environ.get('ALERT_EVENT_LOG', '0') == '1'
+ALERT_RUN_FIELDS = ('count', 'first_seen', 'last_seen', 'peak_severity', 'updated_at')
+
+class AlertCoalescer:
+    """
+    The open alert run of each (exam_id, student_id): its coalesce key, id, first document
+    and last-seen time. An alert with a different key replaces it with a new run, so only
+    consecutive repeats are folded; runs idle for longer than the gap are swept.
+    """
+    def __init__(self, gap_s):
+        self.gap = max(0.0, float(gap_s))
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._last_sweep = time.monotonic()
+        self._runs_opened = 0
+        self._folded = 0
+
+    def record(self, doc, key, severity=None):
+        """Start a run with doc or fold it into the open one; returns (queued, run_id)"""
+        now = time.monotonic()
+        seen = doc.get('alert_time') or datetime.now()
+        run_key = self._run_key(doc)
+        with self._lock:
+            run = self._runs.get(run_key)
+            if run is None or run['key'] != key or now - run['last'] > self.gap:
+                base = {k: v for k, v in doc.items() if k != '_id' and k not in ALERT_RUN_FIELDS}
+                base['first_seen'] = seen
+                run = self._runs[run_key] = {'key': key, 'id': ObjectId(), 'base': base, 'last': now}
+                self._runs_opened += 1
+            else:
+                run['last'] = now
+                self._folded += 1
+            if now - self._last_sweep >= self.gap:
+                self._sweep(now)
+            run_id, base = run['id'], run['base']
+
+        # Every write carries the run's first document, so whichever lands first creates it
+        update = {'$setOnInsert': base, '$inc': {'count': 1}, '$max': {'last_seen': seen}}
+        if severity is not None:
+            update['$max']['peak_severity'] = float(severity)
+        return alert_writer.submit_update('alerts', {'_id': run_id}, update, upsert=True), run_id
+
+    @staticmethod
+    def _run_key(doc):
+        details = doc.get('details') or {}
+        return (doc.get('exam_id', details.get('exam_id')), doc.get('student_id'))
+
+    def interrupt(self, doc):
+        """End the open run of doc's student (an alert that is not coalesced came in between)"""
+        with self._lock:
+            self._runs.pop(self._run_key(doc), None)
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for run_key in [k for k, run in self._runs.items() if now - run['last'] > self.gap]:
+            del self._runs[run_key]
+
+    def reset(self, exam_id, student_id=None):
+        """Close open runs (used when exam data is reset) so later repeats start new documents"""
+        with self._lock:
+            for run_key in list(self._runs):
+                if run_key[0] == exam_id and (student_id is None or run_key[1] == student_id):
+                    del self._runs[run_key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'gap_s': self.gap,
+                'open_runs': len(self._runs),
+                'runs_opened': self._runs_opened,
+                'folded': self._folded,
+                'event_log': ALERT_EVENT_LOG
+            }
+
+alert_coalescer = AlertCoalescer(ALERT_COALESCE_GAP_S)
+
+# Per-student alert rollups for the proctor dashboard: one alert_rollups document per exam
+# and student with occurrence counts by category, total, last_alert_time, the UFM mark and
+# the termination flag. record_alert queues a $inc/$max upsert on the rollup next to every
+# alert, so /api/exam/<exam_id>/summary reads one small document per student however many
+# raw alerts the exam has; rebuild_alert_rollups() recomputes them from the source collections.
+# Only 'ALERT...' directions are counted, like the dashboard always did, and the first
+# pattern found in the direction picks the category.
+ALERT_CATEGORIES = OrderedDict([
+    ('Audio Anomaly', 'audio'),
+    ('Forbidden Object', 'object'),
+    ('No face', 'no_face'),
+    ('Left', 'left'),
+    ('Right', 'right'),
+    ('Up', 'up'),
+    ('Down', 'down'),
+    ('Tilting', 'tilt'),
+])
+
+def alert_category(direction):
+    """Rollup category of an alert direction, or None if it is not counted"""
+    if not isinstance(direction, str) or not direction.startswith('ALERT'):
+        return None
+    for pattern, category in ALERT_CATEGORIES.items():
+        if pattern in direction:
+            return category
+    return 'other'
+
+def alert_rollup_update(doc):
+    """(filter, update) for the rollup an alert document changes, or None"""
+    details = doc.get('details') or {}
+    exam_id = doc.get('exam_id', details.get('exam_id'))
+    student_id = doc.get('student_id')
+    if not exam_id or not student_id:
+        return None
+    seen = doc.get('alert_time') or doc.get('created_at') or datetime.now()
+    if details.get('type') == 'unfair_means':
+        update = {'$set': {'ufm': {'marked': True, 'reason': details.get('reason'), 'marked_at': seen}}}
+    elif details.get('type') == 'exam_termination':
+        update = {'$set': {'terminated': True, 'termination_reason': details.get('reason'), 'terminated_at': seen}}
+    else:
+        category = alert_category(doc.get('direction'))
+        if category is None:
+            return None
+        update = {'$inc': {f'counts.{category}': 1, 'total': 1}, '$max': {'last_alert_time': seen}}
+    return {'exam_id': exam_id, 'student_id': student_id}, update
+
+def record_alert(doc, collection_name='alerts', critical=False, event_type=None, coalesce_key=None, severity=None):
+    """
+    Queue an alert document for the background writer and, if event_type is given,
+    broadcast it to real-time subscribers. Returns False if the writer dropped it.
+    Non-critical alerts with a coalesce_key are folded into a run document (see
+    AlertCoalescer); severity feeds the run's peak_severity. Alerts also update the
+    student's rollup (see alert_rollup_update).
+    """
+    if coalesce_key is not None and collection_name == 'alerts' and not critical and alert_coalescer.gap > 0:
+        queued, run_id = alert_coalescer.record(doc, coalesce_key, severity)
+        if ALERT_EVENT_LOG:
+            alert_writer.submit('alert_events', dict(doc, run_id=run_id))
+    else:
+        if collection_name == 'alerts' and alert_coalescer.gap > 0:
+            alert_coalescer.interrupt(doc)
+        queued = alert_writer.submit(collection_name, doc, critical=critical)
+    if queued and collection_name == 'alerts':
+        rollup = alert_rollup_update(doc)
+        if rollup is not None:
+            alert_writer.submit_update('alert_rollups', *rollup, critical=critical, upsert=True)
+    if not queued:
+        print(f"⚠ Alert queue full - dropped {collection_name} alert for {doc.get('student_id')}")
+    if event_type is not None:
+        details = doc.get('details') or {}
+        alert_time = doc.get('alert_time') or doc.get('created_at')
+        event = {
+            'type': event_type,
+            'student_id': doc.get('student_id'),
+            'exam_id': doc.get('exam_id', details.get('exam_id')),
+            'direction': doc.get('direction'),
+            'alert_type': doc.get('alert_type'),
+            'message': doc.get('message'),
+            'details': details or None,
+            'alert_time': alert_time.isoformat() if alert_time else None
+        }
+        event_hub.publish(event_type, {k: v for k, v in event.items() if v is not None})
+    return queued
+
+
+def create_face_recognizer():
+    """Create an empty LBPH recognizer with the parameters used across the app"""
+    # Use LBPH with improved parameters for better accuracy
+    return cv2.face.LBPHFaceRecognizer_create(
+        radius=2,        # Increased from default 1 for more spatial information
+        neighbors=8,     # Default value, good for most cases
+        grid_x=8,        # Default value
+        grid_y=8,        # Default value
+        threshold=100.0  # Increased threshold for stricter matching
+    )
 
 def init_face_recognizer():
-    """Initialize or load face recognizer"""
-    global face_recognizer, face_labels, label_counter
+    """Load the persisted face model into the gallery (an empty gallery if there is none)"""
+    global face_gallery_loaded
     try:
-        # Use LBPH with improved parameters for better accuracy
-        face_recognizer = cv2.face.LBPHFaceRecognizer_create(
-            radius=2,        # Increased from default 1 for more spatial information
-            neighbors=8,     # Default value, good for most cases
-            grid_x=8,        # Default value
-            grid_y=8,        # Default value
-            threshold=100.0  # Increased threshold for stricter matching
-        )
         database = get_db_connection()
         if database is not None:
             # Try to load existing model from MongoDB
             model_doc = database.face_models.find_one({'model_type': 'lbph_primary'})
             if model_doc:
-                # Load model from binary data
-                model_bytes = model_doc['model_data']
-                with open('temp_model.yml', 'wb') as f:
-                    f.write(model_bytes)
-                face_recognizer.read('temp_model.yml')
-                os.remove('temp_model.yml')
-                
-                face_labels = model_doc.get('labels', {})
-                label_counter = model_doc.get('label_counter', 0)
-                print(f"✓ Loaded existing face recognizer with {len(face_labels)} registered faces")
+                started = time.perf_counter()
+                if model_doc.get('model_format') == FACE_MODEL_FORMAT:
+                    load_face_model(database, model_doc)
+                else:
+                    load_legacy_face_model(database, model_doc)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"✓ Loaded existing face recognizer with {len(face_labels)} registered faces ({elapsed_ms:.0f} ms)")
             else:
                 print("ℹ No existing face recognition model found - will train on first registration")
     except Exception as e:
         print(f"Warning: Failed to initialize face recognizer: {e}")
-        face_recognizer = cv2.face.LBPHFaceRecognizer_create(
-            radius=2,
-            neighbors=8,
-            grid_x=8,
-            grid_y=8,
-            threshold=100.0
-        )
+    face_gallery_loaded = True
+
+# LBPH distance threshold: predictions further than this are "unknown" (matches create_face_recognizer)
+LBPH_DISTANCE_THRESHOLD = 100.0
+# Adjacent histogram bins summed into one for the gallery's coarse pre-filter
+FACE_GALLERY_POOL = 32
+# Gallery rows scored exactly per step of the pruned search
+FACE_GALLERY_BLOCK = 8
+
+def compute_lbph_histograms(face_rois):
+    """
+    Compute LBPH spatial histograms for a list of preprocessed face ROIs.
+    A throwaway recognizer with the app's LBPH parameters does the extraction,
+    so the histograms are identical to the ones LBPH predict() compares.
+    Returns: (n, d) float32 matrix
+    """
+    extractor = create_face_recognizer()
+    extractor.train(list(face_rois), np.arange(len(face_rois), dtype=np.int32))
+    return np.vstack([hist.reshape(1, -1) for hist in extractor.getHistograms()]).astype(np.float32)
+
+def chi_square_distances(rows, query):
+    """Chi-square distance (OpenCV HISTCMP_CHISQR_ALT, as used by LBPH) from query to each row"""
+    total = rows + query
+    diff = rows - query
+    np.multiply(diff, diff, out=diff)
+    np.divide(diff, total, out=diff, where=total > np.finfo(np.float32).eps)
+    diff[total <= np.finfo(np.float32).eps] = 0
+    return 2.0 * diff.sum(axis=1, dtype=np.float64)
+
+class FaceGalleryIndex:
+    """
+    In-memory 1:N face gallery.
+    Every enrolled LBPH histogram lives in one contiguous float32 matrix with a
+    parallel label array, and a reverse label -> roll number array replaces
+    scanning face_labels to name the match.
+
+    Searches are exact but pruned: summing adjacent bins can only shrink the
+    chi-square distance, so distances between pooled histograms (a matrix
+    FACE_GALLERY_POOL times smaller) are lower bounds. Rows are scored exactly
+    in lower-bound order until no remaining row can beat the current top-k.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hists = np.zeros((0, 0), dtype=np.float32)
+        self._pooled = np.zeros((0, 0), dtype=np.float32)
+        self._labels = np.zeros(0, dtype=np.int32)
+        self._size = 0
+        self._roll_numbers = np.array([], dtype=object)
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _pool(hists):
+        hists = np.asarray(hists, dtype=np.float32)
+        if hists.shape[-1] % FACE_GALLERY_POOL:
+            return hists.copy()
+        return hists.reshape(hists.shape[:-1] + (hists.shape[-1] // FACE_GALLERY_POOL, FACE_GALLERY_POOL)).sum(axis=-1)
+
+    def reset(self, hists, labels):
+        """Replace the gallery contents (after loading or compacting the model)"""
+        labels = np.asarray(labels, dtype=np.int32).ravel()
+        hists = np.ascontiguousarray(hists, dtype=np.float32)
+        if hists.ndim != 2:
+            hists = hists.reshape(len(labels), -1)
+        pooled = self._pool(hists)
+        with self._lock:
+            self._hists, self._pooled, self._labels = hists, pooled, labels.copy()
+            self._size = len(labels)
+
+    def reset_from_recognizer(self, recognizer):
+        hists = recognizer.getHistograms()
+        if not hists:
+            self.reset(np.zeros((0, 0), dtype=np.float32), [])
+        else:
+            self.reset(np.vstack([hist.reshape(1, -1) for hist in hists]), np.asarray(recognizer.getLabels()).ravel())
+
+    def add(self, hists, labels):
+        """Append histograms; storage grows geometrically so enrollment is amortized O(1)"""
+        labels = np.asarray(labels, dtype=np.int32).ravel()
+        hists = np.asarray(hists, dtype=np.float32).reshape(len(labels), -1)
+        pooled = self._pool(hists)
+        with self._lock:
+            needed = self._size + len(labels)
+            if self._size == 0 or needed > len(self._labels) or self._hists.shape[1] != hists.shape[1]:
+                capacity = max(needed, 2 * len(self._labels), 16)
+                grown_hists = np.zeros((capacity, hists.shape[1]), dtype=np.float32)
+                grown_pooled = np.zeros((capacity, pooled.shape[1]), dtype=np.float32)
+                grown_labels = np.full(capacity, -1, dtype=np.int32)
+                if self._size:
+                    grown_hists[:self._size] = self._hists[:self._size]
+                    grown_pooled[:self._size] = self._pooled[:self._size]
+                    grown_labels[:self._size] = self._labels[:self._size]
+                self._hists, self._pooled, self._labels = grown_hists, grown_pooled, grown_labels
+            # Rows past _size are invisible to searches that already took a snapshot
+            self._hists[self._size:needed] = hists
+            self._pooled[self._size:needed] = pooled
+            self._labels[self._size:needed] = labels
+            self._size = needed
+
+    def set_roll_numbers(self, labels_by_roll):
+        """Rebuild the reverse label -> roll number array from {roll_number: label_id}"""
+        size = max(labels_by_roll.values(), default=-1) + 1
+        roll_numbers = np.full(size, 'unknown', dtype=object)
+        for roll_number, label_id in labels_by_roll.items():
+            roll_numbers[label_id] = roll_number
+        with self._lock:
+            self._roll_numbers = roll_numbers
+
+    def roll_number(self, label_id):
+        roll_numbers = self._roll_numbers
+        if 0 <= label_id < len(roll_numbers):
+            return roll_numbers[label_id]
+        return 'unknown'
+
+    def _snapshot(self):
+        with self._lock:
+            size = self._size
+            return self._hists[:size], self._pooled[:size], self._labels[:size]
+
+    def export(self):
+        """Copy of the enrolled (histograms, labels) for persistence"""
+        hists, _, labels = self._snapshot()
+        return hists.copy(), labels.copy()
+
+    def _search_one(self, hists, pooled, labels, query, pooled_query, k):
+        lower_bounds = chi_square_distances(pooled, pooled_query)
+        order = np.argsort(lower_bounds)
+        best = {}  # label -> closest exact distance
+        kth_best = np.inf
+        for start in range(0, len(order), FACE_GALLERY_BLOCK):
+            rows = order[start:start + FACE_GALLERY_BLOCK]
+            # Small tolerance for float32 rounding in the bound
+            if lower_bounds[rows[0]] > kth_best * (1 + 1e-5):
+                break
+            for row, distance in zip(rows, chi_square_distances(hists[rows], query)):
+                label_id = int(labels[row])
+                if distance < best.get(label_id, np.inf):
+                    best[label_id] = float(distance)
+            if len(best) >= k:
+                kth_best = sorted(best.values())[k - 1]
+        top = sorted(best.items(), key=lambda item: item[1])[:k]
+        return [(label_id, self.roll_number(label_id), distance) for label_id, distance in top]
+
+    def search(self, query_hists, k=1):
+        """
+        Return the top-k (label_id, roll_number, distance) candidates per query
+        histogram, best first, keeping each student's closest histogram only
+        """
+        hists, pooled, labels = self._snapshot()
+        query_hists = np.asarray(query_hists, dtype=np.float32).reshape(len(query_hists), -1)
+        if len(labels) == 0:
+            return [[] for _ in range(len(query_hists))]
+        pooled_queries = self._pool(query_hists)
+        return [
+            self._search_one(hists, pooled, labels, query, pooled_query, max(1, k))
+            for query, pooled_query in zip(query_hists, pooled_queries)
+        ]
+
+    def predict(self, query_hist):
+        """LBPH-compatible prediction: (label_id, distance), label -1 beyond the threshold"""
+        matches = self.search([query_hist], k=1)[0]
+        if not matches:
+            return -1, sys.float_info.max
+        label_id, _, distance = matches[0]
+        if distance >= LBPH_DISTANCE_THRESHOLD:
+            return -1, distance
+        return label_id, distance
+
+face_gallery = FaceGalleryIndex()
+
+# Face model persistence: the gallery histograms and label map are serialized in
+# memory into a compressed .npz blob stored in face_models (no temp files)
+FACE_MODEL_FORMAT = 'lbph-gallery-npz'
+FACE_MODEL_FORMAT_VERSION = 1
+# Blobs larger than this are split across face_model_chunks (MongoDB documents max out at 16 MB)
+FACE_MODEL_CHUNK_BYTES = 8 * 1024 * 1024
+
+def serialize_face_model(hists, labels, labels_by_roll):
+    """
+    Pack gallery histograms and the label map into compressed .npz bytes.
+    LBPH histograms are bin counts times 1/cell_size, so they are stored as
+    uint16 counts plus that scale whenever this round-trips bit-exactly.
+    """
+    hists = np.asarray(hists, dtype=np.float32)
+    arrays = {
+        'format_version': np.array([FACE_MODEL_FORMAT_VERSION], dtype=np.int32),
+        'labels': np.asarray(labels, dtype=np.int32),
+        'roll_numbers': np.array(list(labels_by_roll.keys()), dtype=str),
+        'label_ids': np.array(list(labels_by_roll.values()), dtype=np.int32)
+    }
+    nonzero = hists[hists > 0]
+    packed = False
+    if nonzero.size:
+        scale = np.float32(nonzero.min())
+        counts = np.rint(hists / scale)
+        if counts.max() <= np.iinfo(np.uint16).max:
+            counts = counts.astype(np.uint16)
+            if np.array_equal(counts.astype(np.float32) * scale, hists):
+                arrays['counts'] = counts
+                arrays['scale'] = np.array([scale], dtype=np.float32)
+                packed = True
+    if not packed:
+        arrays['histograms'] = hists
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+def deserialize_face_model(model_bytes):
+    """Inverse of serialize_face_model: (histograms, labels, {roll_number: label_id})"""
+    with np.load(io.BytesIO(model_bytes), allow_pickle=False) as data:
+        version = int(data['format_version'][0])
+        if version > FACE_MODEL_FORMAT_VERSION:
+            raise ValueError(f"Unsupported face model format version {version}")
+        if 'counts' in data:
+            hists = data['counts'].astype(np.float32) * data['scale'][0]
+        else:
+            hists = data['histograms'].astype(np.float32)
+        labels = data['labels'].astype(np.int32)
+        labels_by_roll = {str(roll): int(label_id) for roll, label_id in zip(data['roll_numbers'], data['label_ids'])}
+    return hists, labels, labels_by_roll
+
+def save_face_model(database):
+    """Persist the face gallery and label map to MongoDB"""
+    with face_model_lock:
+        hists, labels = face_gallery.export()
+        labels_by_roll = dict(face_labels)
+        counter = label_counter
+    
+    model_bytes = serialize_face_model(hists, labels, labels_by_roll)
+    model_version = str(ObjectId())
+    chunks = [model_bytes[i:i + FACE_MODEL_CHUNK_BYTES] for i in range(0, len(model_bytes), FACE_MODEL_CHUNK_BYTES)]
+    
+    model_fields = {
+        'model_format': FACE_MODEL_FORMAT,
+        'format_version': FACE_MODEL_FORMAT_VERSION,
+        'model_version': model_version,
+        'histogram_count': int(len(labels)),
+        'labels': labels_by_roll,
+        'label_counter': counter,
+        'updated_at': datetime.now()
+    }
+    if len(chunks) <= 1:
+        model_fields['model_data'] = Binary(model_bytes)
+        model_fields['chunk_count'] = 0
+    else:
+        # Write the new chunks before pointing the primary document at them
+        database.face_model_chunks.insert_many([
+            {'model_version': model_version, 'seq': seq, 'data': Binary(chunk)}
+            for seq, chunk in enumerate(chunks)
+        ])
+        model_fields['model_data'] = None
+        model_fields['chunk_count'] = len(chunks)
+    
+    previous = database.face_models.find_one_and_update(
+        {'model_type': 'lbph_primary'},
+        {'$set': model_fields},
+        projection={'model_version': 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    # Only the version this save replaced: a concurrent save's chunks may already be
+    # what the primary document points at
+    if previous and previous.get('model_version') and previous['model_version'] != model_version:
+        database.face_model_chunks.delete_many({'model_version': previous['model_version']})
+
+def load_face_model(database, model_doc):
+    """Load a FACE_MODEL_FORMAT document into the gallery and label map"""
+    global face_labels, label_counter
+    if model_doc.get('chunk_count'):
+        chunks = database.face_model_chunks.find({'model_version': model_doc['model_version']}).sort('seq', 1)
+        model_bytes = b''.join(bytes(chunk['data']) for chunk in chunks)
+    else:
+        model_bytes = bytes(model_doc['model_data'])
+    hists, labels, labels_by_roll = deserialize_face_model(model_bytes)
+    with face_model_lock:
+        face_labels = labels_by_roll
+        label_counter = model_doc.get('label_counter', max(labels_by_roll.values(), default=-1) + 1)
+        face_gallery.reset(hists, labels)
+        face_gallery.set_roll_numbers(face_labels)
+
+def load_legacy_face_model(database, model_doc):
+    """
+    Load a model saved as OpenCV YAML by earlier versions, then re-save it in the
+    compact format. OpenCV can only read a file path, so a private temp file is used.
+    """
+    global face_labels, label_counter
+    legacy = create_face_recognizer()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, 'model.yml')
+        with open(model_path, 'wb') as f:
+            f.write(model_doc['model_data'])
+        legacy.read(model_path)
+    with face_model_lock:
+        face_labels = model_doc.get('labels', {})
+        label_counter = model_doc.get('label_counter', 0)
+        face_gallery.reset_from_recognizer(legacy)
+        face_gallery.set_roll_numbers(face_labels)
+    save_face_model(database)
+    print("✓ Migrated face recognizer to compressed gallery format")
+
+# Compound indexes for every hot query shape, created idempotently at startup.
+# Keyset pages on alerts sort by (alert_time, _id), so those keys trail each alert index.
+MONGO_INDEXES = {
+    'alerts': [
+        [('alert_time', DESCENDING), ('_id', DESCENDING)],
+        [('exam_id', ASCENDING), ('alert_time', DESCENDING), ('_id', DESCENDING)],
+        # Audio, termination and UFM alerts only carry exam_id inside details
+        [('details.exam_id', ASCENDING), ('alert_time', DESCENDING), ('_id', DESCENDING)],
+        [('student_id', ASCENDING), ('alert_time', DESCENDING), ('_id', DESCENDING)],
+        [('details.type', ASCENDING), ('alert_time', DESCENDING), ('_id', DESCENDING)],
+        # Incremental ?since= refreshes page on (updated_at, _id)
+        [('updated_at', DESCENDING), ('_id', DESCENDING)],
+        [('exam_id', ASCENDING), ('updated_at', DESCENDING), ('_id', DESCENDING)],
+        [('details.exam_id', ASCENDING), ('updated_at', DESCENDING), ('_id', DESCENDING)],
+        # Per-student reset, including its legacy exam_id-less $or branches
+        [('student_id', ASCENDING), ('exam_id', ASCENDING)],
+    ],
+    'alert_events': [
+        [('exam_id', ASCENDING), ('student_id', ASCENDING), ('alert_time', DESCENDING)],
+        [('run_id', ASCENDING)],
+    ],
+    'alert_rollups': [
+        ([('exam_id', ASCENDING), ('student_id', ASCENDING)], {'unique': True}),
+    ],
+    'unfair_means': [
+        [('exam_id', ASCENDING), ('student_id', ASCENDING)],
+        [('exam_id', ASCENDING), ('marked_at', DESCENDING)],
+    ],
+    'exam_alerts': [
+        [('exam_id', ASCENDING), ('student_id', ASCENDING)],
+    ],
+    'exam_terminations': [
+        [('exam_id', ASCENDING), ('student_id', ASCENDING)],
+    ],
+    'registered_faces': [
+        [('exam_id', ASCENDING), ('roll_number', ASCENDING)],
+    ],
+    # /login matches on password too, but username + roll_number already pins the document
+    'students': [
+        [('username', ASCENDING), ('roll_number', ASCENDING)],
+    ],
+    'teachers': [
+        ([('username', ASCENDING)], {'unique': True}),
+    ],
+    'face_model_chunks': [
+        [('model_version', ASCENDING), ('seq', ASCENDING)],
+    ],
+    # TTL index: MongoDB deletes each session once its expires_at has passed
+    'teacher_sessions': [
+        ([('expires_at', ASCENDING)], {'expireAfterSeconds': 0}),
+    ],
+}
+MONGO_ENSURE_INDEXES = os.environ.get('MONGO_ENSURE_INDEXES', '1') != '0'
+
+def ensure_indexes(database):
+    """
+    Create any declared index that is missing. Existing indexes are matched on their
+    key pattern, so this is safe to run on every startup. Returns a per-collection report.
+    """
+    report = {}
+    for collection_name, specs in MONGO_INDEXES.items():
+        collection = database[collection_name]
+        try:
+            existing = {tuple(info['key']) for info in collection.index_information().values()}
+        except OperationFailure:
+            existing = set()
+        created, present, failed = [], [], []
+        for spec in specs:
+            keys, options = spec if isinstance(spec, tuple) else (spec, {})
+            name = '_'.join(f"{field}_{order}" for field, order in keys)
+            if tuple(keys) in existing:
+                present.append(name)
+                continue
+            try:
+                collection.create_indexes([IndexModel(keys, **options)])
+                created.append(name)
+            except OperationFailure as e:
+                failed.append({'index': name, 'error': str(e)})
+        report[collection_name] = {'created': created, 'present': present, 'failed': failed}
+        for index_name in created:
+            print(f"✓ Created index {collection_name}.{index_name}")
+        for failure in failed:
+            print(f"✗ Failed to create index {collection_name}.{failure['index']}: {failure['error']}")
+    return report
+
+def get_index_stats(database):
+    """Per-index usage counters from $indexStats for every managed collection"""
+    stats = {}
+    for collection_name in MONGO_INDEXES:
+        try:
+            stats[collection_name] = [
+                {
+                    'name': entry['name'],
+                    'key': dict(entry['key']),
+                    'ops': int(entry['accesses']['ops']),
+                    'since': entry['accesses']['since'].isoformat()
+                }
+                for entry in database[collection_name].aggregate([{'$indexStats': {}}])
+            ]
+        except Exception as e:
+            stats[collection_name] = {'error': str(e)}
+    return stats
 
 def init_database():
     """Simple database initialization - always return True for now"""
@@ -166,6 +1871,17 @@ def init_database():
         database = get_db_connection()
         if database is not None:
             print("✓ MongoDB connection successful")
+            if MONGO_ENSURE_INDEXES:
+                try:
+                    ensure_indexes(database)
+                except Exception as e:
+                    print(f"Index setup error: {e}")
+            try:
+                # First start after upgrading: build the dashboard rollups from existing alerts
+                if database.alert_rollups.estimated_document_count() == 0 and database.alerts.estimated_document_count() > 0:
+                    rebuild_alert_rollups(database)
+            except Exception as e:
+                print(f"Alert rollup rebuild error: {e}")
             init_face_recognizer()
             return True
         else:
@@ -186,32 +1902,177 @@ def log_alert():
     exam_id = data.get('exam_id', 'exam_2025_ai')  # Default exam_id if not provided
     
     if student_id and direction and time:
-        database = get_db_connection()
-        if database is not None:
-            try:
-                alert_doc = {
-                    "student_id": student_id,
-                    "exam_id": exam_id,  # Store exam_id at top level
-                    "direction": direction,
-                    "alert_time": datetime.now(),
-                    "details": data,
-                    "created_at": datetime.now()
-                }
-                database.alerts.insert_one(alert_doc)
-                return jsonify({'status': 'ok'})
-            except Exception as e:
-                print(f"Database logging error: {e}")
-                return jsonify({'status': 'error', 'message': 'Database error'}), 500
-        else:
-            return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+        alert_doc = {
+            "student_id": student_id,
+            "exam_id": exam_id,  # Store exam_id at top level
+            "direction": direction,
+            "alert_time": datetime.now(),
+            "details": data,
+            "created_at": datetime.now()
+        }
+        if record_alert(alert_doc, event_type='head', coalesce_key=('head', direction)):
+            return jsonify({'status': 'ok'})
+        return jsonify({'status': 'error', 'message': 'Alert queue full'}), 503
     return jsonify({'status': 'error', 'message': 'Missing data'}), 400
 
+# /alerts paging: results are ordered newest-first on (alert_time, _id) and paged
+# with an opaque keyset cursor, so each page costs O(limit) regardless of history.
+# Incremental refreshes (?since=) follow updated_at instead: the alert writer stamps it on
+# every alerts write, so runs folding in a repeat and head-pose episodes closing show up too.
+# A stamp is taken before its write lands, by whichever worker wrote it, so the returned
+# since never moves past now - ALERTS_SINCE_LAG_S: changes newer than that are sent again
+# on the next refresh (clients merge alerts by id), and one that becomes visible late is
+# still picked up as long as writes land and worker clocks agree within the lag.
+ALERTS_SINCE_LAG_S = float(os.environ.get('ALERTS_SINCE_LAG_S', 5))
+ALERTS_DEFAULT_LIMIT = 100
+ALERTS_MAX_LIMIT = 1000
+ALERT_FIELDS = ('student_id', 'exam_id', 'direction', 'alert_time', 'type', 'details',
+                'count', 'first_seen', 'last_seen', 'peak_severity')
+ALERT_DEFAULT_FIELDS = ('student_id', 'exam_id', 'direction', 'alert_time', 'details', 'count', 'last_seen')
+ALERT_QUERY_PARAMS = ('exam_id', 'student_id', 'type', 'limit', 'cursor', 'since', 'fields')
+
+def encode_alert_cursor(alert, field='alert_time'):
+    """Opaque keyset position of an alert document: '<field ISO>_<_id>'"""
+    return f"{alert[field].isoformat()}_{alert['_id']}"
+
+def decode_alert_cursor(token):
+    """Parse a cursor token into (alert_time, _id); a bare ISO timestamp has no _id tie-breaker"""
+    alert_time, _, object_id = token.partition('_')
+    return datetime.fromisoformat(alert_time), (ObjectId(object_id) if object_id else None)
+
+def alert_keyset_filter(position, direction, field='alert_time'):
+    """Match alerts strictly after (direction=1) or before (direction=-1) a cursor position"""
+    value, object_id = position
+    op = '$gt' if direction > 0 else '$lt'
+    if object_id is None:
+        return {field: {op: value}}
+    return {'$or': [
+        {field: {op: value}},
+        {field: value, '_id': {op: object_id}}
+    ]}
+
+def serialize_alert(alert, fields):
+    details = alert.get('details') or {}
+    item = {'id': str(alert['_id'])}
+    for field in fields:
+        if field == 'alert_time':
+            item['alert_time'] = alert['alert_time'].isoformat() if alert.get('alert_time') else None
+        elif field == 'exam_id':
+            # Older alert types only record exam_id inside details
+            item['exam_id'] = alert.get('exam_id', details.get('exam_id'))
+        elif field == 'type':
+            item['type'] = details.get('type')
+        elif field == 'details':
+            item['details'] = details
+        elif field in ('count', 'first_seen', 'last_seen'):
+            # Documents written before coalescing (or with it off) are single occurrences
+            value = alert.get(field, 1 if field == 'count' else alert.get('alert_time'))
+            item[field] = value.isoformat() if isinstance(value, datetime) else value
+        else:
+            item[field] = alert.get(field)
+    return item
+
+def query_alerts(database, args):
+    """
+    Filtered, projected, keyset-paginated alert listing.
+    Without 'since' pages run newest-first and 'next_cursor' continues to older alerts;
+    with 'since' only alerts created or updated after that cursor are returned (oldest
+    change first), so a dashboard refresh only costs what changed since its last fetch.
+    A run that folded in repeats comes back with the same id and its new count/last_seen,
+    an episode that ended with its final details; recent changes can also come back more
+    than once (see ALERTS_SINCE_LAG_S). When a refresh has more than limit changes, pass
+    its next_cursor along with the same since to page through them.
+    """
+    try:
+        limit = int(args.get('limit', ALERTS_DEFAULT_LIMIT))
+    except ValueError:
+        return {'error': 'limit must be an integer'}, 400
+    limit = min(max(limit, 1), ALERTS_MAX_LIMIT)
+    
+    fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()] or list(ALERT_DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in ALERT_FIELDS]
+    if unknown:
+        return {'error': f"Unknown fields: {', '.join(unknown)}", 'allowed_fields': list(ALERT_FIELDS)}, 400
+    
+    clauses = []
+    if args.get('exam_id'):
+        clauses.append({'$or': [{'exam_id': args['exam_id']}, {'details.exam_id': args['exam_id']}]})
+    if args.get('student_id'):
+        clauses.append({'student_id': args['student_id']})
+    if args.get('type'):
+        clauses.append({'details.type': {'$in': [t.strip() for t in args['type'].split(',') if t.strip()]}})
+    
+    since, cursor = args.get('since'), args.get('cursor')
+    try:
+        if since:
+            position = decode_alert_cursor(since)
+            if cursor:
+                # Paging through one refresh moves the cursor; since stays where it was
+                position = decode_alert_cursor(cursor)
+            clauses.append(alert_keyset_filter(position, 1, 'updated_at'))
+        elif cursor:
+            clauses.append(alert_keyset_filter(decode_alert_cursor(cursor), -1))
+    except Exception:
+        return {'error': 'Invalid cursor'}, 400
+    
+    projection = {'alert_time': 1, 'updated_at': 1}
+    for field in fields:
+        if field == 'type':
+            projection['details.type'] = 1
+        elif field == 'exam_id':
+            projection.update({'exam_id': 1, 'details.exam_id': 1})
+        else:
+            projection[field] = 1
+    # A parent path subsumes its children (MongoDB rejects overlapping projections)
+    if 'details' in projection:
+        projection = {k: v for k, v in projection.items() if not k.startswith('details.')}
+    
+    query = {'$and': clauses} if clauses else {}
+    order_by = [('updated_at', 1), ('_id', 1)] if since else [('alert_time', -1), ('_id', -1)]
+    docs = list(database.alerts.find(query, projection).sort(order_by).limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    
+    # Resume point for the next incremental fetch: the last change old enough to be settled
+    horizon = datetime.now() - timedelta(seconds=ALERTS_SINCE_LAG_S)
+    if since:
+        latest = since
+        # Past a page that was not fully settled, since has to wait for a later refresh
+        if not cursor or cursor == since:
+            # Results are in updated_at order, so the settled ones come first
+            settled = [doc for doc in docs if doc['updated_at'] <= horizon]
+            if settled:
+                latest = encode_alert_cursor(settled[-1], 'updated_at')
+        next_cursor = encode_alert_cursor(docs[-1], 'updated_at') if has_more else None
+    else:
+        latest = horizon.isoformat() if not cursor else None
+        next_cursor = encode_alert_cursor(docs[-1]) if has_more else None
+    
+    return {
+        'alerts': [serialize_alert(doc, fields) for doc in docs],
+        'count': len(docs),
+        'has_more': has_more,
+        'next_cursor': next_cursor,
+        'since': latest
+    }, 200
+
 @app.route('/alerts', methods=['GET'])
 def get_alerts():
     database = get_db_connection()
     if database is not None:
         try:
-            # Fetch all alerts, sorted by alert_time descending
+            exam_id = request.args.get('exam_id')
+            scopes = [version_scope('alerts', exam_id), version_scope('alerts')] if exam_id else ['alerts']
+            etag = request_etag(data_versions.tokens(scopes))
+            cached = data_versions.not_modified(etag)
+            if cached is not None:
+                return cached
+            
+            if any(param in request.args for param in ALERT_QUERY_PARAMS):
+                result, status = query_alerts(database, request.args)
+                return with_etag(make_response(jsonify(result), status), etag)
+            
+            # Legacy behaviour: every alert as a bare array, newest first
             alerts_cursor = database.alerts.find().sort("alert_time", -1)
             
             alerts = []
@@ -220,10 +2081,12 @@ def get_alerts():
                     'student_id': alert.get('student_id'),
                     'direction': alert.get('direction'),
                     'alert_time': alert.get('alert_time').isoformat() if alert.get('alert_time') else None,
-                    'details': alert.get('details', {})
+                    'details': alert.get('details', {}),
+                    'count': alert.get('count', 1),
+                    'last_seen': (alert.get('last_seen') or alert.get('alert_time')).isoformat() if alert.get('alert_time') else None
                 })
             
-            return jsonify(alerts)
+            return with_etag(jsonify(alerts), etag)
         except Exception as e:
             print(f"Database fetch error: {e}")
             return jsonify({'error': 'Database error'}), 500
@@ -232,7 +2095,12 @@ def get_alerts():
 
 @app.route('/registered-faces', methods=['GET'])
 def get_registered_faces():
-    return jsonify({'registered_faces': list(registered_faces)})
+    # The set only ever grows and is per process, so its size is an exact version
+    etag = request_etag([data_versions.epoch, str(len(registered_faces))])
+    cached = data_versions.not_modified(etag)
+    if cached is not None:
+        return cached
+    return with_etag(jsonify({'registered_faces': list(registered_faces)}), etag)
 
 @app.route('/test-connection', methods=['GET'])
 def test_connection():
@@ -302,6 +2170,201 @@ def login():
     else:
         return jsonify({"message": "Database connection failed"}), 500
 
+# Teacher login sessions (token -> username, expires_at), kept by TEACHER_SESSION_BACKEND:
+#   sqlite  the SQLite file TEACHER_SESSION_DB; shared by the workers on one host (default)
+#   mongo   the teacher_sessions collection, expired by a TTL index; shared by every
+#           worker on every host, at one database round trip per authenticated request
+#   memory  a per-process dict swept by a background thread; only for a single process,
+#           since tokens validate on the worker that issued them alone
+# The shared backends store a SHA-256 digest of each token rather than the token itself.
+TEACHER_SESSION_BACKEND = os.environ.get('TEACHER_SESSION_BACKEND', 'sqlite')
+TEACHER_SESSION_TTL = timedelta(seconds=float(os.environ.get('TEACHER_SESSION_TTL_S', 4 * 3600)))
+TEACHER_SESSION_SWEEP_S = float(os.environ.get('TEACHER_SESSION_SWEEP_S', 60))
+TEACHER_SESSION_DB = os.environ.get('TEACHER_SESSION_DB') or os.path.join(tempfile.gettempdir(), 'neuroproctor_sessions.sqlite3')
+UTC_EPOCH = datetime(1970, 1, 1)
+
+def session_token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class SessionStore:
+    """
+    Base for the teacher session backends: put/get/delete by token, where get returns
+    {'username', 'expires_at'} (possibly already expired) or None. Backends that cannot
+    expire entries on their own remove them from a daemon sweeper thread, started on
+    first use (and again in a forked worker, where it does not survive the fork).
+    """
+    backend = None
+
+    def __init__(self, sweep_s=60.0):
+        self.sweep_interval = max(1.0, float(sweep_s))
+        self._thread = None
+        self._swept = 0
+
+    def _ensure_sweeper(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sweep_loop, name='session-sweeper', daemon=True)
+            self._thread.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self._swept += self.sweep()
+            except Exception as e:
+                print(f"✗ Teacher session sweep failed: {e}")
+
+    def sweep(self):
+        """Remove expired sessions; returns how many were removed"""
+        return 0
+
+    def stats(self):
+        return {'backend': self.backend, 'swept': self._swept}
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions in a dict, plus expiry buckets of sweep_interval seconds (bucket -> tokens).
+    A sweep drops whole buckets that have fully elapsed, so it never scans live sessions.
+    """
+    backend = 'memory'
+
+    def __init__(self, sweep_s=60.0):
+        super().__init__(sweep_s)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._buckets = {}
+        self._next_bucket = None
+
+    def _bucket(self, expires_at):
+        return int((expires_at - UTC_EPOCH).total_seconds() // self.sweep_interval)
+
+    def put(self, token, username, expires_at):
+        bucket = self._bucket(expires_at)
+        with self._lock:
+            self._sessions[token] = {'username': username, 'expires_at': expires_at}
+            self._buckets.setdefault(bucket, set()).add(token)
+            if self._next_bucket is None or bucket < self._next_bucket:
+                self._next_bucket = bucket
+        self._ensure_sweeper()
+
+    def get(self, token):
+        with self._lock:
+            return self._sessions.get(token)
+
+    def delete(self, token):
+        with self._lock:
+            session = self._sessions.pop(token, None)
+            if session is not None:
+                self._buckets.get(self._bucket(session['expires_at']), set()).discard(token)
+
+    def sweep(self):
+        # Buckets before the current one hold only expired sessions
+        current = self._bucket(datetime.utcnow())
+        removed = 0
+        with self._lock:
+            if self._next_bucket is None:
+                return 0
+            if current - self._next_bucket > len(self._buckets):
+                # More elapsed buckets than stored ones (a long gap): visit the stored ones
+                elapsed = [bucket for bucket in self._buckets if bucket < current]
+            else:
+                elapsed = range(self._next_bucket, current)
+            for bucket in elapsed:
+                for token in self._buckets.pop(bucket, ()):
+                    if self._sessions.pop(token, None) is not None:
+                        removed += 1
+            self._next_bucket = max(self._next_bucket, current)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return dict(super().stats(), sessions=len(self._sessions), buckets=len(self._buckets))
+
+class MongoSessionStore(SessionStore):
+    """
+    Sessions in the teacher_sessions collection; its TTL index (MONGO_INDEXES) does the
+    sweeping. The index is created on first use, since init_database() only runs when
+    the app is started with `python app.py`.
+    """
+    backend = 'mongo'
+
+    def __init__(self, sweep_s=60.0):
+        super().__init__(sweep_s)
+        self._indexed = False
+
+    def _collection(self):
+        database = get_db_connection()
+        if database is None:
+            raise RuntimeError('Database connection failed')
+        if not self._indexed:
+            try:
+                database.teacher_sessions.create_indexes([
+                    IndexModel(keys, **options) for keys, options in MONGO_INDEXES['teacher_sessions']
+                ])
+            except OperationFailure as e:
+                print(f"✗ Failed to create the teacher_sessions TTL index: {e}")
+            self._indexed = True
+        return database.teacher_sessions
+
+    def put(self, token, username, expires_at):
+        self._collection().insert_one({'_id': session_token_digest(token), 'username': username, 'expires_at': expires_at})
+
+    def get(self, token):
+        return self._collection().find_one({'_id': session_token_digest(token)}, {'_id': 0})
+
+    def delete(self, token):
+        self._collection().delete_one({'_id': session_token_digest(token)})
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file (WAL mode), one connection per thread and process"""
+    backend = 'sqlite'
+
+    def __init__(self, path, sweep_s=60.0):
+        super().__init__(sweep_s)
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS teacher_sessions '
+                         '(token_hash TEXT PRIMARY KEY, username TEXT NOT NULL, expires_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS teacher_sessions_expires_at ON teacher_sessions (expires_at)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def put(self, token, username, expires_at):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO teacher_sessions VALUES (?, ?, ?)',
+            (session_token_digest(token), username, (expires_at - UTC_EPOCH).total_seconds()))
+        self._ensure_sweeper()
+
+    def get(self, token):
+        row = self._connect().execute(
+            'SELECT username, expires_at FROM teacher_sessions WHERE token_hash = ?',
+            (session_token_digest(token),)).fetchone()
+        if row is None:
+            return None
+        return {'username': row[0], 'expires_at': UTC_EPOCH + timedelta(seconds=row[1])}
+
+    def delete(self, token):
+        self._connect().execute('DELETE FROM teacher_sessions WHERE token_hash = ?', (session_token_digest(token),))
+
+    def sweep(self):
+        now = (datetime.utcnow() - UTC_EPOCH).total_seconds()
+        return self._connect().execute('DELETE FROM teacher_sessions WHERE expires_at < ?', (now,)).rowcount
+
+def create_session_store(backend=TEACHER_SESSION_BACKEND):
+    if backend == 'memory':
+        return MemorySessionStore(TEACHER_SESSION_SWEEP_S)
+    if backend == 'mongo':
+        return MongoSessionStore(TEACHER_SESSION_SWEEP_S)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(TEACHER_SESSION_DB, TEACHER_SESSION_SWEEP_S)
+    raise ValueError(f"Unknown TEACHER_SESSION_BACKEND '{backend}' (expected memory, mongo or sqlite)")
+
+teacher_sessions = create_session_store()
+
 @app.route('/teacher/login', methods=['POST'])
 def teacher_login():
     data = request.get_json()
@@ -327,7 +2390,7 @@ def teacher_login():
                 # create a secure random token and store session
                 token = secrets.token_urlsafe(32)
                 expires_at = datetime.utcnow() + TEACHER_SESSION_TTL
-                teacher_sessions[token] = {"username": username, "expires_at": expires_at}
+                teacher_sessions.put(token, username, expires_at)
 
                 return jsonify({
                     "message": "Login successful", 
@@ -339,42 +2402,398 @@ def teacher_login():
             else:
                 return jsonify({"message": "Invalid credentials"}), 401
         except Exception as e:
-            print(f"Database teacher login error: {e}")
-            return jsonify({"message": "Database error occurred"}), 500
-    else:
-        return jsonify({"message": "Database connection failed"}), 500
+            print(f"Database teacher login error: {e}")
+            return jsonify({"message": "Database error occurred"}), 500
+    else:
+        return jsonify({"message": "Database connection failed"}), 500
+
+
+@app.route('/teacher/validate', methods=['GET'])
+def teacher_validate():
+    """Validate teacher session token. Clients should send ?token=<token> or Authorization: Bearer <token>"""
+    token = request.args.get('token') or None
+    auth_header = request.headers.get('Authorization')
+    if not token and auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ', 1)[1].strip()
+
+    if not token:
+        return jsonify({'valid': False, 'message': 'No token provided'}), 401
+
+    try:
+        session = teacher_sessions.get(token)
+        if not session:
+            return jsonify({'valid': False, 'message': 'Invalid token'}), 401
+
+        if session['expires_at'] < datetime.utcnow():
+            # expired (sweeping and the TTL index remove sessions only periodically)
+            teacher_sessions.delete(token)
+            return jsonify({'valid': False, 'message': 'Token expired'}), 401
+    except Exception as e:
+        print(f"Teacher session lookup error: {e}")
+        return jsonify({'valid': False, 'message': 'Session store unavailable'}), 503
+
+    return jsonify({'valid': True, 'username': session['username']})
+
+# MediaPipe Face Mesh and Face Detection solutions, set by the mediapipe engine
+mp_face_mesh = None
+mp_face_detection = None
+
+def load_mediapipe_engine():
+    global mp_face_mesh, mp_face_detection
+    if USE_INFERENCE_WORKERS:
+        inference_pool.require('mediapipe')
+        return
+    # The graph models ship inside the mediapipe wheel, so this never touches the network
+    import mediapipe as mp
+    mp_face_mesh = mp.solutions.face_mesh
+    mp_face_detection = mp.solutions.face_detection
+
+def warm_up_mediapipe():
+    # Build and run one throwaway graph of each kind so the TFLite runtime is initialized
+    rgb = cv2.cvtColor(WARMUP_FRAME, cv2.COLOR_BGR2RGB)
+    with mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1) as face_mesh:
+        face_mesh.process(rgb)
+    with mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5) as face_detection:
+        face_detection.process(rgb)
+
+mediapipe_engine = engines['mediapipe'] = ModelEngine(
+    'mediapipe', load_mediapipe_engine, None if USE_INFERENCE_WORKERS else warm_up_mediapipe
+)
+
+# Upper bound on cached per-student MediaPipe graph sets (least recently used idle ones are closed)
+MEDIAPIPE_POOL_SIZE = int(os.environ.get('MEDIAPIPE_POOL_SIZE', 64))
+ANONYMOUS_GRAPH_KEY = '__anonymous__'
+
+class StudentGraphs:
+    """FaceMesh/FaceDetection graphs owned by one student session, built on first use"""
+    def __init__(self):
+        self.face_mesh = None
+        self.face_detection = None
+        self.mesh_lock = threading.Lock()
+        self.detection_lock = threading.Lock()
+        self.in_use = 0
+
+    def close(self):
+        for graph in (self.face_mesh, self.face_detection):
+            if graph is not None:
+                try:
+                    graph.close()
+                except Exception as e:
+                    print(f"Error closing MediaPipe graph: {e}")
+
+class MediaPipeGraphPool:
+    """
+    Pool of MediaPipe graphs keyed by student.
+    Each student gets their own FaceMesh tracking graph, so video streams never
+    share tracking state and different students are processed in parallel.
+    A graph is only ever used by one thread at a time; when the pool grows past
+    max_graphs the least recently used idle graph sets are closed.
+    """
+    def __init__(self, max_graphs=64):
+        self.max_graphs = max(1, int(max_graphs))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._evicted = 0
+
+    def _checkout(self, key):
+        key = key or ANONYMOUS_GRAPH_KEY
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = StudentGraphs()
+                self._entries[key] = entry
+                self._created += 1
+            else:
+                self._entries.move_to_end(key)
+            entry.in_use += 1
+        return entry
+
+    def _release(self, entry):
+        evicted = []
+        with self._lock:
+            entry.in_use -= 1
+            if len(self._entries) > self.max_graphs:
+                for key in list(self._entries):
+                    if len(self._entries) <= self.max_graphs:
+                        break
+                    if self._entries[key].in_use == 0:
+                        evicted.append(self._entries.pop(key))
+                self._evicted += len(evicted)
+        for stale in evicted:
+            stale.close()
+
+    @contextmanager
+    def face_mesh(self, key):
+        """Exclusive use of the student's FaceMesh graph"""
+        entry = self._checkout(key)
+        try:
+            with entry.mesh_lock:
+                if entry.face_mesh is None:
+                    entry.face_mesh = mp_face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1)
+                yield entry.face_mesh
+        finally:
+            self._release(entry)
+
+    @contextmanager
+    def face_detection(self, key):
+        """Exclusive use of the student's FaceDetection graph"""
+        entry = self._checkout(key)
+        try:
+            with entry.detection_lock:
+                if entry.face_detection is None:
+                    entry.face_detection = mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5)
+                yield entry.face_detection
+        finally:
+            self._release(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._entries),
+                'in_use': sum(1 for entry in self._entries.values() if entry.in_use),
+                'max_graphs': self.max_graphs,
+                'created': self._created,
+                'evicted': self._evicted
+            }
+
+mediapipe_pool = MediaPipeGraphPool(MEDIAPIPE_POOL_SIZE)
+
+# Inference worker pool: with INFERENCE_WORKERS > 0, MediaPipe and YOLO run in that many
+# spawned processes, each loading its own engines with INFERENCE_WORKER_THREADS compute
+# threads, instead of in the request threads. A frame reaches its worker through a
+# per-worker multiprocessing.shared_memory slot; only a small (task, key, shape) header
+# goes over the pipe, and only the (small) result is pickled back. Frames larger than
+# the slot are sent inline. Head-pose jobs stick to one worker per student so FaceMesh
+# tracking state stays with that student; other jobs go to any idle worker.
+# LBPH matching and the Haar fallback stay in this process next to the face gallery.
+INFERENCE_WORKER_THREADS = int(os.environ.get('INFERENCE_WORKER_THREADS', 1))
+INFERENCE_SHM_SLOT_BYTES = int(os.environ.get('INFERENCE_SHM_SLOT_BYTES', 8 * 1024 * 1024))
+INFERENCE_JOB_TIMEOUT_S = float(os.environ.get('INFERENCE_JOB_TIMEOUT_S', 30))
+
+# Work an inference worker can run: name -> (function(rgb, key), route by key)
+INFERENCE_TASKS = {
+    'objects': (lambda rgb, key: detector([rgb])[0], False),
+    'head_pose': (lambda rgb, key: head_pose_from_rgb(rgb, key), True),
+    # FaceDetection keeps no state between frames; a worker only needs one graph
+    'face_boxes': (lambda rgb, key: face_boxes_from_rgb(rgb), False)
+}
+
+def inference_worker_main(conn, shm_name, threads):
+    """
+    Entry point of an inference worker process. The process is spawned, so this module
+    is re-imported first (with IN_INFERENCE_WORKER set, which keeps it from starting
+    engines or a pool of its own).
+    """
+    global DETECTOR_THREADS
+    DETECTOR_THREADS = threads
+    cv2.setNumThreads(threads)
+    if DETECTOR_BACKEND == 'torch':
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    for engine in engines.values():
+        engine.wait(timeout=None)
+    conn.send(('ready', {
+        'engines': {name: engine.status() for name, engine in engines.items()},
+        'detector_names': detector.names if detector is not None else None
+    }))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        task, key, shape, dtype, inline = message
+        try:
+            rgb = inline if inline is not None else np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            conn.send(('ok', INFERENCE_TASKS[task][0](rgb, key)))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+        finally:
+            rgb = None
+    shm.close()
 
+class InferenceWorker:
+    """Parent-side handle of one worker process: its pipe, shared-memory slot and lock"""
+    def __init__(self, index):
+        self.index = index
+        self.lock = threading.Lock()
+        self.process = None
+        self.conn = None
+        self.shm = None
+        self.ready = False
+        self.jobs = 0
 
-@app.route('/teacher/validate', methods=['GET'])
-def teacher_validate():
-    """Validate teacher session token. Clients should send ?token=<token> or Authorization: Bearer <token>"""
-    token = request.args.get('token') or None
-    auth_header = request.headers.get('Authorization')
-    if not token and auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ', 1)[1].strip()
+class InferenceWorkerPool:
+    """
+    Pool of inference worker processes. run() hands one RGB frame to a worker and blocks
+    the calling request thread until the result comes back; a worker runs one job at
+    a time. A worker that dies or times out is replaced before its next job.
+    """
+    def __init__(self, num_workers, threads=1, slot_bytes=8 * 1024 * 1024, job_timeout=30.0):
+        self.num_workers = max(1, int(num_workers))
+        self.threads = max(1, int(threads))
+        self.slot_bytes = int(slot_bytes)
+        self.job_timeout = float(job_timeout)
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = [InferenceWorker(i) for i in range(self.num_workers)]
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._next = 0
+        self._stats_lock = threading.Lock()
+        self._task_jobs = {}
+        self._task_time = {}
+        self._restarts = 0
+        self._inline_frames = 0
+        self.worker_status = None
 
-    if not token:
-        return jsonify({'valid': False, 'message': 'No token provided'}), 401
+    def _spawn(self, worker):
+        if worker.shm is None:
+            worker.shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+        parent_conn, child_conn = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=inference_worker_main,
+            args=(child_conn, worker.shm.name, self.threads),
+            name=f'{INFERENCE_WORKER_PREFIX}-{worker.index}',
+            daemon=True
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.ready = False
 
-    session = teacher_sessions.get(token)
-    if not session:
-        return jsonify({'valid': False, 'message': 'Invalid token'}), 401
+    def _await_ready(self, worker):
+        """Wait for a freshly spawned worker's handshake (engines loaded and warmed up)"""
+        while not worker.conn.poll(1.0):
+            if not worker.process.is_alive():
+                raise RuntimeError(f"Inference worker {worker.index} exited during startup (code {worker.process.exitcode})")
+        try:
+            _, status = worker.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Inference worker {worker.index} exited during startup")
+        worker.ready = True
+        return status
 
-    if session['expires_at'] < datetime.utcnow():
-        # expired
-        teacher_sessions.pop(token, None)
-        return jsonify({'valid': False, 'message': 'Token expired'}), 401
+    def start(self):
+        """Spawn every worker and wait until all have loaded their engines (idempotent)"""
+        with self._start_lock:
+            if self._started:
+                return self.worker_status
+            for worker in self._workers:
+                self._spawn(worker)
+            for worker in self._workers:
+                with worker.lock:
+                    self.worker_status = self._await_ready(worker)
+            self._started = True
+            print(f"✓ Started {self.num_workers} inference worker process(es)")
+            return self.worker_status
 
-    return jsonify({'valid': True, 'username': session['username']})
+    def require(self, engine_name):
+        """Start the pool and fail unless the workers loaded the named engine"""
+        status = self.start()['engines'][engine_name]
+        if status['state'] != 'ready':
+            raise RuntimeError(f"unavailable in inference workers: {status['error']}")
+        return status
 
-# Initialize MediaPipe Face Mesh
-try:
-    mp_face_mesh = mp.solutions.face_mesh
-    face_mesh = mp_face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1)
-except Exception as e:
-    print(f"Warning: Failed to initialize MediaPipe Face Mesh: {e}")
-    mp_face_mesh = None
-    face_mesh = None
+    def _restart(self, worker):
+        with self._stats_lock:
+            self._restarts += 1
+        try:
+            worker.conn.close()
+        except OSError:
+            pass
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(5)
+        self._spawn(worker)
+
+    def _pick(self, task, key):
+        if INFERENCE_TASKS[task][1] and key:
+            return self._workers[zlib.crc32(str(key).encode()) % self.num_workers]
+        with self._stats_lock:
+            start = self._next
+            self._next = (self._next + 1) % self.num_workers
+        for offset in range(self.num_workers):
+            worker = self._workers[(start + offset) % self.num_workers]
+            if not worker.lock.locked():
+                return worker
+        return self._workers[start]
+
+    def run(self, task, rgb, key=None):
+        """Run one task on a frame in a worker process and return its result"""
+        self.start()
+        rgb = np.ascontiguousarray(rgb)
+        worker = self._pick(task, key)
+        started = time.perf_counter()
+        with worker.lock:
+            if not worker.process.is_alive():
+                self._restart(worker)
+            if not worker.ready:
+                self._await_ready(worker)
+            inline = None
+            if rgb.nbytes <= self.slot_bytes:
+                np.ndarray(rgb.shape, dtype=rgb.dtype, buffer=worker.shm.buf)[...] = rgb
+            else:
+                inline = rgb
+                with self._stats_lock:
+                    self._inline_frames += 1
+            try:
+                worker.conn.send((task, key, rgb.shape, rgb.dtype.str, inline))
+                if not worker.conn.poll(self.job_timeout):
+                    raise TimeoutError(f'no result after {self.job_timeout:.0f}s')
+                status, payload = worker.conn.recv()
+            except (EOFError, OSError, TimeoutError) as e:
+                self._restart(worker)
+                raise RuntimeError(f"Inference worker {worker.index} failed: {e}")
+            worker.jobs += 1
+        with self._stats_lock:
+            self._task_jobs[task] = self._task_jobs.get(task, 0) + 1
+            self._task_time[task] = self._task_time.get(task, 0.0) + time.perf_counter() - started
+        if status == 'error':
+            raise RuntimeError(payload)
+        return payload
+
+    def shutdown(self):
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.process.join(5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+            if worker.shm is not None:
+                worker.shm.close()
+                worker.shm.unlink()
+                worker.shm = None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'workers': self.num_workers,
+                'threads_per_worker': self.threads,
+                'alive': sum(1 for w in self._workers if w.process is not None and w.process.is_alive()),
+                'busy': sum(1 for w in self._workers if w.lock.locked()),
+                'jobs_per_worker': [w.jobs for w in self._workers],
+                'jobs': dict(self._task_jobs),
+                'avg_job_ms': {task: self._task_time[task] / count * 1000.0 for task, count in self._task_jobs.items()},
+                'restarts': self._restarts,
+                'inline_frames': self._inline_frames
+            }
+
+inference_pool = InferenceWorkerPool(
+    INFERENCE_WORKERS, INFERENCE_WORKER_THREADS, INFERENCE_SHM_SLOT_BYTES, INFERENCE_JOB_TIMEOUT_S
+) if USE_INFERENCE_WORKERS else None
+if inference_pool is not None:
+    atexit.register(inference_pool.shutdown)
 model_points = np.array([
     (0.0, 0.0, 0.0),
     (0.0, -330.0, -65.0),
@@ -385,19 +2804,389 @@ model_points = np.array([
 ], dtype=np.float64)
 landmark_ids = [1, 152, 263, 33, 287, 57]
 YAW_THRESHOLD, PITCH_THRESHOLD, ROLL_THRESHOLD = 30, 20, 30
+FORWARD_DIRECTION = "Looking Forward"
+NO_FACE_DIRECTION = "ALERT: No face detected"
 
-@app.route('/detect-head', methods=['POST'])
-def detect_head():
-    if face_mesh is None:
-        return jsonify({'error': 'Face mesh detection not available'}), 503
-    
-    file = request.files['image']
+# Head-pose alert rules in priority order; margin lowers every threshold (for hysteresis)
+HEAD_POSE_RULES = OrderedDict([
+    ("ALERT: Looking Right", lambda yaw, pitch, roll, margin: yaw > YAW_THRESHOLD - margin),
+    ("ALERT: Looking Left", lambda yaw, pitch, roll, margin: yaw < -(YAW_THRESHOLD - margin)),
+    ("ALERT: Looking Down", lambda yaw, pitch, roll, margin: pitch > PITCH_THRESHOLD - margin),
+    ("ALERT: Looking Up", lambda yaw, pitch, roll, margin: pitch < -(PITCH_THRESHOLD - margin)),
+    ("ALERT: Tilting Head", lambda yaw, pitch, roll, margin: abs(roll) > ROLL_THRESHOLD - margin),
+])
+
+def classify_head_pose(yaw, pitch, roll, current=None, margin=0.0):
+    """
+    Direction for a set of angles. If current is an alert direction it is kept while
+    its own rule still holds with the thresholds lowered by margin.
+    """
+    if current in HEAD_POSE_RULES and HEAD_POSE_RULES[current](yaw, pitch, roll, margin):
+        return current
+    for direction, rule in HEAD_POSE_RULES.items():
+        if rule(yaw, pitch, roll, 0.0):
+            return direction
+    return FORWARD_DIRECTION
+
+# Server-side debouncing of head-pose alerts. Angles are smoothed with a time-based
+# EMA (time constant HEAD_POSE_SMOOTHING_S); an alert direction is left only once the
+# angle is HEAD_POSE_HYSTERESIS_DEG back inside its threshold. A new direction must
+# hold for HEAD_POSE_MIN_DWELL_S (HEAD_POSE_RELEASE_S to return to forward) before
+# it is committed, and one alert document is written per sustained episode.
+HEAD_POSE_SMOOTHING_S = float(os.environ.get('HEAD_POSE_SMOOTHING_S', 1.0))
+HEAD_POSE_HYSTERESIS_DEG = float(os.environ.get('HEAD_POSE_HYSTERESIS_DEG', 5.0))
+HEAD_POSE_MIN_DWELL_S = float(os.environ.get('HEAD_POSE_MIN_DWELL_S', 3.0))
+HEAD_POSE_RELEASE_S = float(os.environ.get('HEAD_POSE_RELEASE_S', 1.0))
+# Episodes of students whose frames stop arriving are closed at their last frame
+HEAD_POSE_STALE_S = float(os.environ.get('HEAD_POSE_STALE_S', 30.0))
+HEAD_POSE_SWEEP_INTERVAL_S = 5.0
+
+class HeadPoseTracker:
+    """
+    Per-student temporal state machine over per-frame head-pose estimates.
+    update() is called once per analysed frame and returns the committed state;
+    episode start/end are written through the alert writer.
+    """
+    def __init__(self, smoothing_s=1.0, hysteresis_deg=5.0, min_dwell_s=3.0, release_s=1.0, stale_s=30.0):
+        self.smoothing_s = max(1e-3, float(smoothing_s))
+        self.hysteresis = float(hysteresis_deg)
+        self.min_dwell = float(min_dwell_s)
+        self.release = float(release_s)
+        self.stale = float(stale_s)
+        self._students = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        # Counters reported by /inference-stats
+        self._frames = 0
+        self._episodes_opened = 0
+        self._episodes_closed = 0
+
+    def _new_state(self):
+        return {
+            'angles': None,
+            'last_seen': None,
+            'state': FORWARD_DIRECTION,
+            'candidate': None,
+            'candidate_since': None,
+            'episode': None
+        }
+
+    def update(self, student_id, exam_id, angles, now=None):
+        """
+        Feed one frame: angles is (yaw, pitch, roll), or None when no face was found.
+        Returns a dict with the committed alert_state, smoothed angles and open episode.
+        """
+        now = time.time() if now is None else now
+        actions = []
+        with self._lock:
+            self._frames += 1
+            key = (exam_id, student_id)
+            st = self._students.get(key)
+            if st is None or (st['last_seen'] is not None and now - st['last_seen'] > self.stale):
+                if st is not None and st['episode'] is not None:
+                    actions.append(self._close_episode(st, st['last_seen']))
+                st = self._students[key] = self._new_state()
+
+            if angles is None:
+                observed = NO_FACE_DIRECTION
+            else:
+                angles = np.asarray(angles, dtype=np.float64)
+                if st['angles'] is None:
+                    st['angles'] = angles
+                else:
+                    alpha = 1.0 - np.exp(-(now - st['last_seen']) / self.smoothing_s)
+                    st['angles'] = st['angles'] + alpha * (angles - st['angles'])
+                observed = classify_head_pose(*st['angles'], current=st['state'], margin=self.hysteresis)
+            st['last_seen'] = now
+
+            if observed == st['state']:
+                st['candidate'] = None
+            else:
+                if observed != st['candidate']:
+                    st['candidate'], st['candidate_since'] = observed, now
+                dwell = self.release if observed == FORWARD_DIRECTION else self.min_dwell
+                if now - st['candidate_since'] >= dwell:
+                    # The change is backdated to when it was first observed
+                    changed_at = st['candidate_since']
+                    if st['episode'] is not None:
+                        actions.append(self._close_episode(st, changed_at))
+                    st['state'], st['candidate'] = observed, None
+                    if observed != FORWARD_DIRECTION:
+                        actions.append(self._open_episode(st, student_id, exam_id, changed_at))
+
+            episode = st['episode']
+            if episode is not None:
+                episode['frames'] += 1
+                if observed == st['state'] != NO_FACE_DIRECTION:
+                    episode['peak'] = np.maximum(episode['peak'], np.abs(st['angles']))
+            result = {
+                'alert_state': st['state'],
+                'smoothed': None if st['angles'] is None else dict(zip(('yaw', 'pitch', 'roll'), map(float, st['angles']))),
+                'episode': None if episode is None else {
+                    'id': str(episode['id']),
+                    'direction': episode['direction'],
+                    'started_at': datetime.fromtimestamp(episode['started_at']).isoformat()
+                }
+            }
+            if now - self._last_sweep >= HEAD_POSE_SWEEP_INTERVAL_S:
+                actions.extend(self._sweep(now))
+
+        # Database and event hub calls happen outside the tracker lock
+        for action in actions:
+            action()
+        return result
+
+    def _open_episode(self, st, student_id, exam_id, started_at):
+        episode_id = ObjectId()
+        st['episode'] = {
+            'id': episode_id,
+            'student_id': student_id,
+            'exam_id': exam_id,
+            'direction': st['state'],
+            'started_at': started_at,
+            'frames': 0,
+            'peak': np.zeros(3)
+        }
+        self._episodes_opened += 1
+        started = datetime.fromtimestamp(started_at)
+        doc = {
+            "_id": episode_id,
+            "student_id": student_id,
+            "exam_id": exam_id,
+            "direction": st['state'],
+            "alert_time": started,
+            "details": {
+                "type": "head_pose",
+                "status": "active",
+                "started_at": started.isoformat(),
+                "ended_at": None,
+                "smoothed": None if st['state'] == NO_FACE_DIRECTION else dict(zip(('yaw', 'pitch', 'roll'), map(float, st['angles'])))
+            },
+            "created_at": datetime.now()
+        }
+        return lambda: record_alert(doc, event_type='head')
+
+    def _close_episode(self, st, ended_at):
+        episode, st['episode'] = st['episode'], None
+        self._episodes_closed += 1
+        started_at = episode['started_at']
+        ended = datetime.fromtimestamp(max(ended_at, started_at))
+        fields = {
+            "details.status": "ended",
+            "details.ended_at": ended.isoformat(),
+            "details.duration_s": round(max(0.0, ended_at - started_at), 3),
+            "details.frames": episode['frames'],
+        }
+        if episode['direction'] != NO_FACE_DIRECTION:
+            fields["details.peak"] = dict(zip(('yaw', 'pitch', 'roll'), map(float, episode['peak'])))
+        def write():
+            # exam_id in the filter also lets the writer bump that exam's data version
+            alert_writer.submit_update('alerts', {'_id': episode['id'], 'exam_id': episode['exam_id']}, {'$set': fields})
+            event_hub.publish('head', {
+                'type': 'head',
+                'student_id': episode['student_id'],
+                'exam_id': episode['exam_id'],
+                'episode_id': str(episode['id']),
+                'direction': episode['direction'],
+                'status': 'ended',
+                'ended_at': fields['details.ended_at'],
+                'duration_s': fields['details.duration_s']
+            })
+        return write
+
+    def _sweep(self, now):
+        """Close and forget students whose frames stopped arriving"""
+        self._last_sweep = now
+        actions = []
+        for key, st in list(self._students.items()):
+            if now - st['last_seen'] > self.stale:
+                if st['episode'] is not None:
+                    actions.append(self._close_episode(st, st['last_seen']))
+                del self._students[key]
+        return actions
+
+    def reset(self, exam_id, student_id=None):
+        """Forget tracker state (used when exam data is reset)"""
+        with self._lock:
+            for key in list(self._students):
+                if key[0] == exam_id and (student_id is None or key[1] == student_id):
+                    del self._students[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_students': len(self._students),
+                'open_episodes': sum(1 for st in self._students.values() if st['episode'] is not None),
+                'frames': self._frames,
+                'episodes_opened': self._episodes_opened,
+                'episodes_closed': self._episodes_closed
+            }
+
+head_pose_tracker = HeadPoseTracker(
+    HEAD_POSE_SMOOTHING_S, HEAD_POSE_HYSTERESIS_DEG, HEAD_POSE_MIN_DWELL_S,
+    HEAD_POSE_RELEASE_S, HEAD_POSE_STALE_S
+)
+
+class DecodedFrame:
+    """
+    A webcam frame decoded once per request.
+    The RGB and grayscale buffers are converted lazily and then shared by
+    every analysis that runs on the same frame.
+    """
+    def __init__(self, bgr):
+        self.bgr = bgr
+        self._rgb = None
+        self._gray = None
+        self._thumbnail = None
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @property
+    def rgb(self):
+        if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def thumbnail(self):
+        """Area-averaged grayscale thumbnail used for cheap frame-change checks"""
+        if self._thumbnail is None:
+            self._thumbnail = cv2.resize(self.gray, FRAME_GATE_SIZE, interpolation=cv2.INTER_AREA)
+        return self._thumbnail
+
+# Frame-change gating: each (student, signal) keeps the thumbnail of the frame its
+# last result was computed on. If a new frame's thumbnail differs from it by less than
+# FRAME_GATE_DIFF_THRESHOLD (mean absolute gray-level difference) and the result is
+# younger than FRAME_GATE_MAX_AGE_S, that result is reused instead of running inference.
+FRAME_GATE_ENABLED = os.environ.get('FRAME_GATE_ENABLED', '1') != '0'
+FRAME_GATE_SIZE = (32, 24)
+FRAME_GATE_DIFF_THRESHOLD = float(os.environ.get('FRAME_GATE_DIFF_THRESHOLD', 4.0))
+FRAME_GATE_MAX_AGE_S = float(os.environ.get('FRAME_GATE_MAX_AGE_S', 10.0))
+FRAME_GATE_MAX_ENTRIES = int(os.environ.get('FRAME_GATE_MAX_ENTRIES', 4096))
+
+class FrameChangeGate:
+    """
+    Per-student result cache keyed on frame content. Results served from the cache
+    are marked cached=True; anonymous requests are never gated.
+    """
+    def __init__(self, diff_threshold=4.0, max_age_s=10.0, max_entries=4096, enabled=True):
+        self.diff_threshold = float(diff_threshold)
+        self.max_age = float(max_age_s)
+        self.max_entries = max(1, int(max_entries))
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._misses = {}
+
+    def run(self, key, signal, frame, compute):
+        """Return compute()'s (result, status), or the cached result if the frame has not changed"""
+        if not self.enabled or not key or key == 'unknown':
+            return compute()
+        thumbnail = frame.thumbnail
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((key, signal))
+            if entry is not None:
+                ref_thumbnail, result, stored_at = entry
+                if now - stored_at <= self.max_age and cv2.absdiff(thumbnail, ref_thumbnail).mean() <= self.diff_threshold:
+                    self._hits[signal] = self._hits.get(signal, 0) + 1
+                    return dict(result, cached=True), 200
+            self._misses[signal] = self._misses.get(signal, 0) + 1
+
+        result, status_code = compute()
+        if status_code == 200:
+            with self._lock:
+                self._entries[(key, signal)] = (thumbnail, result, now)
+                self._entries.move_to_end((key, signal))
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return dict(result, cached=False), status_code
+
+    def invalidate(self, key, signal=None):
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == key and (signal is None or k[1] == signal)]:
+                del self._entries[entry_key]
+
+    def stats(self):
+        with self._lock:
+            signals = sorted(set(self._hits) | set(self._misses))
+            per_signal = {}
+            for signal in signals:
+                hits, misses = self._hits.get(signal, 0), self._misses.get(signal, 0)
+                per_signal[signal] = {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses)}
+            total_hits, total_misses = sum(self._hits.values()), sum(self._misses.values())
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'diff_threshold': self.diff_threshold,
+                'max_age_s': self.max_age,
+                'hits': total_hits,
+                'misses': total_misses,
+                'hit_rate': (total_hits / (total_hits + total_misses)) if (total_hits + total_misses) else 0.0,
+                'signals': per_signal
+            }
+
+frame_gate = FrameChangeGate(FRAME_GATE_DIFF_THRESHOLD, FRAME_GATE_MAX_AGE_S, FRAME_GATE_MAX_ENTRIES, FRAME_GATE_ENABLED)
+
+def decode_frame(file):
+    """Decode an uploaded image file into a DecodedFrame (None if decoding fails)"""
     npimg = np.frombuffer(file.read(), np.uint8)
     frame = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-    h, w = frame.shape[:2]
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = face_mesh.process(rgb)
-    direction, yaw, pitch, roll = "ALERT: No face detected", 0, 0, 0
+    if frame is None:
+        return None
+    return DecodedFrame(frame)
+
+def analyze_head_pose(frame, student_id=None, exam_id=None):
+    """
+    Estimate head pose for a decoded frame using the student's own FaceMesh graph
+    (reusing the last estimate if the frame has not changed). With a student_id the
+    frame also feeds the head-pose tracker, which adds the debounced
+    alert_state/episode and writes one alert per sustained episode.
+    Returns: (result_dict, http_status)
+    """
+    if not mediapipe_engine.wait():
+        return {'error': 'Face mesh detection not available'}, 503
+
+    result, _ = frame_gate.run(student_id, 'head', frame, lambda: (estimate_head_pose(frame, student_id), 200))
+    if student_id and student_id != 'unknown':
+        face_found = result['direction'] != NO_FACE_DIRECTION
+        result.update(head_pose_tracker.update(
+            student_id, exam_id or 'exam_2025_ai',
+            (result['yaw'], result['pitch'], result['roll']) if face_found else None
+        ))
+    return result, 200
+
+def estimate_head_pose(frame, student_id=None):
+    """Per-frame FaceMesh + solvePnP head pose: direction and yaw/pitch/roll in degrees"""
+    if inference_pool is not None:
+        result, face_box = inference_pool.run('head_pose', frame.rgb, student_id)
+    else:
+        result, face_box = head_pose_from_rgb(frame.rgb, student_id)
+    # Hand the landmark bounding box to the face tracker so the next ROI
+    # extraction for this student starts from a window around it
+    if face_box is not None:
+        face_box_tracker.update(student_id, face_box)
+    return result
+
+def head_pose_from_rgb(rgb, student_id=None):
+    """
+    FaceMesh + solvePnP on an RGB frame with the student's own graph (in this process)
+    Returns: (result_dict, landmark bounding box (x, y, w, h) or None)
+    """
+    h, w = rgb.shape[:2]
+    with mediapipe_pool.face_mesh(student_id) as face_mesh:
+        results = face_mesh.process(rgb)
+    direction, yaw, pitch, roll = NO_FACE_DIRECTION, 0, 0, 0
+    face_box = None
 
     if results.multi_face_landmarks:
         face_landmarks = results.multi_face_landmarks[0]
@@ -407,6 +3196,12 @@ def detect_head():
             x, y = int(pt.x * w), int(pt.y * h)
             image_points.append((x, y))
         image_points = np.array(image_points, dtype=np.float64)
+        xs = np.array([pt.x for pt in face_landmarks.landmark]) * w
+        ys = np.array([pt.y for pt in face_landmarks.landmark]) * h
+        x0, y0 = max(0, int(xs.min())), max(0, int(ys.min()))
+        x1, y1 = min(w, int(xs.max())), min(h, int(ys.max()))
+        if x1 > x0 and y1 > y0:
+            face_box = (x0, y0, x1 - x0, y1 - y0)
         focal_length = w
         center = (w / 2, h / 2)
         camera_matrix = np.array([
@@ -420,27 +3215,23 @@ def detect_head():
         rmat, _ = cv2.Rodrigues(rotation_vector)
         angles, _, _, _, _, _ = cv2.RQDecomp3x3(rmat)
         pitch, yaw, roll = angles
-        direction = "Looking Forward"
-        if yaw > YAW_THRESHOLD:
-            direction = "ALERT: Looking Right"
-        elif yaw < -YAW_THRESHOLD:
-            direction = "ALERT: Looking Left"
-        elif pitch > PITCH_THRESHOLD:
-            direction = "ALERT: Looking Down"
-        elif pitch < -PITCH_THRESHOLD:
-            direction = "ALERT: Looking Up"
-        elif abs(roll) > ROLL_THRESHOLD:
-            direction = "ALERT: Tilting Head"
-
-    return jsonify({'direction': direction, 'yaw': float(yaw), 'pitch': float(pitch), 'roll': float(roll)})
+        direction = classify_head_pose(yaw, pitch, roll)
 
-try:
-    mp_face_detection = mp.solutions.face_detection
-    face_detection = mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5)
-except Exception as e:
-    print(f"Warning: Failed to initialize MediaPipe Face Detection: {e}")
-    mp_face_detection = None
-    face_detection = None
+    return {'direction': direction, 'yaw': float(yaw), 'pitch': float(pitch), 'roll': float(roll)}, face_box
+
+@app.route('/detect-head', methods=['POST'])
+def detect_head():
+    if not mediapipe_engine.wait():
+        return jsonify({'error': 'Face mesh detection not available'}), 503
+    
+    frame = decode_frame(request.files['image'])
+    if frame is None:
+        return jsonify({'error': 'Failed to decode image'}), 400
+    student_id, exam_id = request.form.get('student_id'), request.form.get('exam_id') or 'exam_2025_ai'
+    result, status_code = analyze_head_pose(frame, student_id, exam_id)
+    if status_code == 200 and student_id:
+        result['next_interval_ms'] = capture_cadence.observe(student_id, exam_id, 'head', is_anomalous('head', result))
+    return jsonify(result), status_code
 
 def preprocess_face_image(gray_face, target_size=(200, 200)):
     """
@@ -462,45 +3253,218 @@ def preprocess_face_image(gray_face, target_size=(200, 200)):
     
     return denoised
 
-def extract_face_roi(frame, use_multiple_detections=True):
+# Haar cascades are not thread-safe, so each request thread loads its own once
+_haar_local = threading.local()
+
+def get_face_cascade():
+    cascade = getattr(_haar_local, 'face_cascade', None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        _haar_local.face_cascade = cascade
+    return cascade
+
+# Face box tracking: the last face box per student is searched first inside a window
+# padded by FACE_TRACK_PADDING on each side, downscaled so the face is about
+# FACE_TRACK_DETECT_WIDTH px wide. A full-frame search only runs when tracking is lost
+# or the box is older than FACE_TRACK_MAX_AGE_S.
+FACE_TRACK_PADDING = float(os.environ.get('FACE_TRACK_PADDING', 0.5))
+FACE_TRACK_DETECT_WIDTH = int(os.environ.get('FACE_TRACK_DETECT_WIDTH', 96))
+FACE_TRACK_MAX_AGE_S = float(os.environ.get('FACE_TRACK_MAX_AGE_S', 5.0))
+FACE_TRACK_MAX_ENTRIES = 4096
+HAAR_MIN_FACE_SIZE = 80
+# Smallest window the frontal-face cascade was trained on
+HAAR_WINDOW_SIZE = 24
+
+class FaceBoxTracker:
+    """Last known face box (x, y, w, h) per student, shared by head pose and face ROI extraction"""
+    def __init__(self, max_age_s=5.0, max_entries=4096):
+        self.max_age = float(max_age_s)
+        self.max_entries = max_entries
+        self._boxes = OrderedDict()
+        self._lock = threading.Lock()
+        # Counters reported by /inference-stats
+        self._tracked = 0
+        self._full_searches = 0
+        self._lost = 0
+
+    def get(self, key):
+        if not key or key == 'unknown':
+            return None
+        with self._lock:
+            entry = self._boxes.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.max_age:
+                return None
+            return entry[0]
+
+    def update(self, key, box):
+        if not key or key == 'unknown':
+            return
+        with self._lock:
+            self._boxes[key] = (tuple(int(v) for v in box), time.monotonic())
+            self._boxes.move_to_end(key)
+            while len(self._boxes) > self.max_entries:
+                self._boxes.popitem(last=False)
+
+    def forget(self, key):
+        with self._lock:
+            if self._boxes.pop(key, None) is not None:
+                self._lost += 1
+
+    def count(self, tracked):
+        with self._lock:
+            if tracked:
+                self._tracked += 1
+            else:
+                self._full_searches += 1
+
+    def stats(self):
+        with self._lock:
+            total = self._tracked + self._full_searches
+            return {
+                'tracked_students': len(self._boxes),
+                'tracked_searches': self._tracked,
+                'full_frame_searches': self._full_searches,
+                'tracking_lost': self._lost,
+                'tracked_rate': (self._tracked / total) if total else 0.0
+            }
+
+face_box_tracker = FaceBoxTracker(FACE_TRACK_MAX_AGE_S, FACE_TRACK_MAX_ENTRIES)
+
+def detect_faces_in_window(gray, box):
+    """Haar search in a padded, downscaled window around box; faces in full-frame coordinates"""
+    x, y, w, h = box
+    pad_x, pad_y = int(w * FACE_TRACK_PADDING), int(h * FACE_TRACK_PADDING)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(gray.shape[1], x + w + pad_x), min(gray.shape[0], y + h + pad_y)
+    if x1 - x0 < HAAR_WINDOW_SIZE or y1 - y0 < HAAR_WINDOW_SIZE:
+        return []
+    window = gray[y0:y1, x0:x1]
+    scale = min(1.0, FACE_TRACK_DETECT_WIDTH / float(w))
+    if scale < 1.0:
+        window = cv2.resize(window, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    # Allow the face to shrink or grow by ~40% between frames
+    min_size = max(HAAR_WINDOW_SIZE, int(w * scale * 0.6), int(HAAR_MIN_FACE_SIZE * scale))
+    faces = get_face_cascade().detectMultiScale(
+        window,
+        scaleFactor=1.1,
+        minNeighbors=5,
+        minSize=(min_size, min_size)
+    )
+    return [
+        (x0 + int(fx / scale), y0 + int(fy / scale), int(fw / scale), int(fh / scale))
+        for (fx, fy, fw, fh) in faces
+    ]
+
+def extract_face_roi(frame, use_multiple_detections=True, gray=None, track_key=None):
     """
     Extract face ROI with improved accuracy using multiple detection methods
+    Pass `gray` when the grayscale frame is already available to skip the conversion.
+    With a `track_key` the student's last face box is searched first.
     Returns: (face_roi, success_flag)
     """
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if gray is None:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     
-    # Method 1: Haar Cascade (fast and reliable)
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    face_rects = face_cascade.detectMultiScale(
-        gray,
-        scaleFactor=1.1,  # More granular search (reduced from 1.3)
-        minNeighbors=5,   # More strict detection
-        minSize=(80, 80)  # Minimum face size
-    )
+    face_rects = []
+    tracked_box = face_box_tracker.get(track_key)
+    if tracked_box is not None:
+        face_rects = detect_faces_in_window(gray, tracked_box)
+        face_box_tracker.count(tracked=True)
+    
+    if len(face_rects) == 0:
+        # Method 1: Haar Cascade (fast and reliable) over the whole frame
+        face_rects = get_face_cascade().detectMultiScale(
+            gray,
+            scaleFactor=1.1,  # More granular search (reduced from 1.3)
+            minNeighbors=5,   # More strict detection
+            minSize=(HAAR_MIN_FACE_SIZE, HAAR_MIN_FACE_SIZE)  # Minimum face size
+        )
+        if track_key:
+            face_box_tracker.count(tracked=False)
     
     if len(face_rects) > 0:
         # Get largest face
-        (x, y, w, h) = max(face_rects, key=lambda r: r[2] * r[3])
-        
-        # Add padding to include more context (10% padding)
-        padding = int(w * 0.1)
-        x = max(0, x - padding)
-        y = max(0, y - padding)
-        w = min(gray.shape[1] - x, w + 2 * padding)
-        h = min(gray.shape[0] - y, h + 2 * padding)
-        
-        face_roi = gray[y:y+h, x:x+w]
-        
-        # Preprocess the face
-        processed_face = preprocess_face_image(face_roi)
-        
-        return processed_face, True
+        box = max(face_rects, key=lambda r: r[2] * r[3])
+        face_box_tracker.update(track_key, box)
+        return crop_face_roi(gray, box), True
     
+    if track_key:
+        face_box_tracker.forget(track_key)
     return None, False
 
+def crop_face_roi(gray, box):
+    """Crop a face box (with 10% context padding) from the gray frame and preprocess it for LBPH"""
+    x, y, w, h = (int(v) for v in box)
+    
+    # Add padding to include more context (10% padding)
+    padding = int(w * 0.1)
+    x = max(0, x - padding)
+    y = max(0, y - padding)
+    w = min(gray.shape[1] - x, w + 2 * padding)
+    h = min(gray.shape[0] - y, h + 2 * padding)
+    
+    face_roi = gray[y:y+h, x:x+w]
+    
+    # Preprocess the face
+    return preprocess_face_image(face_roi)
+
+# LBPH ROIs are cropped straight from the MediaPipe detection box; the Haar cascade
+# only runs when FACE_ROI_SOURCE=haar or (with FACE_ROI_HAAR_FALLBACK) when the box is unusable
+FACE_ROI_SOURCE = os.environ.get('FACE_ROI_SOURCE', 'mediapipe')
+FACE_ROI_HAAR_FALLBACK = os.environ.get('FACE_ROI_HAAR_FALLBACK', '1') != '0'
+# MediaPipe boxes are slightly larger and lower than the Haar boxes existing enrollments
+# were cropped from; this maps them onto the same framing so LBPH distances stay comparable
+MEDIAPIPE_BOX_SCALE = 0.93
+MEDIAPIPE_BOX_SHIFT_Y = -0.065
+MEDIAPIPE_MIN_FACE_SIZE = 48
+
+def detect_face_boxes(rgb, key=None):
+    """MediaPipe face detection, in an inference worker if enabled: relative boxes as below"""
+    if inference_pool is not None:
+        return inference_pool.run('face_boxes', rgb, key)
+    return face_boxes_from_rgb(rgb, key)
+
+def face_boxes_from_rgb(rgb, key=None):
+    """MediaPipe face detection in this process: relative (xmin, ymin, width, height) per face"""
+    with mediapipe_pool.face_detection(key) as face_detection:
+        results = face_detection.process(rgb)
+    return [
+        (bbox.xmin, bbox.ymin, bbox.width, bbox.height)
+        for bbox in (detection.location_data.relative_bounding_box for detection in results.detections or [])
+    ]
+
+def mediapipe_face_box(relative_box, frame_shape):
+    """Square pixel box (x, y, w, h) for a MediaPipe detection in Haar framing; None if unusable"""
+    frame_h, frame_w = frame_shape[:2]
+    xmin, ymin, width, height = relative_box
+    w, h = width * frame_w, height * frame_h
+    cx = xmin * frame_w + w / 2
+    cy = ymin * frame_h + h / 2 + MEDIAPIPE_BOX_SHIFT_Y * h
+    side = max(w, h) * MEDIAPIPE_BOX_SCALE
+    x0, y0 = max(0, int(round(cx - side / 2))), max(0, int(round(cy - side / 2)))
+    x1, y1 = min(frame_w, int(round(cx + side / 2))), min(frame_h, int(round(cy + side / 2)))
+    if min(x1 - x0, y1 - y0) < MEDIAPIPE_MIN_FACE_SIZE:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
+
+def face_roi_from_detection(frame, gray, relative_box, track_key=None):
+    """
+    Single face-detection stage: crop the LBPH ROI from the MediaPipe detection that
+    was already run, falling back to the (tracked) Haar search if configured
+    Returns: (face_roi, success_flag)
+    """
+    if FACE_ROI_SOURCE == 'mediapipe':
+        box = mediapipe_face_box(relative_box, gray.shape)
+        if box is not None:
+            face_box_tracker.update(track_key, box)
+            return crop_face_roi(gray, box), True
+        if not FACE_ROI_HAAR_FALLBACK:
+            return None, False
+    return extract_face_roi(frame, gray=gray, track_key=track_key)
+
 @app.route('/register-face', methods=['POST'])
 def register_face():
-    if face_detection is None:
+    if not mediapipe_engine.wait():
         return jsonify({'error': 'Face detection not available'}), 503
     
     global face_labels, label_counter
@@ -530,33 +3494,39 @@ def register_face():
     if rgb is None or rgb.size == 0:
         return jsonify({'status': 'no_face'})
     
-    results = face_detection.process(rgb)
-    if results.detections:
-        if len(results.detections) == 1:
+    face_boxes = detect_face_boxes(rgb, roll_number)
+    if face_boxes:
+        if len(face_boxes) == 1:
             # Extract and preprocess face
-            face_roi, success = extract_face_roi(frame)
+            face_roi, success = face_roi_from_detection(frame, gray, face_boxes[0], track_key=roll_number)
             if not success or face_roi is None:
                 return jsonify({'status': 'no_face'})
             
             registered_faces.add(roll_number)
             
             # Assign label ID for this student
-            if roll_number not in face_labels:
-                face_labels[roll_number] = label_counter
-                label_counter += 1
+            with face_model_lock:
+                if roll_number not in face_labels:
+                    face_labels[roll_number] = label_counter
+                    label_counter += 1
+                    face_gallery.set_roll_numbers(face_labels)
+                
+                label_id = face_labels[roll_number]
             
-            label_id = face_labels[roll_number]
+            face_roi_cache[(roll_number, exam_id)] = face_roi
             
             database = get_db_connection()
             if database is not None:
                 try:
                     success, encoded_image = cv2.imencode('.jpg', frame)
                     if success:
-                        # Store image and face descriptor
+                        # Store image, preprocessed ROI and face descriptor
                         face_doc = {
                             'roll_number': roll_number,
                             'exam_id': exam_id,
                             'image_data': Binary(encoded_image.tobytes()),
+                            'roi_data': Binary(face_roi.tobytes()),
+                            'roi_shape': list(face_roi.shape),
                             'label_id': label_id,
                             'brightness': float(brightness),
                             'sharpness': float(laplacian_var),
@@ -567,90 +3537,182 @@ def register_face():
                             {'$set': face_doc},
                             upsert=True
                         )
-                        
-                        # Retrain recognizer with all stored faces
-                        retrain_face_recognizer(database)
-                        
                 except Exception as e:
                     print(f"Error storing face image: {e}")
+            
+            # Add this face to the recognizer without retraining on everyone else
+            enroll_face(face_roi, label_id)
+            # Drop any verdict cached before this student was (re-)registered
+            frame_gate.invalidate(roll_number, 'face')
             return jsonify({'status': 'registered'})
         else:
             return jsonify({'status': 'multiple_faces'})
     else:
         return jsonify({'status': 'no_face'})
 
+def enroll_face(face_roi, label_id):
+    """
+    Incrementally add one preprocessed face ROI's LBPH histogram to the gallery.
+    Cost is independent of how many students are already enrolled; the model
+    is persisted to MongoDB shortly afterwards by a debounced background save.
+    """
+    try:
+        hists = compute_lbph_histograms([face_roi])
+        with face_model_lock:
+            face_gallery.add(hists, [label_id])
+            if face_compaction_journal is not None:
+                face_compaction_journal.append((hists, [label_id]))
+        schedule_face_model_save()
+    except Exception as e:
+        print(f"Error enrolling face: {e}")
+
+def decode_face_roi(face_doc):
+    """Rebuild a cached ROI from a registered_faces document (None if not stored)"""
+    roi_bytes = face_doc.get('roi_data')
+    if not roi_bytes:
+        return None
+    shape = tuple(face_doc.get('roi_shape') or FACE_ROI_SIZE)
+    return np.frombuffer(roi_bytes, np.uint8).reshape(shape)
+
+def _flush_face_model_save():
+    global face_model_save_timer
+    with face_model_lock:
+        face_model_save_timer = None
+    database = get_db_connection()
+    if database is None:
+        return
+    try:
+        save_face_model(database)
+        print("✓ Saved face recognizer to MongoDB")
+    except Exception as e:
+        print(f"Error saving face recognizer: {e}")
+
+def schedule_face_model_save():
+    """Persist the model after FACE_MODEL_SAVE_DELAY_S, coalescing bursts of enrollments"""
+    global face_model_save_timer
+    with face_model_lock:
+        if face_model_save_timer is not None:
+            return
+        face_model_save_timer = threading.Timer(FACE_MODEL_SAVE_DELAY_S, _flush_face_model_save)
+        face_model_save_timer.daemon = True
+        face_model_save_timer.start()
+
 def retrain_face_recognizer(database):
-    """Retrain face recognizer with all registered faces from MongoDB"""
-    global face_recognizer
+    """
+    Full retrain (compaction) of the face recognizer from all registered faces.
+    Incremental enrollment keeps stale histograms from re-registrations and
+    deleted students; this rebuilds a clean model from the cached ROIs and only
+    re-extracts faces for legacy documents that have no stored ROI.
+    Faces enrolled while it runs are journaled and re-added after the swap.
+    """
+    global face_compaction_journal
+    with face_model_lock:
+        face_compaction_journal = []
     try:
-        # Fetch all registered faces
-        faces_cursor = database.registered_faces.find({})
+        # Fetch all registered faces, skipping the JPEG unless the ROI is missing
+        faces_cursor = database.registered_faces.find({}, {'image_data': 0})
         faces_list = []
         labels_list = []
         
         for face_doc in faces_cursor:
-            image_bytes = face_doc['image_data']
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Use improved face extraction
-            face_roi, success = extract_face_roi(img)
-            if success and face_roi is not None:
-                faces_list.append(face_roi)
-                labels_list.append(face_doc['label_id'])
+            cache_key = (face_doc.get('roll_number'), face_doc.get('exam_id'))
+            face_roi = face_roi_cache.get(cache_key)
+            if face_roi is None:
+                face_roi = decode_face_roi(face_doc)
+            if face_roi is None:
+                # Legacy document: extract once and store the ROI for next time
+                image_doc = database.registered_faces.find_one({'_id': face_doc['_id']}, {'image_data': 1})
+                if not image_doc or not image_doc.get('image_data'):
+                    continue
+                nparr = np.frombuffer(image_doc['image_data'], np.uint8)
+                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                if img is None:
+                    continue
+                face_roi, success = extract_face_roi(img)
+                if not success or face_roi is None:
+                    continue
+                database.registered_faces.update_one(
+                    {'_id': face_doc['_id']},
+                    {'$set': {'roi_data': Binary(face_roi.tobytes()), 'roi_shape': list(face_roi.shape)}}
+                )
+            face_roi_cache[cache_key] = face_roi
+            faces_list.append(face_roi)
+            labels_list.append(face_doc['label_id'])
         
         if len(faces_list) > 0:
-            # Train recognizer
-            face_recognizer.train(faces_list, np.array(labels_list))
+            # Build the fresh histograms off to the side, then swap them in
+            compacted = compute_lbph_histograms(faces_list)
+            with face_model_lock:
+                face_gallery.reset(compacted, labels_list)
+                for hists, labels in face_compaction_journal:
+                    face_gallery.add(hists, labels)
+                face_compaction_journal = None
+                face_gallery.set_roll_numbers(face_labels)
             
             # Save model to MongoDB
-            face_recognizer.write('temp_model.yml')
-            with open('temp_model.yml', 'rb') as f:
-                model_bytes = f.read()
-            os.remove('temp_model.yml')
-            
-            database.face_models.update_one(
-                {'model_type': 'lbph_primary'},
-                {'$set': {
-                    'model_data': model_bytes,
-                    'labels': face_labels,
-                    'label_counter': label_counter,
-                    'updated_at': datetime.now()
-                }},
-                upsert=True
-            )
+            save_face_model(database)
             print(f"✓ Retrained face recognizer with {len(faces_list)} faces")
+        return len(faces_list)
     except Exception as e:
         print(f"Error retraining face recognizer: {e}")
+        return 0
+    finally:
+        with face_model_lock:
+            face_compaction_journal = None
+
+def start_face_model_compaction():
+    """Run retrain_face_recognizer in a background thread (False if one is already running)"""
+    global face_model_compaction_thread
+    database = get_db_connection()
+    if database is None:
+        return False
+    with face_model_lock:
+        if face_model_compaction_thread is not None and face_model_compaction_thread.is_alive():
+            return False
+        face_model_compaction_thread = threading.Thread(
+            target=retrain_face_recognizer, args=(database,), name='face-model-compaction', daemon=True
+        )
+        face_model_compaction_thread.start()
+    return True
+
+@app.route('/api/face-model/compact', methods=['POST'])
+def compact_face_model():
+    """Start a background full retrain of the face recognizer from the cached ROIs"""
+    if get_db_connection() is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    if not start_face_model_compaction():
+        return jsonify({'status': 'error', 'message': 'Compaction already running'}), 409
+    return jsonify({'status': 'started', 'message': 'Face model compaction started'}), 202
+
+def analyze_face_verification(frame, roll_number):
+    """
+    Verify that the face in a decoded frame belongs to roll_number, reusing the last
+    verdict if the frame has not changed
+    Returns: (result_dict, http_status)
+    """
+    return frame_gate.run(roll_number, 'face', frame, lambda: run_face_verification(frame, roll_number))
+
+def run_face_verification(frame, roll_number):
+    if not face_gallery_loaded or not mediapipe_engine.wait():
+        return {'error': 'Face detection/recognition not available'}, 503
 
-@app.route('/verify-face', methods=['POST'])
-def verify_face():
-    if face_detection is None or face_recognizer is None:
-        return jsonify({'error': 'Face detection/recognition not available'}), 503
-    
-    roll_number = request.form['roll_number']
-    file = request.files['image']
-    npimg = np.frombuffer(file.read(), np.uint8)
-    frame = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    
     # First check with MediaPipe for face detection
-    results = face_detection.process(rgb)
-    if not results.detections:
-        return jsonify({'status': 'no_face'})
-    elif len(results.detections) > 1:
-        return jsonify({'status': 'multiple_faces'})
+    face_boxes = detect_face_boxes(frame.rgb, roll_number)
+    if not face_boxes:
+        return {'status': 'no_face'}, 200
+    elif len(face_boxes) > 1:
+        return {'status': 'multiple_faces'}, 200
     else:
         # Extract and preprocess face ROI
-        face_roi, success = extract_face_roi(frame)
+        face_roi, success = face_roi_from_detection(frame.bgr, frame.gray, face_boxes[0], track_key=roll_number)
         
         if not success or face_roi is None:
-            return jsonify({'status': 'no_face'})
+            return {'status': 'no_face'}, 200
         
         # Recognize face using LBPH
         if roll_number in face_labels:
             expected_label = face_labels[roll_number]
-            predicted_label, confidence = face_recognizer.predict(face_roi)
+            predicted_label, confidence = face_gallery.predict(compute_lbph_histograms([face_roi])[0])
             
             # Adaptive threshold based on confidence
             # Lower confidence = better match (LBPH uses distance metric)
@@ -658,31 +3720,46 @@ def verify_face():
             CONFIDENCE_THRESHOLD = 60  # More lenient than before
             
             if predicted_label == expected_label and confidence < CONFIDENCE_THRESHOLD:
-                return jsonify({
+                return {
                     'status': 'match',
                     'confidence': float(confidence),
                     'recognized_as': roll_number
-                })
+                }, 200
             else:
                 # Find who was recognized
-                recognized_roll = next((k for k, v in face_labels.items() if v == predicted_label), 'unknown')
+                recognized_roll = face_gallery.roll_number(predicted_label)
                 
                 # If confidence is very high (>100), it's likely a mismatch
                 # If confidence is borderline (60-80), might be lighting/angle issue
-                return jsonify({
+                return {
                     'status': 'mismatch',
                     'confidence': float(confidence),
                     'expected': roll_number,
                     'recognized_as': recognized_roll,
                     'severity': 'high' if confidence > 80 else 'medium'
-                })
+                }, 200
         else:
-            return jsonify({'status': 'not_registered', 'message': 'Student not registered for face recognition'})
+            return {'status': 'not_registered', 'message': 'Student not registered for face recognition'}, 200
+
+@app.route('/verify-face', methods=['POST'])
+def verify_face():
+    if not face_gallery_loaded or not mediapipe_engine.wait():
+        return jsonify({'error': 'Face detection/recognition not available'}), 503
+    
+    roll_number = request.form['roll_number']
+    exam_id = request.form.get('exam_id', 'exam_2025_ai')
+    frame = decode_frame(request.files['image'])
+    if frame is None:
+        return jsonify({'status': 'no_face'})
+    result, status_code = analyze_face_verification(frame, roll_number)
+    if status_code == 200:
+        result['next_interval_ms'] = capture_cadence.observe(roll_number, exam_id, 'face', is_anomalous('face', result))
+    return jsonify(result), status_code
 
 @app.route('/recognize-face', methods=['POST'])
 def recognize_face():
     """New endpoint: Recognize who is in the image without knowing their roll number"""
-    if face_detection is None or face_recognizer is None:
+    if not face_gallery_loaded or not mediapipe_engine.wait():
         return jsonify({'error': 'Face detection/recognition not available'}), 503
     
     file = request.files['image']
@@ -691,36 +3768,44 @@ def recognize_face():
     rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     
-    results = face_detection.process(rgb)
-    if not results.detections:
+    face_boxes = detect_face_boxes(rgb)
+    if not face_boxes:
         return jsonify({'status': 'no_face'})
     
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    face_rects = face_cascade.detectMultiScale(gray, 1.3, 5)
+    face_rects = []
+    if FACE_ROI_SOURCE == 'mediapipe':
+        # Every MediaPipe detection becomes a face; no second detector pass
+        face_rects = [box for box in (mediapipe_face_box(b, gray.shape) for b in face_boxes) if box is not None]
+        face_rois = [crop_face_roi(gray, box) for box in face_rects]
+    if not face_rects and (FACE_ROI_SOURCE != 'mediapipe' or FACE_ROI_HAAR_FALLBACK):
+        face_rects = get_face_cascade().detectMultiScale(gray, 1.3, 5)
+        face_rois = [crop_face_roi(gray, box) for box in face_rects]
     
     if len(face_rects) == 0:
         return jsonify({'status': 'no_face'})
     
+    try:
+        top_k = max(1, int(request.form.get('top_k', request.args.get('top_k', 1))))
+    except (TypeError, ValueError):
+        top_k = 1
+    
+    # Match every detected face against the whole gallery in one batch
+    matches = face_gallery.search(compute_lbph_histograms(face_rois), k=top_k)
+    
     recognized_faces = []
-    for (x, y, w, h) in face_rects:
-        face_roi = gray[y:y+h, x:x+w]
-        face_roi = cv2.resize(face_roi, (200, 200))
-        
-        predicted_label, confidence = face_recognizer.predict(face_roi)
-        
-        if confidence < 70:
-            recognized_roll = next((k for k, v in face_labels.items() if v == predicted_label), 'unknown')
-            recognized_faces.append({
-                'roll_number': recognized_roll,
-                'confidence': float(confidence),
-                'bbox': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)}
-            })
-        else:
-            recognized_faces.append({
-                'roll_number': 'unknown',
-                'confidence': float(confidence),
-                'bbox': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)}
-            })
+    for (x, y, w, h), candidates in zip(face_rects, matches):
+        confidence = candidates[0][2] if candidates else sys.float_info.max
+        face_result = {
+            'roll_number': candidates[0][1] if candidates and confidence < 70 else 'unknown',
+            'confidence': float(confidence),
+            'bbox': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)}
+        }
+        if top_k > 1:
+            face_result['candidates'] = [
+                {'roll_number': roll_number, 'confidence': distance}
+                for _, roll_number, distance in candidates
+            ]
+        recognized_faces.append(face_result)
     
     return jsonify({
         'status': 'success',
@@ -728,272 +3813,693 @@ def recognize_face():
         'faces': recognized_faces
     })
 
-@app.route('/detect-object', methods=['POST'])
-def detect_object():
+# Forbidden objects by COCO class id: 'cell phone' (67), 'laptop' (63), 'book' (73)
+FORBIDDEN_OBJECT_CLASSES = {67: 'cell phone', 63: 'laptop', 73: 'book'}
+FORBIDDEN_CLASS_IDS = np.array(sorted(FORBIDDEN_OBJECT_CLASSES), dtype=np.int64)
+DETECTION_MIN_CONFIDENCE = 0.3   # Reported in all_detections above this
+FORBIDDEN_MIN_CONFIDENCE = 0.4   # Forbidden objects trigger an alert above this
+
+# Compact per-frame detection result: parallel arrays of class names and
+# confidences for detections above DETECTION_MIN_CONFIDENCE, plus a boolean
+# mask marking the forbidden ones
+ObjectDetections = namedtuple('ObjectDetections', ['names', 'confidences', 'forbidden'])
+
+_class_name_table = None
+
+def get_class_name_table():
+    """Class id -> name lookup array built once from the model's label map"""
+    global _class_name_table
+    if _class_name_table is None:
+        # ONNX files exported without class-name metadata only know the forbidden classes by name
+        names = detector_class_names or FORBIDDEN_OBJECT_CLASSES
+        if not isinstance(names, dict):
+            names = dict(enumerate(names))
+        size = max(names.keys(), default=-1) + 1
+        _class_name_table = np.array([names.get(i, str(i)) for i in range(size)], dtype=object)
+    return _class_name_table
+
+def filter_object_detections(detections):
     """
-    Detect forbidden objects like cell phones and laptops using YOLOv5
+    Vectorized filtering of one frame's YOLO output
+    detections: (n, 6) array of [x1, y1, x2, y2, confidence, class]
+    Returns: ObjectDetections
     """
-    if not YOLO_AVAILABLE or model is None:
-        return jsonify({
+    detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+    confidences = detections[:, 4]
+    class_ids = detections[:, 5].astype(np.int64)
+
+    keep = confidences > DETECTION_MIN_CONFIDENCE
+    confidences = confidences[keep]
+    class_ids = class_ids[keep]
+    forbidden = np.isin(class_ids, FORBIDDEN_CLASS_IDS) & (confidences > FORBIDDEN_MIN_CONFIDENCE)
+
+    table = get_class_name_table()
+    in_table = class_ids < len(table)
+    names = np.empty(len(class_ids), dtype=object)
+    names[in_table] = table[class_ids[in_table]]
+    names[~in_table] = [str(class_id) for class_id in class_ids[~in_table]]
+    return ObjectDetections(names, confidences, forbidden)
+
+def analyze_objects(frame, student_id='unknown', exam_id='exam_2025_ai'):
+    """
+    Detect forbidden objects like cell phones and laptops in a decoded frame using YOLOv5.
+    YOLO only runs when there has been motion since the student's last object check.
+    Returns: (result_dict, http_status)
+    """
+    return frame_gate.run(student_id, 'objects', frame, lambda: run_object_detection(frame, student_id, exam_id))
+
+def run_object_detection(frame, student_id='unknown', exam_id='exam_2025_ai'):
+    if not detector_engine.wait():
+        return {
             'status': 'error', 
             'message': 'Object detection not available'
-        }), 503
+        }, 503
     
     try:
-        # Read and decode image
-        file = request.files['image']
-        npimg = np.frombuffer(file.read(), np.uint8)
-        frame = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-        
-        if frame is None:
-            return jsonify({
-                'status': 'error',
-                'message': 'Failed to decode image'
-            }), 400
-        
-        # Convert BGR to RGB (YOLO expects RGB)
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        # Run YOLO detection with proper parameters
-        results = model(rgb, size=640)  # Use 'size' parameter instead of 'imgsz'
-        
-        # Extract detection results
-        detections = results.pandas().xyxy[0]  # Get detections as pandas DataFrame
-        
-        # Define forbidden objects (COCO dataset class names)
-        # COCO class names: 'cell phone' (class 67), 'laptop' (class 63), 'book' (class 73)
-        forbidden_objects = {
-            'cell phone': 67,
-            'laptop': 63,
-            'book': 73
-        }
-        
-        detected_forbidden = []
-        all_detections = []
+        # Run YOLO detection (YOLO expects RGB) in an inference worker, or in-process
+        # where the scheduler batches this frame with other concurrent requests' frames
+        if inference_pool is not None:
+            raw_detections = inference_pool.run('objects', frame.rgb)
+        else:
+            raw_detections = yolo_scheduler.submit(frame.rgb)
+        detections = filter_object_detections(raw_detections)
         
-        for _, detection in detections.iterrows():
-            class_name = detection['name']
-            confidence = detection['confidence']
-            
-            # Store all detections with confidence > 0.3
-            if confidence > 0.3:
-                all_detections.append({
-                    'name': class_name,
-                    'confidence': float(confidence)
-                })
-            
-            # Check if it's a forbidden object with good confidence
-            if class_name in forbidden_objects and confidence > 0.4:
-                detected_forbidden.append({
-                    'name': class_name,
-                    'confidence': float(confidence)
-                })
-                print(f"⚠️ FORBIDDEN OBJECT DETECTED: {class_name} (confidence: {confidence:.2f})")
+        all_detections = [
+            {'name': name, 'confidence': float(confidence)}
+            for name, confidence in zip(detections.names, detections.confidences)
+        ]
+        detected_forbidden = [
+            {'name': name, 'confidence': float(confidence)}
+            for name, confidence in zip(detections.names[detections.forbidden], detections.confidences[detections.forbidden])
+        ]
+        for d in detected_forbidden:
+            print(f"⚠️ FORBIDDEN OBJECT DETECTED: {d['name']} (confidence: {d['confidence']:.2f})")
         
         if detected_forbidden:
-            # Log forbidden object detection to database
-            database = get_db_connection()
-            if database is not None:
-                try:
-                    student_id = request.form.get('student_id', 'unknown')
-                    exam_id = request.form.get('exam_id', 'exam_2025_ai')
-                    
-                    alert_doc = {
-                        "student_id": student_id,
-                        "exam_id": exam_id,
-                        "direction": f"ALERT: Forbidden Object - {', '.join([d['name'] for d in detected_forbidden])}",
-                        "alert_time": datetime.now(),
-                        "details": {
-                            "type": "forbidden_object",
-                            "objects": detected_forbidden,
-                            "all_detections": all_detections,
-                            "time": datetime.now().isoformat()
-                        },
-                        "created_at": datetime.now()
-                    }
-                    database.alerts.insert_one(alert_doc)
-                except Exception as e:
-                    print(f"Error logging forbidden object alert: {e}")
+            # Queue the forbidden object alert for the background writer
+            record_alert({
+                "student_id": student_id,
+                "exam_id": exam_id,
+                "direction": f"ALERT: Forbidden Object - {', '.join([d['name'] for d in detected_forbidden])}",
+                "alert_time": datetime.now(),
+                "details": {
+                    "type": "forbidden_object",
+                    "objects": detected_forbidden,
+                    "all_detections": all_detections,
+                    "time": datetime.now().isoformat()
+                },
+                "created_at": datetime.now()
+            }, event_type='object',
+                coalesce_key=('forbidden_object', tuple(sorted({d['name'] for d in detected_forbidden}))),
+                severity=max(d['confidence'] for d in detected_forbidden))
             
-            return jsonify({
+            return {
                 'status': 'forbidden_object',
                 'objects': [d['name'] for d in detected_forbidden],
                 'details': detected_forbidden,
                 'all_detections': all_detections
-            })
+            }, 200
         else:
-            return jsonify({
+            return {
                 'status': 'clear',
                 'all_detections': all_detections
-            })
+            }, 200
             
     except Exception as e:
         print(f"Object detection error: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({
+        return {
             'status': 'error',
             'message': f'Detection failed: {str(e)}'
-        }), 500
+        }, 500
 
-@app.route('/detect-audio-anomaly', methods=['POST'])
-def detect_audio_anomaly():
-    try:
-        data = request.get_json(force=True, silent=True)
-        if not data:
-            return jsonify({'status': 'error', 'message': 'No JSON payload received'}), 400
+@app.route('/detect-object', methods=['POST'])
+def detect_object():
+    """
+    Detect forbidden objects like cell phones and laptops using YOLOv5
+    """
+    if not detector_engine.wait():
+        return jsonify({
+            'status': 'error', 
+            'message': 'Object detection not available'
+        }), 503
+    
+    frame = decode_frame(request.files['image'])
+    if frame is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Failed to decode image'
+        }), 400
+    
+    student_id = request.form.get('student_id', 'unknown')
+    exam_id = request.form.get('exam_id', 'exam_2025_ai')
+    result, status_code = analyze_objects(frame, student_id, exam_id)
+    if status_code == 200 and student_id != 'unknown':
+        result['next_interval_ms'] = capture_cadence.observe(student_id, exam_id, 'objects', is_anomalous('objects', result))
+    return jsonify(result), status_code
 
-        student_id = data.get('student_id', 'unknown')
-        audio_features = data.get('audio_features', {}) or {}
+# Adaptive capture cadence: every analysis result for an identified student
+# (/analyze-frame, /detect-head, /verify-face, /detect-object, /detect-audio-anomaly)
+# carries next_interval_ms, the recommended delay before the client samples that
+# signal again. A clean streak longer than CADENCE_CLEAN_STREAK backs the interval
+# off geometrically (up to CADENCE_MAX_FACTOR x base); an anomaly raises the
+# student's risk to 1, pulling every signal towards CADENCE_MIN_FACTOR x base, and
+# risk halves every CADENCE_RISK_HALF_LIFE_S.
+CADENCE_BASE_MS = {'head': 2000, 'face': 2000, 'objects': 1500, 'audio': 2000}
+CADENCE_MIN_FACTOR = float(os.environ.get('CADENCE_MIN_FACTOR', 0.5))
+CADENCE_MAX_FACTOR = float(os.environ.get('CADENCE_MAX_FACTOR', 4.0))
+CADENCE_CLEAN_STREAK = int(os.environ.get('CADENCE_CLEAN_STREAK', 5))
+CADENCE_BACKOFF = float(os.environ.get('CADENCE_BACKOFF', 1.2))
+CADENCE_RISK_HALF_LIFE_S = float(os.environ.get('CADENCE_RISK_HALF_LIFE_S', 30))
+CADENCE_STATE_TTL_S = 600
+# Load governor: intervals are stretched by up to CADENCE_MAX_STRETCH when analysis
+# requests in flight or their smoothed latency exceed these targets
+CADENCE_TARGET_INFLIGHT = int(os.environ.get('CADENCE_TARGET_INFLIGHT', 2 * (os.cpu_count() or 1)))
+CADENCE_TARGET_LATENCY_MS = float(os.environ.get('CADENCE_TARGET_LATENCY_MS', 300))
+CADENCE_MAX_STRETCH = float(os.environ.get('CADENCE_MAX_STRETCH', 4.0))
+GOVERNED_ENDPOINTS = ('analyze_frame', 'detect_head', 'verify_face', 'detect_object', 'detect_audio_anomaly')
 
-        # Safely extract features with defaults and types
-        try:
-            volume_level = float(audio_features.get('volume_level', 0) or 0)
-        except Exception:
-            volume_level = 0.0
+class LoadGovernor:
+    """Global load signal from in-flight analysis requests and their smoothed latency"""
+    def __init__(self, target_inflight, target_latency_ms, max_stretch):
+        self.target_inflight = max(1, int(target_inflight))
+        self.target_latency = max(1.0, float(target_latency_ms)) / 1000.0
+        self.max_stretch = max(1.0, float(max_stretch))
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._latency_ema = 0.0
+
+    def begin(self):
+        with self._lock:
+            self._inflight += 1
+
+    def end(self, elapsed_s):
+        with self._lock:
+            self._inflight -= 1
+            self._latency_ema += 0.1 * (elapsed_s - self._latency_ema)
+
+    def factor(self):
+        """Multiplier >= 1 applied to every recommended interval"""
+        with self._lock:
+            pressure = max(self._inflight / self.target_inflight, self._latency_ema / self.target_latency)
+        return min(self.max_stretch, max(1.0, pressure))
+
+    def stats(self):
+        with self._lock:
+            inflight, latency = self._inflight, self._latency_ema
+        return {
+            'inflight': inflight,
+            'avg_latency_ms': latency * 1000.0,
+            'target_inflight': self.target_inflight,
+            'target_latency_ms': self.target_latency * 1000.0,
+            'stretch_factor': self.factor()
+        }
+
+load_governor = LoadGovernor(CADENCE_TARGET_INFLIGHT, CADENCE_TARGET_LATENCY_MS, CADENCE_MAX_STRETCH)
+
+@app.before_request
+def _governor_begin():
+    if request.endpoint in GOVERNED_ENDPOINTS:
+        g.governed_started = time.monotonic()
+        load_governor.begin()
+
+@app.teardown_request
+def _governor_end(exc):
+    started = g.pop('governed_started', None)
+    if started is not None:
+        load_governor.end(time.monotonic() - started)
+
+class CaptureCadence:
+    """Per-student risk level and per-signal clean streaks that drive next_interval_ms"""
+    def __init__(self, governor):
+        self.governor = governor
+        self._students = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def observe(self, student_id, exam_id, signal, anomalous, now=None):
+        """Record one analysis outcome and return the signal's next interval in ms"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            key = (exam_id, student_id)
+            st = self._students.get(key)
+            if st is None:
+                st = self._students[key] = {'risk': 0.0, 'updated': now, 'streaks': {}}
+            st['risk'] *= 0.5 ** ((now - st['updated']) / CADENCE_RISK_HALF_LIFE_S)
+            st['updated'] = now
+            if anomalous:
+                st['risk'] = 1.0
+                st['streaks'][signal] = 0
+            else:
+                st['streaks'][signal] = st['streaks'].get(signal, 0) + 1
+            streak, risk = st['streaks'][signal], st['risk']
+            if now - self._last_sweep > CADENCE_STATE_TTL_S:
+                self._last_sweep = now
+                for stale in [k for k, s in self._students.items() if now - s['updated'] > CADENCE_STATE_TTL_S]:
+                    del self._students[stale]
+        return self.interval_ms(signal, streak, risk)
+
+    def interval_ms(self, signal, streak, risk):
+        base = CADENCE_BASE_MS[signal]
+        fastest, slowest = base * CADENCE_MIN_FACTOR, base * CADENCE_MAX_FACTOR
+        calm = min(slowest, base * CADENCE_BACKOFF ** max(0, streak - CADENCE_CLEAN_STREAK))
+        interval = calm + (fastest - calm) * risk
+        return int(round(interval * self.governor.factor()))
+
+    def intervals(self, student_id, exam_id):
+        """Current recommendation for every signal without recording an observation"""
+        now = time.monotonic()
+        with self._lock:
+            st = self._students.get((exam_id, student_id))
+            if st is None:
+                streaks, risk = {}, 0.0
+            else:
+                streaks = dict(st['streaks'])
+                risk = st['risk'] * 0.5 ** ((now - st['updated']) / CADENCE_RISK_HALF_LIFE_S)
+        return {signal: self.interval_ms(signal, streaks.get(signal, 0), risk) for signal in CADENCE_BASE_MS}
+
+    def stats(self):
+        with self._lock:
+            students = len(self._students)
+            elevated = sum(1 for st in self._students.values() if st['risk'] > 0.5)
+        return {'tracked_students': students, 'elevated_risk': elevated, 'governor': self.governor.stats()}
+
+capture_cadence = CaptureCadence(load_governor)
+
+def is_anomalous(signal, result):
+    """Whether an analysis result counts against the student's clean streak"""
+    if signal == 'head':
+        return (result.get('alert_state') or result.get('direction') or '').startswith('ALERT')
+    if signal == 'face':
+        return result.get('status') in ('mismatch', 'no_face', 'multiple_faces')
+    if signal == 'objects':
+        return result.get('status') == 'forbidden_object'
+    return result.get('status') == 'anomaly_detected'
+
+# Analyses that /analyze-frame can run on a single uploaded frame
+FRAME_ANALYSES = ('head', 'face', 'objects')
+
+@app.route('/analyze-frame', methods=['POST'])
+def analyze_frame():
+    """
+    Run head pose, face verification and object detection on one uploaded frame.
+    The image is decoded once and its RGB/gray buffers are shared by every analysis.
+    Form fields:
+        image: webcam frame
+        analyses: comma-separated subset of "head,face,objects" (default: all)
+        roll_number / student_id: student identity (required for "face")
+        exam_id: exam identifier (default: exam_2025_ai)
+    """
+    if 'image' not in request.files:
+        return jsonify({'status': 'error', 'message': 'Missing image'}), 400
+
+    requested = request.form.get('analyses') or ','.join(FRAME_ANALYSES)
+    analyses = []
+    for name in requested.split(','):
+        name = name.strip().lower()
+        if name and name not in analyses:
+            analyses.append(name)
+    unknown = [name for name in analyses if name not in FRAME_ANALYSES]
+    if unknown or not analyses:
+        return jsonify({
+            'status': 'error',
+            'message': f"Unknown analyses: {', '.join(unknown)}" if unknown else 'No analyses requested',
+            'supported': list(FRAME_ANALYSES)
+        }), 400
+
+    frame = decode_frame(request.files['image'])
+    if frame is None:
+        return jsonify({'status': 'error', 'message': 'Failed to decode image'}), 400
+
+    student_id = request.form.get('student_id') or request.form.get('roll_number') or 'unknown'
+    roll_number = request.form.get('roll_number') or request.form.get('student_id')
+    exam_id = request.form.get('exam_id', 'exam_2025_ai')
+
+    response = {'status': 'ok', 'analyses': analyses}
+    for name in analyses:
+        if name == 'head':
+            result, status_code = analyze_head_pose(frame, student_id, exam_id)
+        elif name == 'face':
+            if not roll_number:
+                result, status_code = {'status': 'error', 'message': 'roll_number is required for face verification'}, 400
+            else:
+                result, status_code = analyze_face_verification(frame, roll_number)
+        else:
+            result, status_code = analyze_objects(frame, student_id, exam_id)
+        if status_code != 200:
+            result = dict(result, status_code=status_code)
+        elif student_id != 'unknown':
+            result = dict(result, next_interval_ms=capture_cadence.observe(
+                student_id, exam_id, name, is_anomalous(name, result)))
+        response[name] = result
+
+    if student_id != 'unknown':
+        response['next_interval_ms'] = capture_cadence.intervals(student_id, exam_id)
+    return jsonify(response)
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: per-engine state (pending/loading/ready/unavailable).
+    Polling it also starts any engine that has not begun loading (ENGINE_LOADING=lazy).
+    503 while an engine is still loading; 200 once all have settled, with
+    degraded=true if any of them failed to load.
+    """
+    start_engines()
+    engine_states = {name: engine.status() for name, engine in engines.items()}
+    settled = all(state['state'] in ('ready', 'unavailable') for state in engine_states.values())
+    return jsonify({
+        'ready': settled,
+        'degraded': any(state['state'] == 'unavailable' for state in engine_states.values()),
+        'engines': engine_states
+    }), 200 if settled else 503
+
+@app.route('/inference-stats', methods=['GET'])
+def inference_stats():
+    """Report inference scheduler and alert writer state (queue depth, batch sizes, latencies)"""
+    return jsonify({
+        'yolo_batching': yolo_scheduler.stats() if yolo_scheduler is not None else None,
+        'inference_workers': inference_pool.stats() if inference_pool is not None else None,
+        'mediapipe_pool': mediapipe_pool.stats(),
+        'alert_writer': alert_writer.stats(),
+        'alert_coalescer': alert_coalescer.stats(),
+        'data_versions': data_versions.stats(),
+        'teacher_sessions': teacher_sessions.stats(),
+        'event_hub': event_hub.stats(),
+        'audio_streams': audio_streams.stats(),
+        'head_pose_tracker': head_pose_tracker.stats(),
+        'capture_cadence': capture_cadence.stats(),
+        'frame_gate': frame_gate.stats(),
+        'face_tracker': face_box_tracker.stats()
+    })
+
+# Audio anomaly scoring. Thresholds apply to spectrum values normalized to 0..1
+AUDIO_VOLUME_THRESHOLD = 0.18
+AUDIO_SPEECH_PEAK_THRESHOLD = 0.45
+AUDIO_MIN_SPEECH_PEAKS = 4
+AUDIO_HIGH_VOLUME_THRESHOLD = 0.40
+AUDIO_VERY_HIGH_VOLUME = 0.55
+# Percent thresholds (user-requested)
+AUDIO_LOW_VOLUME_PERCENT = 5.0  # below 5% -> anomaly
+AUDIO_HIGH_VOLUME_PERCENT = 35.0  # above 35% -> anomaly
+AUDIO_MAX_WINDOWS = int(os.environ.get('AUDIO_MAX_WINDOWS', 64))
+AUDIO_MAX_BINS = int(os.environ.get('AUDIO_MAX_BINS', 4096))
+
+# Streaming PCM ingestion (chunked POST /stream-audio, WebSocket /ws/audio). Each connection
+# owns one AudioStreamAnalyzer: Blackman-windowed FFTs of AUDIO_STREAM_FFT_SIZE samples with
+# 50% overlap, smoothed and mapped to byte levels the way the exam page's AnalyserNode does,
+# so the volume and peaks it derives feed the same rules as the client-computed features.
+# Memory per connection is bounded by one FFT window, whatever the stream length.
+AUDIO_STREAM_ENCODINGS = ('pcm16', 'mulaw')
+AUDIO_STREAM_SAMPLE_RATES = (8000, 16000, 22050, 24000, 32000, 44100, 48000)
+AUDIO_STREAM_FFT_SIZE = int(os.environ.get('AUDIO_STREAM_FFT_SIZE', 2048))
+AUDIO_STREAM_REPORT_S = float(os.environ.get('AUDIO_STREAM_REPORT_S', 2.0))
+AUDIO_STREAM_READ_BYTES = 16 * 1024
+AUDIO_STREAM_MAX_MESSAGE_BYTES = 256 * 1024
+AUDIO_STREAM_SMOOTHING = 0.85  # smoothingTimeConstant on the exam page
+AUDIO_STREAM_DB_RANGE = (-100.0, -30.0)  # AnalyserNode minDecibels / maxDecibels
+AUDIO_STREAM_PEAK_BAND = (0.08, 0.65)  # share of the spectrum the exam page scans for peaks
+AUDIO_STREAM_PEAK_LEVEL = 75  # byte level above which a bin counts as a peak
+AUDIO_STREAM_MAX_PEAKS = 40
+# Voice activity: a frame is voiced when it is AUDIO_VAD_MARGIN_DB above the tracked noise
+# floor, louder than AUDIO_VAD_MIN_DB and carries most of its energy in the speech band.
+# A report interval with AUDIO_VAD_SPEECH_RATIO voiced frames or more is an anomaly.
+AUDIO_VAD_MARGIN_DB = 9.0
+AUDIO_VAD_MIN_DB = -50.0
+AUDIO_VAD_FLOOR_RISE = 0.01  # per frame, so the floor follows slow changes in room noise
+AUDIO_VAD_SPEECH_BAND_HZ = (80.0, 4000.0)
+AUDIO_VAD_BAND_RATIO = 0.6
+AUDIO_VAD_SPEECH_RATIO = float(os.environ.get('AUDIO_VAD_SPEECH_RATIO', 0.6))
+
+# Binary audio-feature payload (Content-Type: application/octet-stream, all little-endian):
+#   header '<4sBBHHHf': magic b'NPAF', version 1, spectrum dtype (0 = float32 in 0..1,
+#     1 = uint8 in 0..255), window count, bins per window, reserved, window duration (s)
+#   float32[windows] volume levels, uint32[windows] valid bins per window,
+#   then windows x bins spectrum values (rows are padded past their valid length)
+# student_id and exam_id travel in the query string.
+AUDIO_PAYLOAD_HEADER = struct.Struct('<4sBBHHHf')
+AUDIO_PAYLOAD_MAGIC = b'NPAF'
+AUDIO_PAYLOAD_VERSION = 1
+AUDIO_PAYLOAD_DTYPES = {0: (np.dtype('<f4'), 1.0), 1: (np.dtype('u1'), 255.0)}
+
+AudioScores = namedtuple('AudioScores', ['volumes', 'peak_counts', 'peak_ratios', 'total_peaks', 'reasons'])
+
+def parse_audio_payload(body):
+    """
+    Parse a binary audio-feature payload. The arrays are views on the request body
+    (np.frombuffer), so nothing is copied. Returns (volumes, spectra, lengths, scale, duration)
+    """
+    if len(body) < AUDIO_PAYLOAD_HEADER.size:
+        raise ValueError('audio payload is shorter than its header')
+    magic, version, dtype_code, windows, bins, _, duration = AUDIO_PAYLOAD_HEADER.unpack_from(body)
+    if magic != AUDIO_PAYLOAD_MAGIC or version != AUDIO_PAYLOAD_VERSION:
+        raise ValueError('unrecognized audio payload header')
+    if dtype_code not in AUDIO_PAYLOAD_DTYPES:
+        raise ValueError(f'unsupported spectrum dtype code {dtype_code}')
+    if not 0 < windows <= AUDIO_MAX_WINDOWS or bins > AUDIO_MAX_BINS:
+        raise ValueError(f'audio payload must carry 1-{AUDIO_MAX_WINDOWS} windows of at most {AUDIO_MAX_BINS} bins')
+    dtype, scale = AUDIO_PAYLOAD_DTYPES[dtype_code]
 
-        frequency_data = audio_features.get('frequency_data', []) or []
-        # normalize to list of floats
+    offset = AUDIO_PAYLOAD_HEADER.size
+    expected = offset + windows * 8 + windows * bins * dtype.itemsize
+    if len(body) != expected:
+        raise ValueError(f'audio payload is {len(body)} bytes, expected {expected}')
+    volumes = np.frombuffer(body, dtype='<f4', count=windows, offset=offset)
+    lengths = np.frombuffer(body, dtype='<u4', count=windows, offset=offset + windows * 4)
+    spectra = np.frombuffer(body, dtype=dtype, count=windows * bins, offset=offset + windows * 8).reshape(windows, bins)
+    return volumes, spectra, np.minimum(lengths, bins), scale, float(duration)
+
+def audio_windows_from_json(audio_features):
+    """
+    JSON audio_features (one dict, or a list of them for batch scoring) -> the same
+    (volumes, spectra, lengths, scale, duration) as parse_audio_payload.
+    Unparseable fields fall back to 0 / no peaks like the single-window handler always did
+    """
+    windows = [audio_features] if isinstance(audio_features, dict) else list(audio_features)
+    if not 0 < len(windows) <= AUDIO_MAX_WINDOWS:
+        raise ValueError(f'audio_features must carry 1-{AUDIO_MAX_WINDOWS} windows')
+
+    volumes = np.zeros(len(windows))
+    rows = []
+    for i, features in enumerate(windows):
+        features = features if isinstance(features, dict) else {}
         try:
-            frequency_data = [float(x) for x in frequency_data]
+            volumes[i] = float(features.get('volume_level', 0) or 0)
         except Exception:
-            frequency_data = []
-
+            pass
         try:
-            duration = float(audio_features.get('duration', 0) or 0)
+            row = np.asarray(features.get('frequency_data', []) or [], dtype=np.float64).ravel()
         except Exception:
-            duration = 0.0
-
-        # Tunable thresholds
-        VOLUME_THRESHOLD = 0.18
-        SPEECH_PEAK_THRESHOLD = 0.45
-        MIN_SPEECH_PEAKS = 4
-        HIGH_VOLUME_THRESHOLD = 0.40
-        VERY_HIGH_VOLUME = 0.55
-        # Percent thresholds (user-requested)
-        LOW_VOLUME_PERCENT = 5.0  # below 5% -> anomaly
-        HIGH_VOLUME_PERCENT = 35.0  # above 35% -> anomaly
-
-        anomaly_detected = False
-        anomaly_reasons = []
-
-        total_peaks = len(frequency_data)
-        speech_peaks = [f for f in frequency_data if f > SPEECH_PEAK_THRESHOLD]
-        peak_count = len(speech_peaks)
-        peak_ratio = (peak_count / total_peaks) if total_peaks > 0 else 0.0
-
-        # Debug log for incoming audio features
-        if volume_level > 0.0 or total_peaks > 0:
-            print(f"Audio - Student: {student_id}, Vol: {volume_level:.3f}, Peaks: {peak_count}/{total_peaks}, Ratio: {peak_ratio:.2f}, Dur: {duration}")
-
-        # Convert to percent for user-friendly thresholds
-        vol_pct = volume_level * 100.0
-
-        # Primary checks (priority order)
-        # User-requested: treat very low or very high voice level as anomaly
-        if vol_pct < LOW_VOLUME_PERCENT:
-            anomaly_detected = True
-            anomaly_reasons.append(f"low_volume:{vol_pct:.1f}%")
-        elif vol_pct > HIGH_VOLUME_PERCENT:
-            anomaly_detected = True
-            anomaly_reasons.append(f"high_volume:{vol_pct:.1f}%")
-        elif volume_level >= VERY_HIGH_VOLUME:
-            anomaly_detected = True
-            anomaly_reasons.append(f"very_high_volume:{volume_level:.2f}")
-        elif volume_level >= HIGH_VOLUME_THRESHOLD and (peak_count >= MIN_SPEECH_PEAKS or peak_ratio >= 0.10):
-            anomaly_detected = True
-            anomaly_reasons.append(f"clear_speech:{volume_level:.2f}:{peak_count}")
-        elif peak_count >= (MIN_SPEECH_PEAKS + 2) and peak_ratio > 0.12:
-            anomaly_detected = True
-            anomaly_reasons.append(f"speech_pattern:{peak_count}:{peak_ratio:.2f}")
-        elif volume_level >= VOLUME_THRESHOLD * 2 and peak_count >= (MIN_SPEECH_PEAKS - 1):
-            # catch shorter but loud bursts
-            anomaly_detected = True
-            anomaly_reasons.append(f"short_loud:{volume_level:.2f}")
-
-        # If anomaly detected, log to DB (if available) and return structured response
-        if anomaly_detected:
-            database = get_db_connection()
-            alert_payload = {
-                "student_id": student_id,
-                "direction": f"ALERT: Audio Anomaly - {', '.join(anomaly_reasons)}",
-                "alert_time": datetime.now(),
-                "details": {
-                    "type": "audio_anomaly",
-                    "volume_level": volume_level,
-                    "duration": duration,
-                    "peak_count": peak_count,
-                    "peak_ratio": peak_ratio,
-                    "frequency_summary": {
-                        "total_peaks": total_peaks,
-                        "speech_peaks": peak_count
-                    },
-                    "anomaly_reasons": anomaly_reasons,
-                    "time": datetime.now().isoformat()
-                },
-                "created_at": datetime.now()
-            }
+            row = np.empty(0)
+        rows.append(row[:AUDIO_MAX_BINS])
+    try:
+        duration = float((windows[0] or {}).get('duration', 0) or 0)
+    except Exception:
+        duration = 0.0
 
-            if database is not None:
-                try:
-                    database.alerts.insert_one(alert_payload)
-                    print(f"Audio anomaly logged for student {student_id}: {anomaly_reasons}")
-                except Exception as e:
-                    print(f"Error logging audio anomaly: {e}")
+    lengths = np.array([len(row) for row in rows])
+    spectra = np.zeros((len(rows), lengths.max()))
+    for i, row in enumerate(rows):
+        spectra[i, :len(row)] = row
+    return volumes, spectra, lengths, 1.0, duration
 
-            # push event to audio_event_queue for real-time streaming clients
-            try:
-                event = {
-                    'student_id': student_id,
-                    'status': 'anomaly_detected',
-                    'volume_level': volume_level,
-                    'peak_count': peak_count,
-                    'peak_ratio': peak_ratio,
-                    'anomaly_reasons': anomaly_reasons,
-                    'timestamp': datetime.now().isoformat()
-                }
-                with audio_queue_lock:
-                    audio_event_queue.append(event)
-                    # cap queue
-                    while len(audio_event_queue) > MAX_AUDIO_QUEUE:
-                        audio_event_queue.popleft()
-            except Exception as e:
-                print(f"Error pushing audio event to queue: {e}")
+def score_audio_windows(volumes, spectra, lengths, scale=1.0, voice_ratios=None):
+    """
+    Score a batch of audio windows in one pass. spectra is (windows, bins) in 0..scale with
+    row i valid up to lengths[i]. Rules are applied in priority order; only the first match
+    per window is reported, and a window with no reasons is clear.
+    voice_ratios (fraction of voiced frames, only known for server-side streams) adds a
+    lowest-priority rule for sustained speech the spectrum snapshot missed
+    """
+    volumes = np.nan_to_num(np.asarray(volumes, dtype=np.float64))
+    lengths = np.asarray(lengths, dtype=np.int64)
+    valid = np.arange(spectra.shape[1]) < lengths[:, None]
+    peak_counts = np.count_nonzero((spectra > AUDIO_SPEECH_PEAK_THRESHOLD * scale) & valid, axis=1)
+    peak_ratios = np.divide(peak_counts, lengths, out=np.zeros(len(volumes)), where=lengths > 0)
+    vol_pct = volumes * 100.0
 
-            return jsonify({
-                'status': 'anomaly_detected',
-                'volume_level': volume_level,
-                'peak_count': peak_count,
-                'peak_ratio': peak_ratio,
-                'anomaly_reasons': anomaly_reasons,
-                'message': 'Audio anomaly detected'
-            })
+    rules = np.select([
+        vol_pct < AUDIO_LOW_VOLUME_PERCENT,
+        vol_pct > AUDIO_HIGH_VOLUME_PERCENT,
+        volumes >= AUDIO_VERY_HIGH_VOLUME,
+        (volumes >= AUDIO_HIGH_VOLUME_THRESHOLD) & ((peak_counts >= AUDIO_MIN_SPEECH_PEAKS) | (peak_ratios >= 0.10)),
+        (peak_counts >= AUDIO_MIN_SPEECH_PEAKS + 2) & (peak_ratios > 0.12),
+        # catch shorter but loud bursts
+        (volumes >= AUDIO_VOLUME_THRESHOLD * 2) & (peak_counts >= AUDIO_MIN_SPEECH_PEAKS - 1),
+        np.zeros(len(volumes), dtype=bool) if voice_ratios is None else np.asarray(voice_ratios) >= AUDIO_VAD_SPEECH_RATIO
+    ], [1, 2, 3, 4, 5, 6, 7], default=0)
+
+    reasons = [[] for _ in range(len(volumes))]
+    for i in np.flatnonzero(rules):
+        rule, volume, pct, count, ratio = rules[i], volumes[i], vol_pct[i], peak_counts[i], peak_ratios[i]
+        if rule == 1:
+            reasons[i].append(f"low_volume:{pct:.1f}%")
+        elif rule == 2:
+            reasons[i].append(f"high_volume:{pct:.1f}%")
+        elif rule == 3:
+            reasons[i].append(f"very_high_volume:{volume:.2f}")
+        elif rule == 4:
+            reasons[i].append(f"clear_speech:{volume:.2f}:{count}")
+        elif rule == 5:
+            reasons[i].append(f"speech_pattern:{count}:{ratio:.2f}")
+        elif rule == 6:
+            reasons[i].append(f"short_loud:{volume:.2f}")
+        else:
+            reasons[i].append(f"voice_activity:{voice_ratios[i]:.2f}")
+    return AudioScores(volumes, peak_counts, peak_ratios, lengths, reasons)
+
+def report_audio_scores(student_id, exam_id, scores, duration, extra=None):
+    """
+    Act on scored audio windows: log them, record at most one alert, publish an 'audio'
+    event and update the capture cadence. extra (e.g. stream-only features) is added to the
+    alert details, the event and the returned response dict
+    """
+    extra = extra or {}
+    window_count = len(scores.volumes)
+    anomalous = [i for i, reasons in enumerate(scores.reasons) if reasons]
+    index = anomalous[0] if anomalous else window_count - 1
+    volume_level = float(scores.volumes[index])
+    peak_count = int(scores.peak_counts[index])
+    peak_ratio = float(scores.peak_ratios[index])
+    total_peaks = int(scores.total_peaks[index])
+    anomaly_reasons = scores.reasons[index]
+
+    # Debug log for incoming audio features
+    if window_count > 1:
+        print(f"Audio - Student: {student_id}, Windows: {window_count}, Anomalous: {len(anomalous)}, Max vol: {scores.volumes.max():.3f}, Dur: {duration}")
+    elif volume_level > 0.0 or total_peaks > 0:
+        print(f"Audio - Student: {student_id}, Vol: {volume_level:.3f}, Peaks: {peak_count}/{total_peaks}, Ratio: {peak_ratio:.2f}, Dur: {duration}")
+
+    batch = {}
+    if window_count > 1:
+        batch = {
+            'windows_scored': window_count,
+            'anomalous_windows': len(anomalous),
+            'volume_mean': float(scores.volumes.mean()),
+            'volume_max': float(scores.volumes.max()),
+            'windows': [{
+                'status': 'anomaly_detected' if scores.reasons[i] else 'clear',
+                'volume_level': float(scores.volumes[i]),
+                'peak_count': int(scores.peak_counts[i]),
+                'peak_ratio': float(scores.peak_ratios[i]),
+                'anomaly_reasons': scores.reasons[i]
+            } for i in range(window_count)]
+        }
+
+    # If anomaly detected, log to DB (if available) and return structured response
+    if anomalous:
+        alert_payload = {
+            "student_id": student_id,
+            "exam_id": exam_id,
+            "direction": f"ALERT: Audio Anomaly - {', '.join(anomaly_reasons)}",
+            "alert_time": datetime.now(),
+            "details": {
+                "type": "audio_anomaly",
+                "volume_level": volume_level,
+                "duration": duration,
+                "peak_count": peak_count,
+                "peak_ratio": peak_ratio,
+                "frequency_summary": {
+                    "total_peaks": total_peaks,
+                    "speech_peaks": peak_count
+                },
+                "anomaly_reasons": anomaly_reasons,
+                "time": datetime.now().isoformat(),
+                **{key: value for key, value in batch.items() if key != 'windows'},
+                **extra
+            },
+            "created_at": datetime.now()
+        }
 
-        # No anomaly
-        # push clear event for real-time UI (low-volume / no anomaly)
+        # Runs are per reason kind (low_volume, clear_speech, ...), not per measured value
+        reason_kinds = tuple(reason.split(':', 1)[0] for reason in anomaly_reasons)
+        if record_alert(alert_payload, coalesce_key=('audio_anomaly', reason_kinds), severity=volume_level):
+            print(f"Audio anomaly logged for student {student_id}: {anomaly_reasons}")
+
+        # broadcast to real-time streaming clients
         try:
-            event = {
+            event_hub.publish('audio', {
                 'student_id': student_id,
-                'status': 'clear',
+                'exam_id': exam_id,
+                'status': 'anomaly_detected',
                 'volume_level': volume_level,
                 'peak_count': peak_count,
                 'peak_ratio': peak_ratio,
-                'timestamp': datetime.now().isoformat()
-            }
-            with audio_queue_lock:
-                audio_event_queue.append(event)
-                while len(audio_event_queue) > MAX_AUDIO_QUEUE:
-                    audio_event_queue.popleft()
+                'anomaly_reasons': anomaly_reasons,
+                'timestamp': datetime.now().isoformat(),
+                **extra
+            })
         except Exception as e:
-            print(f"Error pushing clear audio event to queue: {e}")
+            print(f"Error publishing audio event: {e}")
 
-        return jsonify({
+        return {
+            'status': 'anomaly_detected',
+            'volume_level': volume_level,
+            'peak_count': peak_count,
+            'peak_ratio': peak_ratio,
+            'anomaly_reasons': anomaly_reasons,
+            'message': 'Audio anomaly detected',
+            'next_interval_ms': capture_cadence.observe(student_id, exam_id, 'audio', True),
+            **batch,
+            **extra
+        }
+
+    # No anomaly
+    # push clear event for real-time UI (low-volume / no anomaly)
+    try:
+        event_hub.publish('audio', {
+            'student_id': student_id,
+            'exam_id': exam_id,
             'status': 'clear',
             'volume_level': volume_level,
             'peak_count': peak_count,
             'peak_ratio': peak_ratio,
-            'message': 'No audio anomaly detected'
+            'timestamp': datetime.now().isoformat(),
+            **extra
         })
+    except Exception as e:
+        print(f"Error publishing clear audio event: {e}")
+
+    return {
+        'status': 'clear',
+        'volume_level': volume_level,
+        'peak_count': peak_count,
+        'peak_ratio': peak_ratio,
+        'message': 'No audio anomaly detected',
+        'next_interval_ms': capture_cadence.observe(student_id, exam_id, 'audio', False),
+        **batch,
+        **extra
+    }
+
+@app.route('/detect-audio-anomaly', methods=['POST'])
+def detect_audio_anomaly():
+    """
+    Score audio features for a student. Accepts JSON ({student_id, exam_id, audio_features})
+    where audio_features may be a list of windows, or the binary payload described at
+    AUDIO_PAYLOAD_HEADER with student_id/exam_id in the query string.
+    A batch records at most one alert (its first anomalous window, or else the latest window
+    is reported at the top level); per-window results come back under 'windows'.
+    """
+    try:
+        if request.mimetype == 'application/octet-stream':
+            student_id = request.args.get('student_id', 'unknown')
+            exam_id = request.args.get('exam_id', 'exam_2025_ai')
+            parse = lambda: parse_audio_payload(request.get_data(cache=False))
+        else:
+            data = request.get_json(force=True, silent=True)
+            if not data:
+                return jsonify({'status': 'error', 'message': 'No JSON payload received'}), 400
+            student_id = data.get('student_id', 'unknown')
+            exam_id = data.get('exam_id', 'exam_2025_ai')
+            parse = lambda: audio_windows_from_json(data.get('audio_features', {}) or {})
+        try:
+            volumes, spectra, lengths, scale, duration = parse()
+        except (ValueError, TypeError) as e:
+            return jsonify({'status': 'error', 'message': f'Invalid audio features: {e}'}), 400
+
+        scores = score_audio_windows(volumes, spectra, lengths, scale)
+        return jsonify(report_audio_scores(student_id, exam_id, scores, duration))
 
     except Exception as e:
         print(f"Audio anomaly detection error: {e}")
@@ -1003,32 +4509,258 @@ def detect_audio_anomaly():
         }), 500
 
 
+def mulaw_decode_table():
+    """G.711 mu-law byte -> float32 sample in -1..1"""
+    codes = ~np.arange(256, dtype=np.uint8)
+    magnitude = (((codes & 0x0F).astype(np.int32) << 3) + 0x84) << ((codes >> 4) & 0x07)
+    samples = np.where(codes & 0x80, 0x84 - magnitude, magnitude - 0x84)
+    return (samples / 32768.0).astype(np.float32)
+
+MULAW_DECODE = mulaw_decode_table()
+
+class AudioStreamAnalyzer:
+    """
+    Incremental audio features for one student's PCM stream. Every AUDIO_STREAM_REPORT_S of
+    audio the smoothed spectrum is turned into a volume level and peak list, scored together
+    with the interval's voice-activity ratio, and reported like a /detect-audio-anomaly call.
+    State is the unprocessed tail (< one FFT window), the smoothed spectrum and the noise floor
+    """
+    def __init__(self, student_id, exam_id, sample_rate=16000, encoding='pcm16', fft_size=AUDIO_STREAM_FFT_SIZE):
+        if encoding not in AUDIO_STREAM_ENCODINGS:
+            raise ValueError(f"encoding must be one of {', '.join(AUDIO_STREAM_ENCODINGS)}")
+        if sample_rate not in AUDIO_STREAM_SAMPLE_RATES:
+            raise ValueError(f"sample_rate must be one of {', '.join(map(str, AUDIO_STREAM_SAMPLE_RATES))}")
+        self.student_id = student_id
+        self.exam_id = exam_id
+        self.sample_rate = sample_rate
+        self.encoding = encoding
+        self.fft_size = fft_size
+        self.hop = fft_size // 2
+        self.window = np.blackman(fft_size).astype(np.float32)
+        # AnalyserNode.frequencyBinCount drops the Nyquist bin
+        self.bins = fft_size // 2
+        self.peak_band = slice(int(self.bins * AUDIO_STREAM_PEAK_BAND[0]), int(self.bins * AUDIO_STREAM_PEAK_BAND[1]))
+        freqs = np.fft.rfftfreq(fft_size, 1.0 / sample_rate)[:self.bins]
+        self.speech_band = (freqs >= AUDIO_VAD_SPEECH_BAND_HZ[0]) & (freqs <= AUDIO_VAD_SPEECH_BAND_HZ[1])
+        self.frames_per_report = max(1, round(AUDIO_STREAM_REPORT_S * sample_rate / self.hop))
+
+        self.tail = np.zeros(0, dtype=np.float32)
+        self.carry = b''
+        self.smoothed = np.zeros(self.bins)
+        self.noise_floor_db = None
+        self.frames = 0
+        self.voiced = 0
+        self.samples_seen = 0
+        self.reports = 0
+        self.anomalies = 0
+        self.last_result = None
+
+    def decode(self, chunk):
+        """Encoded bytes -> float32 samples in -1..1 (an odd trailing pcm16 byte waits for the next chunk)"""
+        if self.encoding == 'mulaw':
+            return MULAW_DECODE[np.frombuffer(chunk, dtype=np.uint8)]
+        if self.carry:
+            chunk = self.carry + chunk
+        usable = len(chunk) & ~1
+        self.carry = chunk[usable:]
+        return np.frombuffer(chunk, dtype='<i2', count=usable // 2) * np.float32(1.0 / 32768.0)
+
+    def feed(self, chunk):
+        """Consume a chunk of encoded audio -> results of the report intervals it completed"""
+        decoded = self.decode(bytes(chunk))
+        self.samples_seen += len(decoded)
+        samples = np.concatenate((self.tail, decoded))
+        count = (len(samples) - self.fft_size) // self.hop + 1 if len(samples) >= self.fft_size else 0
+        if count == 0:
+            self.tail = samples
+            return []
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.fft_size)[::self.hop][:count]
+        self.tail = samples[count * self.hop:].copy()
+
+        spectra = np.abs(np.fft.rfft(frames * self.window, axis=1))[:, :self.bins] / self.fft_size
+        power = spectra ** 2
+        energy_db = 10.0 * np.log10(np.mean(np.square(frames, dtype=np.float64), axis=1) + 1e-12)
+        band_ratio = power[:, self.speech_band].sum(axis=1) / (power.sum(axis=1) + 1e-12)
+
+        results = []
+        for i in range(count):
+            self.smoothed *= AUDIO_STREAM_SMOOTHING
+            self.smoothed += (1.0 - AUDIO_STREAM_SMOOTHING) * spectra[i]
+            if self.noise_floor_db is None:
+                # start low so a stream that opens mid-sentence is not taken as the floor
+                self.noise_floor_db = min(energy_db[i], AUDIO_VAD_MIN_DB)
+            elif energy_db[i] < self.noise_floor_db:
+                self.noise_floor_db = energy_db[i]
+            else:
+                self.noise_floor_db += AUDIO_VAD_FLOOR_RISE * (energy_db[i] - self.noise_floor_db)
+            if (energy_db[i] >= max(self.noise_floor_db + AUDIO_VAD_MARGIN_DB, AUDIO_VAD_MIN_DB)
+                    and band_ratio[i] >= AUDIO_VAD_BAND_RATIO):
+                self.voiced += 1
+            self.frames += 1
+            if self.frames >= self.frames_per_report:
+                results.append(self.report())
+        return results
+
+    def features(self):
+        """(volume_level, peak byte levels, voice ratio) for the current interval, as the exam page computes them"""
+        min_db, max_db = AUDIO_STREAM_DB_RANGE
+        levels = np.floor(np.clip((20.0 * np.log10(self.smoothed + 1e-12) - min_db) * 255.0 / (max_db - min_db), 0, 255))
+        band = levels[self.peak_band]
+        peaks = band[band > AUDIO_STREAM_PEAK_LEVEL][:AUDIO_STREAM_MAX_PEAKS]
+        top = np.sort(np.partition(levels, -30)[-30:])[::-1]
+        volume_level = max(np.sqrt(np.mean(levels ** 2)), top[:15].mean(), top.mean()) / 255.0
+        return volume_level, peaks, self.voiced / max(1, self.frames)
+
+    def report(self):
+        """Score the finished interval through the regular audio anomaly rules and start a new one"""
+        volume_level, peaks, voice_ratio = self.features()
+        self.frames = self.voiced = 0
+        scores = score_audio_windows(
+            np.array([volume_level]), peaks[None, :], np.array([len(peaks)]), 255.0,
+            voice_ratios=np.array([voice_ratio]))
+        result = report_audio_scores(self.student_id, self.exam_id, scores, AUDIO_STREAM_REPORT_S, {
+            'source': 'stream',
+            'voice_ratio': round(float(voice_ratio), 3),
+            'stream_seconds': round(self.samples_seen / self.sample_rate, 2)
+        })
+        self.reports += 1
+        self.anomalies += result['status'] == 'anomaly_detected'
+        self.last_result = result
+        return result
+
+    def summary(self):
+        return {
+            'status': 'ok',
+            'seconds': round(self.samples_seen / self.sample_rate, 2),
+            'reports': self.reports,
+            'anomalies': self.anomalies,
+            'last_result': self.last_result
+        }
+
+class AudioStreamStats:
+    """Connection and throughput counters for the audio stream endpoints"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+        self.connections = 0
+        self.bytes = 0
+        self.reports = 0
+        self.anomalies = 0
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            self.active += 1
+            self.connections += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def record(self, nbytes, results):
+        with self._lock:
+            self.bytes += nbytes
+            self.reports += len(results)
+            self.anomalies += sum(result['status'] == 'anomaly_detected' for result in results)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self.active,
+                'connections': self.connections,
+                'bytes': self.bytes,
+                'reports': self.reports,
+                'anomalies': self.anomalies
+            }
+
+audio_streams = AudioStreamStats()
+
+def open_audio_stream(args):
+    """AudioStreamAnalyzer from stream query parameters (student_id, exam_id, encoding, sample_rate)"""
+    return AudioStreamAnalyzer(
+        args.get('student_id', 'unknown'),
+        args.get('exam_id', 'exam_2025_ai'),
+        sample_rate=args.get('sample_rate', 16000, type=int),
+        encoding=args.get('encoding', 'pcm16'))
+
+@app.route('/stream-audio', methods=['POST'])
+def stream_audio():
+    """
+    Streaming audio ingestion over one long-lived chunked POST whose body is raw PCM
+    (?student_id=&exam_id=&encoding=pcm16|mulaw&sample_rate=16000). Results are published
+    as 'audio' events (/stream-audio-anomaly) while the upload runs; the response
+    summarizes the stream once the client ends it.
+    """
+    try:
+        analyzer = open_audio_stream(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    with audio_streams.connection():
+        while True:
+            chunk = request.stream.read(AUDIO_STREAM_READ_BYTES)
+            if not chunk:
+                break
+            audio_streams.record(len(chunk), analyzer.feed(chunk))
+    return jsonify(analyzer.summary())
+
+if Sock is not None:
+    app.config.setdefault('SOCK_SERVER_OPTIONS', {'max_message_size': AUDIO_STREAM_MAX_MESSAGE_BYTES})
+    sock = Sock(app)
+
+    @sock.route('/ws/audio')
+    def audio_socket(ws):
+        """
+        Streaming audio ingestion over a WebSocket, same query parameters as /stream-audio.
+        Binary messages carry PCM; each report is sent back as a JSON text message.
+        """
+        try:
+            analyzer = open_audio_stream(request.args)
+        except ValueError as e:
+            ws.send(json.dumps({'status': 'error', 'message': str(e)}))
+            return
+
+        with audio_streams.connection():
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, str):
+                    # text frames are reserved for control messages; none are defined yet
+                    continue
+                results = analyzer.feed(message)
+                audio_streams.record(len(message), results)
+                for result in results:
+                    ws.send(json.dumps(result))
+else:
+    print("ℹ flask-sock not installed - /ws/audio disabled, the chunked /stream-audio endpoint still works")
+
+
 @app.route('/stream-audio-anomaly')
 def stream_audio_anomaly():
-    """Simple Server-Sent Events endpoint to stream audio detection events in real-time.
+    """Server-Sent Events stream of audio detection events (optionally ?student_id=...).
     Clients can connect with EventSource in the browser to receive JSON events.
     """
-    def event_stream():
-        # Long-running generator that yields events when available
-        try:
-            while True:
-                event = None
-                with audio_queue_lock:
-                    if audio_event_queue:
-                        event = audio_event_queue.popleft()
-                if event:
-                    try:
-                        yield f"data: {json.dumps(event)}\n\n"
-                    except Exception as e:
-                        print(f"Error serializing audio event: {e}")
-                else:
-                    # no event - sleep briefly to avoid busy loop
-                    time.sleep(0.4)
-        except GeneratorExit:
-            # client disconnected
-            return
+    return sse_response(types=('audio',), student_id=request.args.get('student_id'))
 
-    return app.response_class(event_stream(), mimetype='text/event-stream')
+@app.route('/stream-events')
+def stream_events():
+    """
+    Server-Sent Events stream of every alert type, sent as named events (head, object,
+    audio, exam_alert, termination, ufm). Filters: ?types=head,object&exam_id=...&student_id=...
+    Reconnecting clients resume from Last-Event-ID.
+    """
+    types = tuple(t.strip() for t in request.args.get('types', '').split(',') if t.strip())
+    unknown = [t for t in types if t not in EVENT_TYPES]
+    if unknown:
+        return jsonify({'status': 'error', 'message': f"Unknown event types: {', '.join(unknown)}"}), 400
+    return sse_response(
+        types=types or None,
+        student_id=request.args.get('student_id'),
+        exam_id=request.args.get('exam_id'),
+        include_type=True
+    )
 
 @app.route('/api/exam/alert', methods=['POST'])
 def record_exam_alert():
@@ -1056,34 +4788,24 @@ def record_exam_alert():
                 'message': 'Missing required fields'
             }), 400
         
-        database = get_db_connection()
-        if database is not None:
-            try:
-                alert_doc = {
-                    "student_id": student_id,
-                    "exam_id": exam_id,
-                    "alert_type": alert_type,
-                    "message": message,
-                    "timestamp": timestamp,
-                    "created_at": datetime.now()
-                }
-                database.exam_alerts.insert_one(alert_doc)
-                
-                return jsonify({
-                    'status': 'success',
-                    'message': 'Alert recorded'
-                })
-            except Exception as e:
-                print(f"Error recording exam alert: {e}")
-                return jsonify({
-                    'status': 'error',
-                    'message': f'Database error: {str(e)}'
-                }), 500
-        else:
+        alert_doc = {
+            "student_id": student_id,
+            "exam_id": exam_id,
+            "alert_type": alert_type,
+            "message": message,
+            "timestamp": timestamp,
+            "created_at": datetime.now()
+        }
+        if not record_alert(alert_doc, 'exam_alerts', event_type='exam_alert'):
             return jsonify({
                 'status': 'error',
-                'message': 'Database connection failed'
-            }), 500
+                'message': 'Alert queue full'
+            }), 503
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Alert recorded'
+        })
             
     except Exception as e:
         print(f"Error in record_exam_alert: {e}")
@@ -1126,9 +4848,9 @@ def record_exam_termination():
                     "timestamp": timestamp,
                     "created_at": datetime.now()
                 }
-                database.exam_terminations.insert_one(termination_doc)
+                alert_writer.submit('exam_terminations', termination_doc, critical=True)
                 
-                # Also log as a critical alert
+                # Also log as a critical alert (never dropped by the writer)
                 alert_doc = {
                     "student_id": student_id,
                     "direction": f"EXAM TERMINATED: {reason}",
@@ -1141,7 +4863,7 @@ def record_exam_termination():
                     },
                     "created_at": datetime.now()
                 }
-                database.alerts.insert_one(alert_doc)
+                record_alert(alert_doc, critical=True, event_type='termination')
                 
                 print(f"Exam terminated for student {student_id}: {reason}")
                 
@@ -1173,7 +4895,7 @@ def record_exam_termination():
 def reset_exam_data():
     """Reset alerts and unfair-means (UFM) data for a given exam_id and optionally a specific student.
     This clears DB records if available, otherwise clears in-memory storage.
-    Also clears the audio event queue to avoid showing stale events when an exam restarts.
+    Also drops the exam's (or student's) buffered real-time events so a restarted exam does not show stale ones.
     Payload: { 
         "exam_id": "exam_2025_ai",
         "student_id": "12345" (optional - if provided, only resets data for this student)
@@ -1194,8 +4916,12 @@ def reset_exam_data():
         database = get_db_connection()
         removed = {}
         errors = []  # Track any deletion errors
+        # Later repeats must start new alert runs rather than update deleted ones
+        alert_coalescer.reset(exam_id, student_id)
 
         if database is not None:
+            # Write out queued alerts first so they cannot land after the reset
+            alert_writer.flush()
             try:
                 def with_legacy_support(base_filter):
                     if not legacy_cleanup or 'exam_id' not in base_filter:
@@ -1273,6 +4999,33 @@ def reset_exam_data():
                     removed['alerts_removed'] = 0
                     print(f"Error deleting alerts: {e}")
 
+                try:
+                    if 'alert_rollups' in database.list_collection_names():
+                        rollups_filter = {'exam_id': exam_id}
+                        if student_id:
+                            rollups_filter['student_id'] = student_id
+                        res_rollups = database.alert_rollups.delete_many(rollups_filter)
+                        removed['alert_rollups_removed'] = res_rollups.deleted_count
+                        print(f"Removed {res_rollups.deleted_count} alert_rollups with filter: {rollups_filter}")
+                    else:
+                        removed['alert_rollups_removed'] = 0
+                except Exception as e:
+                    errors.append(f"Alert rollups deletion error: {str(e)}")
+                    removed['alert_rollups_removed'] = 0
+                    print(f"Error deleting alert_rollups: {e}")
+
+                try:
+                    if 'alert_events' in database.list_collection_names():
+                        res_events = database.alert_events.delete_many(with_legacy_support(generic_alerts_filter))
+                        removed['alert_events_removed'] = res_events.deleted_count
+                        print(f"Removed {res_events.deleted_count} alert_events records with filter: {generic_alerts_filter} (legacy={legacy_cleanup})")
+                    else:
+                        removed['alert_events_removed'] = 0
+                except Exception as e:
+                    errors.append(f"Alert events deletion error: {str(e)}")
+                    removed['alert_events_removed'] = 0
+                    print(f"Error deleting alert_events: {e}")
+
                 # Remove registered faces
                 try:
                     if 'registered_faces' in database.list_collection_names():
@@ -1302,15 +5055,22 @@ def reset_exam_data():
             removed['exam_alerts_removed'] = 0  # Placeholder
             removed['exam_terminations_removed'] = 0  # Placeholder
             removed['alerts_removed'] = 0  # Placeholder
+            removed['alert_events_removed'] = 0  # Placeholder
+            removed['alert_rollups_removed'] = 0  # Placeholder
             removed['registered_faces_removed'] = 0  # Placeholder
 
-        # Clear audio event queue
+        # Legacy cleanup can also remove alerts that name no exam
+        data_versions.bump([
+            'alerts', version_scope('alerts', exam_id), version_scope('alerts'), version_scope('ufm', exam_id)
+        ])
+
+        # Drop this exam's (or student's) buffered real-time events
         try:
-            with audio_queue_lock:
-                audio_event_queue.clear()
+            event_hub.discard(exam_id, student_id)
+            head_pose_tracker.reset(exam_id, student_id)
             removed['audio_queue_cleared'] = True
         except Exception as e:
-            print(f"Error clearing audio_event_queue: {e}")
+            print(f"Error clearing event hub: {e}")
             removed['audio_queue_cleared'] = False
             errors.append(f"Audio queue clear error: {str(e)}")
 
@@ -1361,10 +5121,6 @@ def mark_unfair_means():
         database = get_db_connection()
         if database is not None:
             try:
-                # Check if UFM collection exists, create if not
-                if 'unfair_means' not in database.list_collection_names():
-                    database.create_collection('unfair_means')
-                
                 # Check if student is already marked for UFM in this exam
                 existing_ufm = database.unfair_means.find_one({
                     "student_id": student_id,
@@ -1387,9 +5143,15 @@ def mark_unfair_means():
                     "status": "marked",
                     "created_at": datetime.now()
                 }
-                database.unfair_means.insert_one(ufm_doc)
+                # Written behind like the alert; an upsert, so a repeat mark that races the
+                # queued write (and misses it in the check above) cannot add a second record
+                ufm_key = {"student_id": student_id, "exam_id": exam_id}
+                alert_writer.submit_update(
+                    'unfair_means', ufm_key,
+                    {'$setOnInsert': {k: v for k, v in ufm_doc.items() if k not in ufm_key}},
+                    critical=True, upsert=True)
                 
-                # Also log as a critical alert
+                # Also log as a critical alert (never dropped by the writer)
                 alert_doc = {
                     "student_id": student_id,
                     "direction": f"UNFAIR MEANS: {reason}",
@@ -1403,7 +5165,7 @@ def mark_unfair_means():
                     },
                     "created_at": datetime.now()
                 }
-                database.alerts.insert_one(alert_doc)
+                record_alert(alert_doc, critical=True, event_type='ufm')
                 
                 print(f"Student {student_id} marked for unfair means: {reason}")
                 
@@ -1440,6 +5202,7 @@ def mark_unfair_means():
                 "created_at": datetime.now().isoformat()
             }
             ufm_storage.append(ufm_doc)
+            data_versions.bump([version_scope('ufm', exam_id)])
             
             print(f"Student {student_id} marked for unfair means (in-memory): {reason}")
             
@@ -1463,6 +5226,11 @@ def get_ufm_students(exam_id):
     Get all students marked for unfair means in a specific exam
     """
     try:
+        etag = request_etag(data_versions.tokens([version_scope('ufm', exam_id)]))
+        cached = data_versions.not_modified(etag)
+        if cached is not None:
+            return cached
+        
         database = get_db_connection()
         if database is not None:
             try:
@@ -1471,10 +5239,10 @@ def get_ufm_students(exam_id):
                     {"_id": 0}
                 ).sort("marked_at", -1))
                 
-                return jsonify({
+                return with_etag(jsonify({
                     'status': 'success',
                     'ufm_students': ufm_students
-                })
+                }), etag)
             except Exception as e:
                 print(f"Error fetching UFM students: {e}")
                 return jsonify({
@@ -1487,10 +5255,10 @@ def get_ufm_students(exam_id):
             # Sort by marked_at in descending order (most recent first)
             ufm_students.sort(key=lambda x: x.get('marked_at', ''), reverse=True)
             
-            return jsonify({
+            return with_etag(jsonify({
                 'status': 'success',
                 'ufm_students': ufm_students
-            })
+            }), etag)
             
     except Exception as e:
         print(f"Error in get_ufm_students: {e}")
@@ -1499,7 +5267,205 @@ def get_ufm_students(exam_id):
             'message': f'Server error: {str(e)}'
         }), 500
 
+def alert_rollup_pipeline(exam_id=None):
+    """Aggregation over alerts yielding one rollup (counts, total, last_alert_time) per exam and student"""
+    match = {'direction': {'$regex': '^ALERT'}}
+    if exam_id:
+        match['$or'] = [{'exam_id': exam_id}, {'details.exam_id': exam_id}]
+    category = {'$switch': {
+        'branches': [
+            {'case': {'$gte': [{'$indexOfCP': ['$direction', pattern]}, 0]}, 'then': name}
+            for pattern, name in ALERT_CATEGORIES.items()
+        ],
+        'default': 'other'
+    }}
+    return [
+        {'$match': match},
+        # Coalesced run documents stand for `count` occurrences
+        {'$group': {
+            '_id': {'exam_id': {'$ifNull': ['$exam_id', '$details.exam_id']}, 'student_id': '$student_id', 'category': category},
+            'count': {'$sum': {'$ifNull': ['$count', 1]}},
+            'last_alert_time': {'$max': {'$ifNull': ['$last_seen', '$alert_time']}}
+        }},
+        {'$group': {
+            '_id': {'exam_id': '$_id.exam_id', 'student_id': '$_id.student_id'},
+            'counts': {'$push': {'k': '$_id.category', 'v': '$count'}},
+            'total': {'$sum': '$count'},
+            'last_alert_time': {'$max': '$last_alert_time'}
+        }},
+        {'$project': {
+            '_id': 0,
+            'exam_id': '$_id.exam_id',
+            'student_id': '$_id.student_id',
+            'counts': {'$arrayToObject': '$counts'},
+            'total': 1,
+            'last_alert_time': 1
+        }}
+    ]
+
+def rebuild_alert_rollups(database, exam_id=None):
+    """
+    Recompute alert_rollups (for one exam, or all) from alerts, unfair_means and
+    exam_terminations. Queued alerts are written out first; alerts recorded while the
+    rebuild runs may be missed, so run it when the exam is quiet. Returns the rollup count.
+    """
+    alert_writer.flush()
+    rollups = {}
+    for doc in database.alerts.aggregate(alert_rollup_pipeline(exam_id), allowDiskUse=True):
+        if doc.get('exam_id') and doc.get('student_id'):
+            rollups[(doc['exam_id'], doc['student_id'])] = doc
+
+    def rollup_for(record):
+        key = (record.get('exam_id'), record.get('student_id'))
+        return rollups.setdefault(key, {
+            'exam_id': key[0], 'student_id': key[1], 'counts': {}, 'total': 0, 'last_alert_time': None
+        })
+
+    scope = {'exam_id': exam_id} if exam_id else {'exam_id': {'$nin': [None, '']}}
+    for ufm in database.unfair_means.find(scope):
+        rollup_for(ufm)['ufm'] = {'marked': True, 'reason': ufm.get('reason'), 'marked_at': ufm.get('marked_at')}
+    for termination in database.exam_terminations.find(scope).sort('created_at', ASCENDING):
+        rollup_for(termination).update(
+            terminated=True,
+            termination_reason=termination.get('reason'),
+            terminated_at=termination.get('created_at'))
+
+    exam_ids = {exam_id} if exam_id else set(database.alert_rollups.distinct('exam_id'))
+    database.alert_rollups.delete_many({'exam_id': exam_id} if exam_id else {})
+    if rollups:
+        database.alert_rollups.insert_many(list(rollups.values()))
+    exam_ids.update(key[0] for key in rollups)
+    data_versions.bump(['alerts'] + [version_scope('alerts', exam) for exam in exam_ids if exam])
+    print(f"✓ Rebuilt {len(rollups)} alert rollups" + (f" for exam {exam_id}" if exam_id else ""))
+    return len(rollups)
+
+def serialize_rollup(rollup):
+    ufm = rollup.get('ufm') or {}
+    return {
+        'student_id': rollup.get('student_id'),
+        'counts': rollup.get('counts') or {},
+        'total': rollup.get('total', 0),
+        'last_alert_time': rollup['last_alert_time'].isoformat() if rollup.get('last_alert_time') else None,
+        'ufm': {
+            'marked': bool(ufm.get('marked')),
+            'reason': ufm.get('reason'),
+            'marked_at': ufm['marked_at'].isoformat() if isinstance(ufm.get('marked_at'), datetime) else ufm.get('marked_at')
+        },
+        'terminated': bool(rollup.get('terminated')),
+        'termination_reason': rollup.get('termination_reason'),
+        'terminated_at': rollup['terminated_at'].isoformat() if rollup.get('terminated_at') else None
+    }
+
+@app.route('/api/exam/<exam_id>/summary', methods=['GET'])
+def get_exam_summary(exam_id):
+    """
+    Per-student alert summary for the proctor dashboard, read from alert_rollups:
+    counts by category, total, last alert time, UFM mark and termination flag.
+    Students are ordered by total alerts, highest first.
+    """
+    database = get_db_connection()
+    if database is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    # Rollup writes always name their exam, so the unscoped alert counter is not needed
+    etag = request_etag(data_versions.tokens([version_scope('alerts', exam_id)]))
+    cached = data_versions.not_modified(etag)
+    if cached is not None:
+        return cached
+    try:
+        rollups = list(database.alert_rollups.find({'exam_id': exam_id}, {'_id': 0}))
+    except Exception as e:
+        print(f"Error fetching exam summary: {e}")
+        return jsonify({'status': 'error', 'message': f'Database error: {str(e)}'}), 500
+
+    students = sorted((serialize_rollup(rollup) for rollup in rollups), key=lambda s: (-s['total'], str(s['student_id'])))
+    by_category = {}
+    for student in students:
+        for category, count in student['counts'].items():
+            by_category[category] = by_category.get(category, 0) + count
+    return with_etag(jsonify({
+        'status': 'success',
+        'exam_id': exam_id,
+        'students': students,
+        'totals': {
+            'students': len(students),
+            'alerts': sum(student['total'] for student in students),
+            'by_category': by_category,
+            'ufm_marked': sum(1 for student in students if student['ufm']['marked']),
+            'terminated': sum(1 for student in students if student['terminated'])
+        }
+    }), etag)
+
+@app.route('/api/exam/<exam_id>/summary/rebuild', methods=['POST'])
+def rebuild_exam_summary(exam_id):
+    """Recompute the exam's alert rollups from the raw alerts"""
+    database = get_db_connection()
+    if database is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    try:
+        return jsonify({'status': 'success', 'exam_id': exam_id, 'rollups': rebuild_alert_rollups(database, exam_id)})
+    except Exception as e:
+        print(f"Error rebuilding alert rollups: {e}")
+        return jsonify({'status': 'error', 'message': f'Database error: {str(e)}'}), 500
+
+@app.route('/api/db/indexes', methods=['GET'])
+def db_index_stats():
+    """Index usage counters for the collections managed by ensure_indexes"""
+    database = get_db_connection()
+    if database is None:
+        return jsonify({'status': 'error', 'message': 'Database connection failed'}), 500
+    return jsonify({'status': 'success', 'indexes': get_index_stats(database)})
+
+def _reset_engines_after_fork():
+    for engine in engines.values():
+        engine.reset_after_fork()
+    if ENGINE_LOADING == 'background':
+        start_engines()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_engines_after_fork)
+
+def init_engines():
+    """Apply ENGINE_LOADING (lazy engines are left for their first request)"""
+    if ENGINE_LOADING == 'eager':
+        for engine in engines.values():
+            engine.wait(timeout=None)
+    elif ENGINE_LOADING == 'background':
+        start_engines()
+
+if __name__ != "__main__" and not IN_INFERENCE_WORKER:
+    # Imported by gunicorn or the tests; `python app.py` starts them just before serving.
+    # Inference workers load theirs in inference_worker_main.
+    init_engines()
+
 if __name__ == "__main__":
+    # Index maintenance without starting the server:
+    #   python app.py ensure-indexes   create any missing indexes
+    #   python app.py index-stats      print per-index usage counters
+    #   python app.py rebuild-rollups [exam_id]   recompute dashboard alert rollups
+    # Detector export (needs torch + onnx, and onnxruntime for --int8):
+    #   python app.py export-detector [--int8] [--opencv]
+    if len(sys.argv) > 1 and sys.argv[1] == 'export-detector':
+        onnx_path = os.path.join(MODEL_DIR, DETECTOR_ONNX_PATH)
+        export_detector_onnx(onnx_path=onnx_path, int8='--int8' in sys.argv[2:])
+        if '--opencv' in sys.argv[2:]:
+            export_detector_onnx(onnx_path=batch1_model_path(onnx_path), batch_size=1)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] in ('ensure-indexes', 'index-stats', 'rebuild-rollups'):
+        database = get_db_connection()
+        if database is None:
+            print("✗ MongoDB connection failed")
+            sys.exit(1)
+        if sys.argv[1] == 'ensure-indexes':
+            result = ensure_indexes(database)
+        elif sys.argv[1] == 'rebuild-rollups':
+            result = {'rollups': rebuild_alert_rollups(database, sys.argv[2] if len(sys.argv) > 2 else None)}
+        else:
+            result = get_index_stats(database)
+        print(json.dumps(result, indent=2, default=str))
+        sys.exit(0)
+    
+    init_engines()
+    
     print("\n" + "="*60)
     print("AI Proctor Backend - MongoDB Edition")
     print("="*60 + "\n")
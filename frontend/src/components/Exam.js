@@ -3,6 +3,35 @@ import { useNavigate } from "react-router-dom";
 import Webcam from "react-webcam";
 import { setupKeyboardRestriction, setupTabSwitchDetection } from "../utils/keyboardRestriction";
 
+// Default capture interval (ms) per signal; the backend replaces these with its
+// recommended next_interval_ms after every analysis
+const ANALYSIS_INTERVALS = { head: 2000, face: 2000, objects: 1500, audio: 2000 };
+
+// Raw microphone audio is streamed to the backend over one WebSocket as 16 kHz
+// mu-law bytes; while that socket is open the periodic feature upload is skipped
+const AUDIO_STREAM_URL = "ws://localhost:5000/ws/audio";
+const AUDIO_STREAM_SAMPLE_RATE = 16000;
+
+// Float samples at the context rate -> 16 kHz G.711 mu-law bytes (box-filter downsampling)
+function encodeAudioChunk(samples, inputRate) {
+  const ratio = inputRate / AUDIO_STREAM_SAMPLE_RATE;
+  const out = new Uint8Array(Math.floor(samples.length / ratio));
+  for (let i = 0; i < out.length; i++) {
+    const start = Math.floor(i * ratio);
+    const end = Math.max(start + 1, Math.floor((i + 1) * ratio));
+    let sum = 0;
+    for (let j = start; j < end; j++) sum += samples[j];
+    const pcm = Math.max(-32635, Math.min(32635, Math.round((sum / (end - start)) * 32767)));
+    const sign = pcm < 0 ? 0x80 : 0;
+    const magnitude = Math.abs(pcm) + 0x84;
+    let exponent = 7;
+    for (let mask = 0x4000; (magnitude & mask) === 0 && exponent > 0; mask >>= 1) exponent--;
+    const mantissa = (magnitude >> (exponent + 3)) & 0x0f;
+    out[i] = ~(sign | (exponent << 4) | mantissa) & 0xff;
+  }
+  return out;
+}
+
 export default function Exam() {
   const examRef = useRef(null);
   const navigate = useNavigate();
@@ -116,9 +145,12 @@ export default function Exam() {
   const [audioAlert, setAudioAlert] = useState("");
   const [isAudioMonitoring, setIsAudioMonitoring] = useState(false);
   const eventSourceRef = useRef(null);
+  const captureIntervalsRef = useRef({ ...ANALYSIS_INTERVALS });
   const audioContextRef = useRef(null);
   const analyserRef = useRef(null);
   const microphoneRef = useRef(null);
+  const audioSocketRef = useRef(null);
+  const audioProcessorRef = useRef(null);
   const [cameraPermission, setCameraPermission] = useState(null);
   const [audioPermission, setAudioPermission] = useState(null);
   const [permissionError, setPermissionError] = useState("");
@@ -377,105 +409,72 @@ export default function Exam() {
     checkPermissions();
   }, []);
 
-  const verifyFaceDuringExam = useCallback(async (dataUrl) => {
-    try {
-      const blob = await fetch(dataUrl).then(res => res.blob());
-      const formData = new FormData();
-      formData.append("roll_number", rollNumber);
-      formData.append("image", blob, "frame.jpg");
-
-      const res = await fetch("http://localhost:5000/verify-face", {
-        method: "POST",
-        body: formData,
-      });
-      const data = await res.json();
-
-      if (data.status === "mismatch") {
-        // Send alert to dashboard instead of terminating exam
-        const alertData = {
-          student_id: rollNumber,
-          exam_id: examId,
-          direction: "ALERT: Face Mismatch Detected",
-          time: new Date().toLocaleTimeString(),
-          details: {
-            type: "face_mismatch",
-            confidence: data.confidence,
-            message: "Face verification failed - possible impersonation"
-          }
-        };
-        
-        fetch("http://localhost:5000/log-alert", {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(alertData)
-        }).catch(err => console.error("Failed to log face mismatch alert:", err));
-        
-        // Show alert to user
-        showFaceMismatchAlert("⚠️ ALERT: Face mismatch detected! Please ensure you are clearly visible.");
-        console.warn("⚠️ Face mismatch detected - Alert sent to dashboard");
-      } else if (data.status === "multiple_faces") {
-        // Send alert for multiple faces
-        const alertData = {
-          student_id: rollNumber,
-          exam_id: examId,
-          direction: "ALERT: Multiple Faces Detected",
-          time: new Date().toLocaleTimeString(),
-          details: {
-            type: "multiple_faces",
-            message: "More than one person detected in frame"
-          }
-        };
-        
-        fetch("http://localhost:5000/log-alert", {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(alertData)
-        }).catch(err => console.error("Failed to log multiple faces alert:", err));
-        
-        // Show alert to user
-        showFaceMismatchAlert("⚠️ ALERT: Multiple faces detected! Ensure only you are visible.");
-        console.warn("⚠️ Multiple faces detected - Alert sent to dashboard");
-      } else if (data.status === "no_face") {
-        // Don't submit for no face detection, just warn
-        console.log("No face detected in current frame");
-      }
-    } catch (error) {
-      console.error("Face verification error:", error);
-      // Don't submit on network errors
+  const handleFaceVerificationResult = useCallback((data) => {
+    if (data.status === "mismatch") {
+      // Send alert to dashboard instead of terminating exam
+      const alertData = {
+        student_id: rollNumber,
+        exam_id: examId,
+        direction: "ALERT: Face Mismatch Detected",
+        time: new Date().toLocaleTimeString(),
+        details: {
+          type: "face_mismatch",
+          confidence: data.confidence,
+          message: "Face verification failed - possible impersonation"
+        }
+      };
+      
+      fetch("http://localhost:5000/log-alert", {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(alertData)
+      }).catch(err => console.error("Failed to log face mismatch alert:", err));
+      
+      // Show alert to user
+      showFaceMismatchAlert("⚠️ ALERT: Face mismatch detected! Please ensure you are clearly visible.");
+      console.warn("⚠️ Face mismatch detected - Alert sent to dashboard");
+    } else if (data.status === "multiple_faces") {
+      // Send alert for multiple faces
+      const alertData = {
+        student_id: rollNumber,
+        exam_id: examId,
+        direction: "ALERT: Multiple Faces Detected",
+        time: new Date().toLocaleTimeString(),
+        details: {
+          type: "multiple_faces",
+          message: "More than one person detected in frame"
+        }
+      };
+      
+      fetch("http://localhost:5000/log-alert", {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(alertData)
+      }).catch(err => console.error("Failed to log multiple faces alert:", err));
+      
+      // Show alert to user
+      showFaceMismatchAlert("⚠️ ALERT: Multiple faces detected! Ensure only you are visible.");
+      console.warn("⚠️ Multiple faces detected - Alert sent to dashboard");
+    } else if (data.status === "no_face") {
+      // Don't submit for no face detection, just warn
+      console.log("No face detected in current frame");
     }
   }, [rollNumber, examId, showFaceMismatchAlert]);
 
-  const detectObjectDuringExam = useCallback(async (dataUrl) => {
-    try {
-      const blob = await fetch(dataUrl).then(res => res.blob());
-      const formData = new FormData();
-      formData.append("image", blob, "frame.jpg");
-      formData.append("student_id", rollNumber);
-      formData.append("exam_id", examId);
-
-      const res = await fetch("http://localhost:5000/detect-object", {
-        method: "POST",
-        body: formData,
-      });
-      const data = await res.json();
-
-      if (data.status === 'forbidden_object') {
-        setObjectDetectionStatus(`⚠️ FORBIDDEN: ${data.objects?.join(', ')}`);
-      } else if (data.status === 'clear') {
-        setObjectDetectionStatus(`✓ Clear (${data.all_detections?.length || 0} objects)`);
-      } else if (data.status === 'error') {
-        setObjectDetectionStatus(`Object detection unavailable`);
-      }
+  const handleObjectDetectionResult = useCallback((data) => {
+    if (data.status === 'forbidden_object') {
+      setObjectDetectionStatus(`⚠️ FORBIDDEN: ${data.objects?.join(', ')}`);
+    } else if (data.status === 'clear') {
+      setObjectDetectionStatus(`✓ Clear (${data.all_detections?.length || 0} objects)`);
+    } else if (data.status === 'error') {
+      setObjectDetectionStatus(`Object detection unavailable`);
+    }
 
-      if (data.status === "forbidden_object") {
-        alert(`Forbidden object detected: ${data.objects?.join(', ')}. Exam will be submitted.`);
-        handleSubmit();
-      }
-    } catch (error) {
-      console.error("Object detection error:", error);
-      setObjectDetectionStatus("Detection error");
+    if (data.status === "forbidden_object") {
+      alert(`Forbidden object detected: ${data.objects?.join(', ')}. Exam will be submitted.`);
+      handleSubmit();
     }
-  }, [rollNumber, examId, handleSubmit]);
+  }, [handleSubmit]);
 
   // Audio monitoring functions
   const startAudioMonitoring = useCallback(async () => {
@@ -498,6 +497,41 @@ export default function Exam() {
       audioContextRef.current = audioContext;
       analyserRef.current = analyser;
       microphoneRef.current = stream;
+
+      // Stream raw audio as well; if the socket cannot be opened the periodic
+      // feature upload in analyzeAudio keeps working on its own
+      const query = new URLSearchParams({
+        student_id: rollNumber, exam_id: examId,
+        encoding: 'mulaw', sample_rate: AUDIO_STREAM_SAMPLE_RATE
+      });
+      const socket = new WebSocket(`${AUDIO_STREAM_URL}?${query}`);
+      socket.binaryType = 'arraybuffer';
+      const processor = audioContext.createScriptProcessor(4096, 1, 1);
+      processor.onaudioprocess = (e) => {
+        if (socket.readyState === WebSocket.OPEN) {
+          socket.send(encodeAudioChunk(e.inputBuffer.getChannelData(0), audioContext.sampleRate));
+        }
+      };
+      socket.onmessage = (e) => {
+        try {
+          const result = JSON.parse(e.data);
+          if (result.status === 'anomaly_detected') {
+            setAudioAlert(`🔊 ALERT: ${(result.anomaly_reasons || []).join(", ")}`);
+          } else if (result.status === 'clear') {
+            setAudioAlert(`🎤 Monitoring (${Math.round((result.volume_level || 0) * 100)}%)`);
+          }
+        } catch (err) {
+          console.error('Audio stream message error', err);
+        }
+      };
+      socket.onclose = () => {
+        if (audioSocketRef.current === socket) audioSocketRef.current = null;
+      };
+      microphone.connect(processor);
+      // A ScriptProcessor only runs while connected to the destination; it outputs silence
+      processor.connect(audioContext.destination);
+      audioSocketRef.current = socket;
+      audioProcessorRef.current = processor;
       
       setIsAudioMonitoring(true);
       console.log("Audio monitoring started");
@@ -505,9 +539,18 @@ export default function Exam() {
       console.error("Error starting audio monitoring:", error);
       setAudioAlert("⚠️ Microphone access denied. Audio monitoring disabled.");
     }
-  }, []);
+  }, [rollNumber, examId]);
 
   const stopAudioMonitoring = useCallback(() => {
+    if (audioProcessorRef.current) {
+      audioProcessorRef.current.disconnect();
+      audioProcessorRef.current.onaudioprocess = null;
+      audioProcessorRef.current = null;
+    }
+    if (audioSocketRef.current) {
+      audioSocketRef.current.close();
+      audioSocketRef.current = null;
+    }
     if (microphoneRef.current) {
       microphoneRef.current.getTracks().forEach(track => track.stop());
       microphoneRef.current = null;
@@ -530,6 +573,9 @@ export default function Exam() {
       return;
     }
 
+    // The backend is already analysing the raw audio stream
+    if (audioSocketRef.current && audioSocketRef.current.readyState === WebSocket.OPEN) return;
+
     const bufferLength = analyserRef.current.frequencyBinCount;
     const dataArray = new Uint8Array(bufferLength);
     analyserRef.current.getByteFrequencyData(dataArray);
@@ -543,7 +589,7 @@ export default function Exam() {
     
     for (let i = speechRangeStart; i < speechRangeEnd; i++) {
       if (dataArray[i] > 75) {
-        frequencyPeaks.push(dataArray[i] / 255);
+        frequencyPeaks.push(dataArray[i]);
       }
     }
     
@@ -569,30 +615,38 @@ export default function Exam() {
     }
 
     try {
-      // Send compact features to backend for analysis
-      const payload = {
-        student_id: rollNumber,
-        audio_features: {
-          volume_level: volumeLevel,
-          // send small set of peaks (floats between 0-1)
-          frequency_data: frequencyPeaks.slice(0, 40),
-          duration: 1.0
-        }
-      };
-
-      const res = await fetch("http://localhost:5000/detect-audio-anomaly", {
+      // Send compact features to backend for analysis: one window in the binary
+      // audio payload (16-byte header, float32 volume, uint32 peak count, uint8 peaks)
+      const peaks = frequencyPeaks.slice(0, 40);
+      const payload = new ArrayBuffer(24 + peaks.length);
+      const view = new DataView(payload);
+      [0x4e, 0x50, 0x41, 0x46].forEach((byte, i) => view.setUint8(i, byte)); // "NPAF"
+      view.setUint8(4, 1);                     // version
+      view.setUint8(5, 1);                     // uint8 spectrum
+      view.setUint16(6, 1, true);              // windows
+      view.setUint16(8, peaks.length, true);   // bins
+      view.setFloat32(12, 1.0, true);          // duration (s)
+      view.setFloat32(16, volumeLevel, true);
+      view.setUint32(20, peaks.length, true);
+      new Uint8Array(payload, 24).set(peaks);
+
+      const query = new URLSearchParams({ student_id: rollNumber, exam_id: examId });
+      const res = await fetch(`http://localhost:5000/detect-audio-anomaly?${query}`, {
         method: "POST",
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload)
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: payload
       });
 
       const data = await res.json();
+      if (data.next_interval_ms) {
+        captureIntervalsRef.current = { ...captureIntervalsRef.current, audio: data.next_interval_ms };
+      }
 
       // backend returns anomaly_reasons when anomaly detected
       if (data.status === "anomaly_detected") {
         const reasons = data.anomaly_reasons || data.anomalies || [];
         setAudioAlert(`🔊 ALERT: ${reasons.join(", ")}`);
-        console.log("⚠️ Audio anomaly detected:", reasons, payload);
+        console.log("⚠️ Audio anomaly detected:", reasons, { volumeLevel, peaks: peaks.length });
       } else {
         if (volumeLevel > 0.05) {
           setAudioAlert(`🎤 Monitoring (${(volumeLevel * 100).toFixed(0)}%)`);
@@ -603,7 +657,7 @@ export default function Exam() {
     } catch (error) {
       console.error("Audio analysis error:", error);
     }
-  }, [isAudioMonitoring, rollNumber]);
+  }, [isAudioMonitoring, rollNumber, examId]);
 
   // Server-Sent Events connection to receive real-time audio anomaly events from backend
   useEffect(() => {
@@ -613,7 +667,7 @@ export default function Exam() {
       if (eventSourceRef.current) {
         eventSourceRef.current.close();
       }
-      const es = new EventSource('http://localhost:5000/stream-audio-anomaly');
+      const es = new EventSource(`http://localhost:5000/stream-audio-anomaly?student_id=${encodeURIComponent(rollNumber)}`);
       eventSourceRef.current = es;
 
       es.onmessage = (e) => {
@@ -643,7 +697,7 @@ export default function Exam() {
         setTimeout(() => {
           if (!eventSourceRef.current && started && !submitted) {
             try {
-              eventSourceRef.current = new EventSource('http://localhost:5000/stream-audio-anomaly');
+              eventSourceRef.current = new EventSource(`http://localhost:5000/stream-audio-anomaly?student_id=${encodeURIComponent(rollNumber)}`);
             } catch (e) {}
           }
         }, 3000);
@@ -660,34 +714,42 @@ export default function Exam() {
     };
   }, [started, submitted, rollNumber]);
 
-  const sendFrameToBackend = useCallback((dataUrl) => {
-    fetch(dataUrl)
-      .then(res => res.blob())
-      .then(blob => {
-        const formData = new FormData();
-        formData.append('image', blob, 'frame.jpg');
-        fetch("http://localhost:5000/detect-head", {
-          method: "POST",
-          body: formData,
-        })
-        .then(res => res.json())
-        .then(data => {
-          setHeadAlert(data.direction);
-          if (data.direction.startsWith("ALERT")) {
-            const alertData = {
-              student_id: rollNumber,
-              direction: data.direction,
-              time: new Date().toLocaleTimeString()
-            };
-            fetch("http://localhost:5000/log-alert", {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify(alertData)
-            });
-          }
-        });
+  // Head-pose alerts are debounced and logged server-side (one per sustained episode)
+  const handleHeadPoseResult = useCallback((data) => {
+    if (!data.direction) return;
+    setHeadAlert(data.direction);
+  }, []);
+
+  // Upload one webcam frame for every analysis that is due; the backend decodes it once
+  const analyzeFrameDuringExam = useCallback(async (dataUrl, analyses) => {
+    try {
+      const blob = await fetch(dataUrl).then(res => res.blob());
+      const formData = new FormData();
+      formData.append("image", blob, "frame.jpg");
+      formData.append("analyses", analyses.join(","));
+      formData.append("roll_number", rollNumber);
+      formData.append("student_id", rollNumber);
+      formData.append("exam_id", examId);
+
+      const res = await fetch("http://localhost:5000/analyze-frame", {
+        method: "POST",
+        body: formData,
       });
-  }, [rollNumber]);
+      const data = await res.json();
+      if (data.next_interval_ms) {
+        captureIntervalsRef.current = { ...captureIntervalsRef.current, ...data.next_interval_ms };
+      }
+
+      if (data.head) handleHeadPoseResult(data.head);
+      if (data.face) handleFaceVerificationResult(data.face);
+      if (data.objects) handleObjectDetectionResult(data.objects);
+    } catch (error) {
+      console.error("Frame analysis error:", error);
+      if (analyses.includes("objects")) {
+        setObjectDetectionStatus("Detection error");
+      }
+    }
+  }, [rollNumber, examId, handleHeadPoseResult, handleFaceVerificationResult, handleObjectDetectionResult]);
 
   // Timer logic
   useEffect(() => {
@@ -702,47 +764,22 @@ export default function Exam() {
       }
   }, [timeLeft, submitted, handleSubmit]);
 
-  // Head movement detection logic
+  // Webcam analysis logic: head movement, face verification and object detection share one upload
   useEffect(() => {
       if (!started || submitted) return;
+      const nextDue = { head: 0, face: 0, objects: 0 };
       const interval = setInterval(() => {
-          if (webcamRef.current) {
-              const imageSrc = webcamRef.current.getScreenshot();
-              if (imageSrc) {
-                  sendFrameToBackend(imageSrc);
-              }
+          const now = Date.now();
+          const due = Object.keys(nextDue).filter(name => now >= nextDue[name]);
+          if (due.length === 0 || !webcamRef.current) return;
+          const imageSrc = webcamRef.current.getScreenshot();
+          if (imageSrc) {
+              due.forEach(name => { nextDue[name] = now + captureIntervalsRef.current[name]; });
+              analyzeFrameDuringExam(imageSrc, due);
           }
-      }, 2000);
+      }, 250);
       return () => clearInterval(interval);
-  }, [started, submitted, sendFrameToBackend]);
-
-  // Face verification logic (separate from head movement, less frequent)
-  useEffect(() => {
-      if (!started || submitted) return;
-      const interval = setInterval(() => {
-          if (webcamRef.current) {
-              const imageSrc = webcamRef.current.getScreenshot();
-              if (imageSrc) {
-                  verifyFaceDuringExam(imageSrc);
-              }
-          }
-      }, 2000); // Reduced from 3000ms to 2000ms for better face verification
-      return () => clearInterval(interval);
-  }, [started, submitted, verifyFaceDuringExam]);
-
-  // Object detection logic
-  useEffect(() => {
-      if (!started || submitted) return;
-      const interval = setInterval(() => {
-          if (webcamRef.current) {
-              const imageSrc = webcamRef.current.getScreenshot();
-              if (imageSrc) {
-                  detectObjectDuringExam(imageSrc);
-              }
-          }
-      }, 1500); // Reduced from 3000ms to 1500ms for faster object detection
-      return () => clearInterval(interval);
-  }, [started, submitted, detectObjectDuringExam]);
+  }, [started, submitted, analyzeFrameDuringExam]);
 
   // Audio monitoring logic
   useEffect(() => {
@@ -761,11 +798,19 @@ export default function Exam() {
   useEffect(() => {
       if (!started || submitted || !isAudioMonitoring) return;
       
-      const interval = setInterval(() => {
-          analyzeAudio();
-      }, 2000); // Analyze audio every 2 seconds
+      // Re-arm after each analysis using the backend's recommended audio interval
+      let timer = null;
+      let cancelled = false;
+      const tick = async () => {
+          await analyzeAudio();
+          if (!cancelled) timer = setTimeout(tick, captureIntervalsRef.current.audio);
+      };
+      timer = setTimeout(tick, captureIntervalsRef.current.audio);
       
-      return () => clearInterval(interval);
+      return () => {
+          cancelled = true;
+          clearTimeout(timer);
+      };
   }, [started, submitted, isAudioMonitoring, analyzeAudio]);
 
   // Timer logic
@@ -1,8 +1,11 @@
 import React, { useEffect, useState, useCallback } from "react";
 import { BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer, CartesianGrid, Legend, PieChart, Pie, Cell, LineChart, Line, Area, AreaChart } from 'recharts';
 
+const EXAM_ID = 'exam_2025_ai';
+
 export default function ProctorDashboard() {
-  const [alerts, setAlerts] = useState([]);
+  // Per-student alert rollups from /api/exam/<exam_id>/summary
+  const [summaryStudents, setSummaryStudents] = useState([]);
   const [ufmStudents, setUfmStudents] = useState([]);
   const [search, setSearch] = useState("");
   const [loading, setLoading] = useState(true);
@@ -25,20 +28,21 @@ export default function ProctorDashboard() {
       setLoading(true);
       setError(null);
 
-      // Fetch alerts
-      const alertsResponse = await fetch('http://localhost:5000/alerts');
-      const alertsData = await alertsResponse.json();
+      // Fetch the per-student alert summary (one rollup per student, not the raw alerts)
+      const summaryResponse = await fetch(`http://localhost:5000/api/exam/${EXAM_ID}/summary`);
+      const summary = await summaryResponse.json();
+      if (!summaryResponse.ok) throw new Error(summary.message || `Server returned ${summaryResponse.status}`);
 
       // Fetch UFM students
-      const ufmResponse = await fetch('http://localhost:5000/api/ufm/exam_2025_ai');
+      const ufmResponse = await fetch(`http://localhost:5000/api/ufm/${EXAM_ID}`);
       const ufmData = await ufmResponse.json();
 
-      setAlerts(Array.isArray(alertsData) ? alertsData : []);
+      setSummaryStudents(summary.students || []);
       setUfmStudents(ufmData.status === 'success' ? ufmData.ufm_students : []);
     } catch (error) {
       console.error('Error fetching data:', error);
       setError('Failed to load dashboard data. Please try again.');
-      setAlerts([]);
+      setSummaryStudents([]);
       setUfmStudents([]);
     } finally {
       setLoading(false);
@@ -58,7 +62,7 @@ export default function ProctorDashboard() {
         },
         body: JSON.stringify({
           student_id: studentId,
-          exam_id: 'exam_2025_ai',
+          exam_id: EXAM_ID,
           reason: reason || 'High alert frequency - marked by proctor',
           proctor_id: 'proctor_dashboard'
         })
@@ -67,8 +71,13 @@ export default function ProctorDashboard() {
       const data = await response.json();
 
       if (data.status === 'success') {
-        // Refresh data to update the display
+        // Refresh data to update the display. The mark is written behind, so it may not
+        // be listed yet; show it straight away instead of waiting for the next refresh.
         await fetchData();
+        setUfmStudents(prev => prev.some(ufm => ufm.student_id === studentId) ? prev : [
+          { student_id: studentId, exam_id: EXAM_ID, reason: reason || 'High alert frequency - marked by proctor', marked_at: new Date().toISOString(), status: 'marked' },
+          ...prev
+        ]);
         setShowUfmModal(false);
         setSelectedStudent(null);
         setUfmReason('');
@@ -90,7 +99,7 @@ export default function ProctorDashboard() {
 
     setIsResetting(true);
     try {
-      const payload = { exam_id: 'exam_2025_ai', include_legacy: true };
+      const payload = { exam_id: EXAM_ID, include_legacy: true };
       if (studentId) {
         payload.student_id = studentId;
       }
@@ -117,7 +126,6 @@ export default function ProctorDashboard() {
       console.log('Reset response data:', data);
 
       if (data.status === 'success') {
-        // Refresh data immediately to update the display
         await fetchData();
         setShowResetModal(false);
         setResetTarget(null);
@@ -141,45 +149,19 @@ export default function ProctorDashboard() {
     }
   };
 
-  // Transform array format to group by student and count different types of alerts
-  const alertCounts = [];
-
-  if (Array.isArray(alerts)) {
-    // Group alerts by student_id
-    const studentAlerts = {};
-    alerts.forEach(alert => {
-      const studentId = alert.student_id;
-      if (!studentAlerts[studentId]) {
-        studentAlerts[studentId] = [];
-      }
-      studentAlerts[studentId].push(alert);
-    });
-
-    // Count alerts for each student
-    Object.entries(studentAlerts).forEach(([student, logs]) => {
-      const alertLogs = logs.filter(a => a.direction.startsWith("ALERT"));
-      const counts = {
-        left: 0,
-        right: 0,
-        up: 0,
-        down: 0,
-        tilt: 0,
-        audio: 0,
-        total: alertLogs.length
-      };
-
-      alertLogs.forEach(alert => {
-        if (alert.direction.includes("Audio Anomaly")) counts.audio++;
-        else if (alert.direction.includes("Left")) counts.left++;
-        else if (alert.direction.includes("Right")) counts.right++;
-        else if (alert.direction.includes("Up")) counts.up++;
-        else if (alert.direction.includes("Down")) counts.down++;
-        else if (alert.direction.includes("Tilting")) counts.tilt++;
-      });
-
-      alertCounts.push({ student, counts });
-    });
-  }
+  // Alert counts per student and category, as rolled up by the backend
+  const alertCounts = summaryStudents.map(({ student_id, counts = {}, total = 0 }) => ({
+    student: student_id,
+    counts: {
+      left: counts.left || 0,
+      right: counts.right || 0,
+      up: counts.up || 0,
+      down: counts.down || 0,
+      tilt: counts.tilt || 0,
+      audio: counts.audio || 0,
+      total
+    }
+  }));
 
   // Check if student is marked for UFM
   const isStudentMarkedUfm = (studentId) => {
@@ -271,7 +253,7 @@ export default function ProctorDashboard() {
           <h4 style={{ color: '#dc3545', marginBottom: '20px' }}>Error Loading Dashboard</h4>
           <p style={{ color: '#6c757d', marginBottom: '30px' }}>{error}</p>
           <button
-            onClick={fetchData}
+            onClick={() => fetchData()}
             style={{
               backgroundColor: '#007bff',
               color: 'white',
@@ -353,7 +335,7 @@ export default function ProctorDashboard() {
                 🗑️ Reset All Data
               </button>
               <button
-                onClick={fetchData}
+                onClick={() => fetchData()}
                 style={{
                   backgroundColor: '#007bff',
                   color: 'white',
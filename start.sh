@@ -1,6 +1,9 @@
 #!/bin/bash
 
 # ---- Start Backend ----
+# Teacher sessions: sqlite (default, workers on one host), mongo (several hosts)
+# or memory (a single process) - see README_RUN.md
+export TEACHER_SESSION_BACKEND="${TEACHER_SESSION_BACKEND:-sqlite}"
 cd backend
 python app.py &    # runs backend in background
 
@@ -11,6 +11,9 @@ from pathlib import Path
 backend_path = Path(__file__).parent.parent.parent / 'backend'
 sys.path.insert(0, str(backend_path))
 
+# Load inference engines on first use instead of in the background for every test run
+os.environ.setdefault('ENGINE_LOADING', 'lazy')
+
 from app import app as flask_app, get_db_connection
 
 @pytest.fixture
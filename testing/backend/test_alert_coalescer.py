@@ -0,0 +1,67 @@
+"""
+AlertCoalescer: only consecutive repeats of one alert fold into a run document
+"""
+from datetime import datetime
+
+import pytest
+
+import app as backend
+
+
+class RecordingWriter:
+    """Stands in for the alert writer; keeps the queued run upserts"""
+    def __init__(self):
+        self.updates = []
+
+    def submit_update(self, collection_name, filter_doc, update, critical=False, upsert=False):
+        self.updates.append((collection_name, filter_doc, update, upsert))
+        return True
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writer = RecordingWriter()
+    monkeypatch.setattr(backend, 'alert_writer', writer)
+    return writer
+
+
+def head_alert(direction, student_id='s1'):
+    return {'student_id': student_id, 'exam_id': 'e1', 'direction': f'ALERT: {direction}', 'alert_time': datetime.now()}
+
+
+def record(coalescer, direction, student_id='s1'):
+    _, run_id = coalescer.record(head_alert(direction, student_id), ('head', direction))
+    return run_id
+
+
+def test_repeats_fold_into_one_run(writer):
+    coalescer = backend.AlertCoalescer(gap_s=30)
+    run_ids = {record(coalescer, 'Looking Left') for _ in range(5)}
+    assert len(run_ids) == 1
+    assert all(update[2]['$inc'] == {'count': 1} and update[3] for update in writer.updates)
+    assert coalescer.stats()['folded'] == 4
+
+
+def test_interleaved_types_start_new_runs(writer):
+    coalescer = backend.AlertCoalescer(gap_s=30)
+    left = record(coalescer, 'Looking Left')
+    right = record(coalescer, 'Looking Right')
+    left_again = record(coalescer, 'Looking Left')
+    assert len({left, right, left_again}) == 3
+    # A repeat right after the second Left still folds into that run
+    assert record(coalescer, 'Looking Left') == left_again
+    assert coalescer.stats()['runs_opened'] == 3
+
+
+def test_other_students_do_not_break_a_run(writer):
+    coalescer = backend.AlertCoalescer(gap_s=30)
+    first = record(coalescer, 'Looking Left')
+    record(coalescer, 'Looking Right', student_id='s2')
+    assert record(coalescer, 'Looking Left') == first
+
+
+def test_uncoalesced_alert_ends_the_run(writer):
+    coalescer = backend.AlertCoalescer(gap_s=30)
+    first = record(coalescer, 'Looking Left')
+    coalescer.interrupt(head_alert('Looking Down'))
+    assert record(coalescer, 'Looking Left') != first
@@ -0,0 +1,83 @@
+"""
+/alerts?since=: incremental refreshes must not skip writes that become visible out of order
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+mongomock = pytest.importorskip('mongomock')
+
+import app as backend
+
+
+@pytest.fixture
+def alerts_db():
+    return mongomock.MongoClient()['ai_proctor_test']
+
+
+def refresh(database, since, limit=100):
+    """One incremental refresh, following next_cursor; returns (alert ids, new since)"""
+    ids, cursor = [], None
+    while True:
+        args = {'exam_id': 'e1', 'since': since, 'limit': str(limit)}
+        if cursor:
+            args['cursor'] = cursor
+        result, status = backend.query_alerts(database, args)
+        assert status == 200
+        ids.extend(alert['id'] for alert in result['alerts'])
+        if not result['has_more']:
+            return ids, result['since']
+        since, cursor = result['since'], result['next_cursor']
+
+
+def alert_doc(**fields):
+    now = datetime.now()
+    return dict({'_id': ObjectId(), 'student_id': 's1', 'exam_id': 'e1', 'direction': 'ALERT: Looking Left',
+                 'alert_time': now, 'updated_at': now - timedelta(minutes=5), 'count': 1}, **fields)
+
+
+def test_run_update_landing_after_a_newer_insert_is_not_skipped(alerts_db):
+    run = alert_doc()
+    alerts_db.alerts.insert_one(run)
+    result, _ = backend.query_alerts(alerts_db, {'exam_id': 'e1'})
+    since = result['since']
+
+    # One writer batch: the insert and the run update share a stamp, and the reader
+    # polls between insert_many and bulk_write
+    inserted = {'collection': 'alerts', 'doc': alert_doc(direction='ALERT: Looking Right')}
+    update = {'collection': 'alerts', 'update': ({'_id': run['_id']}, {'$inc': {'count': 1}}, False)}
+    backend.stamp_updated_at([inserted, update])
+    alerts_db.alerts.insert_one(inserted['doc'])
+    ids, since = refresh(alerts_db, since)
+    assert ids == [str(inserted['doc']['_id'])]
+
+    alerts_db.alerts.update_one(*update['update'][:2])
+    ids, since = refresh(alerts_db, since)
+    # The insert comes again (merged by id); the run's older _id no longer hides its update
+    assert str(run['_id']) in ids
+
+
+def test_write_stamped_earlier_by_another_worker_is_not_skipped(alerts_db):
+    since = (datetime.now() - timedelta(minutes=1)).isoformat()
+    now = datetime.now()
+    alerts_db.alerts.insert_one(alert_doc(updated_at=now))
+    _, since = refresh(alerts_db, since)
+    # A worker whose clock runs 2s behind lands its write after that read
+    late = alert_doc(updated_at=now - timedelta(seconds=2))
+    alerts_db.alerts.insert_one(late)
+    ids, _ = refresh(alerts_db, since)
+    assert str(late['_id']) in ids
+
+
+def test_since_advances_once_changes_settle(alerts_db, monkeypatch):
+    since = (datetime.now() - timedelta(minutes=1)).isoformat()
+    docs = [alert_doc(updated_at=datetime.now()) for _ in range(5)]
+    alerts_db.alerts.insert_many(docs)
+    # More recent changes than one page holds: paging through them still ends
+    ids, since = refresh(alerts_db, since, limit=2)
+    assert sorted(ids) == sorted(str(doc['_id']) for doc in docs)
+    monkeypatch.setattr(backend, 'ALERTS_SINCE_LAG_S', 0)
+    ids, since = refresh(alerts_db, since, limit=2)
+    assert len(ids) == 5
+    assert refresh(alerts_db, since) == ([], since)
@@ -0,0 +1,167 @@
+"""
+AlertWriter: overflow policies, retries, write ordering and shutdown against a fake database
+"""
+import threading
+
+import pytest
+
+import app as backend
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    def insert_many(self, docs, ordered=True):
+        self.database.call(self.name, 'insert_many', [doc['n'] for doc in docs])
+
+    def bulk_write(self, requests, ordered=True):
+        self.database.call(self.name, 'bulk_write', len(requests))
+
+
+class FakeDatabase:
+    """Logs every write in order; failures[name] makes that many writes raise"""
+    def __init__(self):
+        self.log = []
+        self.failures = {}
+        self.on_write = None
+
+    def __getitem__(self, name):
+        return FakeCollection(self, name)
+
+    def __getattr__(self, name):
+        return FakeCollection(self, name)
+
+    def call(self, name, op, payload):
+        if self.on_write is not None:
+            self.on_write()
+        if self.failures.get(name):
+            self.failures[name] -= 1
+            raise ConnectionError('database unreachable')
+        self.log.append((name, op, payload))
+
+    def writes(self, name='alerts'):
+        return [(op, payload) for collection, op, payload in self.log if collection == name]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(backend, 'get_db_connection', lambda: database)
+    return database
+
+
+@pytest.fixture
+def make_writer(database):
+    writers = []
+
+    def make(**kwargs):
+        kwargs.setdefault('flush_ms', 20)
+        writer = backend.AlertWriter(**kwargs)
+        writers.append(writer)
+        return writer
+    yield make
+    for writer in writers:
+        writer.drain(timeout=2)
+
+
+def paused(writer, monkeypatch):
+    """Keep the worker from starting so entries stay queued"""
+    monkeypatch.setattr(writer, '_ensure_worker', lambda: None)
+    return writer
+
+
+def queued(writer):
+    return [entry['doc']['n'] for entry in writer._pending]
+
+
+def test_drop_newest_rejects_when_full(make_writer, monkeypatch):
+    writer = paused(make_writer(max_queue=2, overflow='drop_newest'), monkeypatch)
+    assert [writer.submit('alerts', {'n': n}) for n in range(3)] == [True, True, False]
+    assert queued(writer) == [0, 1]
+    assert writer.stats()['dropped_queue_full'] == 1
+
+
+def test_drop_oldest_evicts_head(make_writer, monkeypatch):
+    writer = paused(make_writer(max_queue=2, overflow='drop_oldest'), monkeypatch)
+    assert all(writer.submit('alerts', {'n': n}) for n in range(3))
+    assert queued(writer) == [1, 2]
+    assert writer.stats()['dropped_queue_full'] == 1
+
+
+def test_block_times_out_then_drops(make_writer, monkeypatch):
+    writer = paused(make_writer(max_queue=1, overflow='block', block_ms=20), monkeypatch)
+    assert writer.submit('alerts', {'n': 0})
+    assert not writer.submit('alerts', {'n': 1})
+    assert queued(writer) == [0]
+
+
+def test_block_waits_for_room(make_writer, monkeypatch):
+    writer = paused(make_writer(max_queue=1, overflow='block', block_ms=2000, flush_ms=0), monkeypatch)
+    writer.submit('alerts', {'n': 0})
+    threading.Timer(0.05, writer._next_batch).start()
+    assert writer.submit('alerts', {'n': 1})
+    assert queued(writer) == [1]
+
+
+def test_critical_bypasses_the_bound(make_writer, monkeypatch):
+    writer = paused(make_writer(max_queue=1, overflow='drop_newest'), monkeypatch)
+    writer.submit('alerts', {'n': 0})
+    assert writer.submit('alerts', {'n': 1}, critical=True)
+    assert queued(writer) == [0, 1]
+
+
+def test_inserts_land_before_updates_queued_after_them(make_writer, database):
+    writer = make_writer(flush_ms=100)
+    writer.submit('alerts', {'n': 0})
+    writer.submit_update('alerts', {'n': 0}, {'$inc': {'count': 1}})
+    writer.submit('alerts', {'n': 1})
+    assert writer.flush(timeout=2)
+    assert database.writes() == [('insert_many', [0, 1]), ('bulk_write', 1)]
+
+
+def test_failed_batches_are_retried_in_order(make_writer, database):
+    database.failures['alerts'] = 1
+    writer = make_writer()
+    for n in range(3):
+        writer.submit('alerts', {'n': n})
+    assert writer.flush(timeout=5)
+    assert database.writes() == [('insert_many', [0, 1, 2])]
+    stats = writer.stats()
+    assert stats['retries'] == 3 and stats['written'] == 3
+
+
+def test_gives_up_after_max_retries(make_writer, database):
+    database.failures['alerts'] = 10
+    writer = make_writer(max_retries=1)
+    writer.submit('alerts', {'n': 0})
+    assert writer.flush(timeout=5)
+    assert database.writes() == []
+    assert writer.stats()['dropped_write_failed'] == 1
+
+
+def test_drain_writes_what_the_worker_left(make_writer, database, monkeypatch):
+    writer = paused(make_writer(), monkeypatch)
+    for n in range(3):
+        writer.submit('alerts', {'n': n})
+    writer.drain(timeout=1)
+    assert database.writes() == [('insert_many', [0, 1, 2])]
+    assert writer.stats()['queue_depth'] == 0
+
+
+def test_submit_after_drain_writes_inline_without_the_lock(make_writer, database):
+    writer = make_writer()
+    writer.drain(timeout=1)
+    # stats() takes the writer's lock; it must not wait on an inline shutdown write
+    blocked = []
+
+    def check_lock():
+        reader = threading.Thread(target=writer.stats)
+        reader.start()
+        reader.join(1)
+        blocked.append(reader.is_alive())
+    database.on_write = check_lock
+    assert writer.submit('alerts', {'n': 0})
+    assert blocked and not any(blocked)
+    assert database.writes() == [('insert_many', [0])]
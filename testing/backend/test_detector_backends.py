@@ -0,0 +1,106 @@
+"""
+Parity tests: the ONNX Runtime and OpenCV DNN detector backends against the torch.hub path
+
+They skip unless the YOLOv5 hub model loads. Offline, point YOLOV5_REPO_DIR at a local
+copy of the hub repo (the `yolov5` pip package directory works) and set MODEL_OFFLINE=1;
+on torch >= 2.6 the bundled yolov5n.pt also needs TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD=1.
+"""
+import pytest
+import numpy as np
+import cv2
+from pathlib import Path
+
+pytest.importorskip('torch')
+pytest.importorskip('onnx')
+
+import app as backend
+
+WEIGHTS = Path(backend.__file__).parent / 'yolov5n.pt'
+# Low threshold so the synthetic frames still produce detections to compare
+PARITY_CONF = 0.05
+
+
+def make_frames():
+    """4:3 frames of different sizes in one batch, so letterboxing is exercised too (exact parity holds at 4:3 only)"""
+    rng = np.random.default_rng(0)
+    scene = np.full((480, 640, 3), 200, dtype=np.uint8)
+    cv2.rectangle(scene, (220, 140), (420, 420), (30, 30, 30), -1)
+    cv2.rectangle(scene, (250, 170), (390, 390), (90, 140, 200), -1)
+    cv2.circle(scene, (500, 120), 60, (180, 60, 40), -1)
+    noise = cv2.GaussianBlur(rng.integers(0, 255, (600, 800, 3), dtype=np.uint8), (15, 15), 5)
+    return [scene, noise, cv2.resize(scene, (320, 240))]
+
+
+@pytest.fixture(scope='module')
+def torch_detector():
+    try:
+        hub_model = backend.load_torch_yolo(str(WEIGHTS))
+    except Exception as e:
+        pytest.skip(f'YOLOv5 torch.hub model not available: {e}')
+    return backend.TorchDetector(hub_model, conf=PARITY_CONF)
+
+
+@pytest.fixture(scope='module')
+def onnx_path(torch_detector, tmp_path_factory):
+    path = tmp_path_factory.mktemp('detector') / 'yolov5n.onnx'
+    return backend.export_detector_onnx(str(WEIGHTS), str(path), hub_model=torch_detector.model)
+
+
+def assert_same_detections(expected, actual):
+    assert len(expected) == len(actual)
+    for want, got in zip(expected, actual):
+        assert want.shape == got.shape
+        np.testing.assert_array_equal(want[:, 5], got[:, 5])
+        np.testing.assert_allclose(want[:, 4], got[:, 4], atol=1e-3)
+        np.testing.assert_allclose(want[:, :4], got[:, :4], atol=1.0)
+
+
+def test_export_keeps_class_names(torch_detector, onnx_path):
+    assert backend.read_onnx_class_names(onnx_path) == torch_detector.names
+
+
+def test_onnxruntime_matches_torch(torch_detector, onnx_path):
+    pytest.importorskip('onnxruntime')
+    frames = make_frames()
+    detector = backend.OnnxRuntimeDetector(onnx_path, conf=PARITY_CONF)
+    assert_same_detections(torch_detector(frames), detector(frames))
+
+
+def test_onnxruntime_close_to_torch_on_widescreen(torch_detector, onnx_path):
+    pytest.importorskip('onnxruntime')
+    # The export is fixed at 4:3, so 16:9 frames get more padding than AutoShape adds:
+    # same detections, but scores and boxes only agree approximately
+    scene = make_frames()[0]
+    frames = [cv2.resize(scene, (1280, 720)), cv2.resize(scene, (640, 360))]
+    detector = backend.OnnxRuntimeDetector(onnx_path, conf=PARITY_CONF)
+    for want, got in zip(torch_detector(frames), detector(frames)):
+        assert want.shape == got.shape
+        np.testing.assert_array_equal(want[:, 5], got[:, 5])
+        np.testing.assert_allclose(want[:, 4], got[:, 4], atol=0.03)
+        np.testing.assert_allclose(want[:, :4], got[:, :4], atol=4.0)
+
+
+def test_opencv_dnn_matches_torch(torch_detector, tmp_path):
+    frames = make_frames()
+    path = backend.export_detector_onnx(str(WEIGHTS), str(tmp_path / 'yolov5n-b1.onnx'), hub_model=torch_detector.model, batch_size=1)
+    detector = backend.OpenCVDnnDetector(path, conf=PARITY_CONF)
+    assert_same_detections(torch_detector(frames), detector(frames))
+
+
+def test_int8_model_runs(torch_detector, onnx_path, tmp_path):
+    pytest.importorskip('onnxruntime')
+    # Quantization changes the scores, so only the output contract is checked
+    path = backend.export_detector_onnx(str(WEIGHTS), str(tmp_path / 'yolov5n.onnx'), int8=True, hub_model=torch_detector.model)
+    results = backend.OnnxRuntimeDetector(path)(make_frames())
+    assert len(results) == 3
+    assert all(result.ndim == 2 and result.shape[1] == 6 for result in results)
+    # Both files are written to a temporary name and moved into place
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['yolov5n-int8.onnx', 'yolov5n.onnx']
+
+
+def test_missing_onnx_model_is_not_exported_at_load(monkeypatch, tmp_path):
+    monkeypatch.setattr(backend, 'MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(backend, 'DETECTOR_ONNX_PATH', 'missing.onnx')
+    with pytest.raises(FileNotFoundError, match='export-detector --opencv'):
+        backend.load_detector('opencv')
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,135 @@
+"""
+HeadPoseTracker: hysteresis, minimum dwell and one alert per sustained episode
+"""
+import pytest
+
+import app as backend
+
+RIGHT = 'ALERT: Looking Right'
+FPS = 10
+
+
+class Sink:
+    """Stands in for record_alert, the alert writer and the event hub"""
+    def __init__(self):
+        self.opened = []
+        self.closed = []
+
+    def record_alert(self, doc, **kwargs):
+        self.opened.append(doc)
+
+    def submit_update(self, collection_name, filter_doc, update, critical=False, upsert=False):
+        self.closed.append((filter_doc['_id'], update['$set']))
+        return True
+
+    def publish(self, event_type, payload):
+        pass
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    sink = Sink()
+    monkeypatch.setattr(backend, 'record_alert', sink.record_alert)
+    monkeypatch.setattr(backend, 'alert_writer', sink)
+    monkeypatch.setattr(backend, 'event_hub', sink)
+    return sink
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+
+def tracker(**kwargs):
+    # Smoothing is effectively off so each test controls the classified angle directly
+    kwargs.setdefault('smoothing_s', 1e-3)
+    return backend.HeadPoseTracker(**kwargs)
+
+
+def feed(tracker, clock, yaw, seconds, pitch=0.0):
+    """Frames at FPS with a constant pose; returns the last result"""
+    result = None
+    for _ in range(int(round(seconds * FPS))):
+        result = tracker.update('s1', 'e1', None if yaw is None else (yaw, pitch, 0.0), now=clock.now)
+        clock.now += 1.0 / FPS
+    return result
+
+
+def test_glance_shorter_than_dwell_is_ignored(sink):
+    t, clock = tracker(min_dwell_s=3.0), Clock()
+    feed(t, clock, 0, 1)
+    result = feed(t, clock, 40, 2)
+    assert result['alert_state'] == backend.FORWARD_DIRECTION
+    assert feed(t, clock, 0, 5)['episode'] is None
+    assert sink.opened == [] and sink.closed == []
+
+
+def test_sustained_turn_is_one_backdated_episode(sink):
+    t, clock = tracker(min_dwell_s=3.0, release_s=1.0), Clock()
+    feed(t, clock, 0, 1)
+    turned_at = clock.now
+    result = feed(t, clock, 40, 10)
+    assert result['alert_state'] == RIGHT
+    assert len(sink.opened) == 1
+    assert sink.opened[0]['direction'] == RIGHT
+    assert sink.opened[0]['alert_time'].timestamp() == pytest.approx(turned_at)
+
+    back_at = clock.now
+    result = feed(t, clock, 0, 2)
+    assert result['alert_state'] == backend.FORWARD_DIRECTION and result['episode'] is None
+    assert len(sink.opened) == 1 and len(sink.closed) == 1
+    episode_id, fields = sink.closed[0]
+    assert episode_id == sink.opened[0]['_id']
+    assert fields['details.duration_s'] == pytest.approx(back_at - turned_at, abs=1e-3)
+    assert t.stats()['episodes_opened'] == t.stats()['episodes_closed'] == 1
+
+
+def test_flicker_across_threshold_does_not_commit(sink):
+    t, clock = tracker(min_dwell_s=1.0), Clock()
+    for _ in range(50):
+        feed(t, clock, 35, 0.5)
+        feed(t, clock, 0, 0.5)
+    assert sink.opened == []
+
+
+def test_hysteresis_holds_alert_inside_margin(sink):
+    t, clock = tracker(hysteresis_deg=5.0, min_dwell_s=1.0, release_s=1.0), Clock()
+    feed(t, clock, 40, 2)
+    # Back under the 30 degree threshold but not past 30 - 5
+    assert feed(t, clock, 27, 5)['alert_state'] == RIGHT
+    assert sink.closed == []
+    assert feed(t, clock, 20, 2)['alert_state'] == backend.FORWARD_DIRECTION
+    assert len(sink.opened) == len(sink.closed) == 1
+
+
+def test_without_hysteresis_the_same_pose_releases(sink):
+    t, clock = tracker(hysteresis_deg=0.0, min_dwell_s=1.0, release_s=1.0), Clock()
+    feed(t, clock, 40, 2)
+    assert feed(t, clock, 27, 2)['alert_state'] == backend.FORWARD_DIRECTION
+    assert len(sink.closed) == 1
+
+
+def test_new_direction_closes_the_previous_episode(sink):
+    t, clock = tracker(min_dwell_s=1.0), Clock()
+    feed(t, clock, 40, 2)
+    feed(t, clock, 0, 2, pitch=30)
+    assert [doc['direction'] for doc in sink.opened] == [RIGHT, 'ALERT: Looking Down']
+    assert len(sink.closed) == 1
+
+
+def test_missing_face_is_its_own_episode(sink):
+    t, clock = tracker(min_dwell_s=1.0), Clock()
+    feed(t, clock, 0, 1)
+    assert feed(t, clock, None, 2)['alert_state'] == backend.NO_FACE_DIRECTION
+    assert [doc['direction'] for doc in sink.opened] == [backend.NO_FACE_DIRECTION]
+
+
+def test_stale_student_episode_closes_at_last_frame(sink):
+    t, clock = tracker(min_dwell_s=1.0, stale_s=30.0), Clock()
+    feed(t, clock, 40, 3)
+    last_frame = clock.now - 1.0 / FPS
+    clock.now += 60
+    result = feed(t, clock, 0, 0.1)
+    assert result['alert_state'] == backend.FORWARD_DIRECTION
+    _, fields = sink.closed[0]
+    assert fields['details.ended_at'] == backend.datetime.fromtimestamp(last_frame).isoformat()